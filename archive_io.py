@@ -0,0 +1,137 @@
+import os
+import tarfile
+import zipfile
+import threading
+from collections import deque
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+class ArchiveReader:
+    """不解压到磁盘，直接读取zip/tar压缩包中的图片
+
+    zip从中央目录列出成员，成员数据在工作线程中按需读取；tar只能顺序读取，
+    由后台线程边解压边预读，预读的数据量不超过readahead_bytes（至少保留一个成员）。
+    迭代产出 (成员名, load)，调用load()得到成员的bytes。超过max_member_bytes的成员被跳过。
+    """
+    def __init__(self, path, extensions, readahead_bytes=64 * 1024 * 1024, max_member_bytes=200 * 1024 * 1024):
+        self.path = path
+        self.extensions = extensions
+        self.readahead_bytes = readahead_bytes
+        self.max_member_bytes = max_member_bytes
+        self.zip = None
+        self.members = None
+        self.skipped = []
+        self.buffer = deque()
+        self.buffered_bytes = 0
+        self.condition = threading.Condition()
+        self.closed = False
+        self.reader_thread = None
+        if zipfile.is_zipfile(path):
+            self.zip = zipfile.ZipFile(path)
+            self.members = []
+            for info in self.zip.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(extensions):
+                    continue
+                if info.file_size > max_member_bytes:
+                    self.skipped.append(info.filename)
+                    continue
+                self.members.append(info)
+
+    def count(self):
+        """成员数量，tar需要读完才知道，返回None"""
+        return len(self.members) if self.members is not None else None
+
+    def __iter__(self):
+        if self.zip is not None:
+            for info in self.members:
+                if self.closed:
+                    return
+                yield info.filename, lambda info=info: self.zip.read(info)
+            return
+
+        self.reader_thread = threading.Thread(target=self._read_tar, daemon=True)
+        self.reader_thread.start()
+        while True:
+            with self.condition:
+                while not self.buffer:
+                    self.condition.wait()
+                item = self.buffer.popleft()
+                if item is None or isinstance(item, BaseException):
+                    if isinstance(item, BaseException):
+                        raise item
+                    return
+                name, data = item
+                self.buffered_bytes -= len(data)
+                self.condition.notify_all()
+            yield name, lambda data=data: data
+
+    def _put(self, item, size=0):
+        with self.condition:
+            while self.buffer and self.buffered_bytes + size > self.readahead_bytes and not self.closed:
+                self.condition.wait()
+            self.buffer.append(item)
+            self.buffered_bytes += size
+            self.condition.notify_all()
+
+    def _read_tar(self):
+        """后台顺序解压tar成员到有界缓冲区"""
+        try:
+            with tarfile.open(self.path, mode='r|*') as tar:
+                for member in tar:
+                    if self.closed:
+                        break
+                    if not member.isfile() or not member.name.lower().endswith(self.extensions):
+                        continue
+                    if member.size > self.max_member_bytes:
+                        self.skipped.append(member.name)
+                        continue
+                    data = tar.extractfile(member).read()
+                    self._put((member.name, data), len(data))
+            self._put(None)
+        except BaseException as e:
+            self._put(e)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.buffer.clear()
+            self.buffered_bytes = 0
+            self.condition.notify_all()
+        if self.zip is not None:
+            self.zip.close()
+
+
+class ArchiveOutput:
+    """按类别把图片写入输出压缩包（<类别>.zip，不再压缩），压缩包内重名时追加序号"""
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.lock = threading.Lock()
+        self.archives = {}  # 类别 -> (ZipFile, 已有成员名集合)
+
+    def add(self, category, name, data):
+        """写入一张图片，返回 <压缩包路径>/<成员名>"""
+        with self.lock:
+            if category not in self.archives:
+                archive = zipfile.ZipFile(os.path.join(self.output_dir, f"{category}.zip"), 'a')
+                self.archives[category] = (archive, set(archive.namelist()))
+            archive, names = self.archives[category]
+            base, ext = os.path.splitext(name)
+            candidate = name
+            suffix = 1
+            while candidate in names:
+                candidate = f"{base}_{suffix}{ext}"
+                suffix += 1
+            archive.writestr(candidate, data, compress_type=zipfile.ZIP_STORED)
+            names.add(candidate)
+        return os.path.join(archive.filename, candidate)
+
+    def close(self):
+        with self.lock:
+            for archive, _ in self.archives.values():
+                archive.close()
+            self.archives = {}
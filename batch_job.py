@@ -0,0 +1,112 @@
+import os
+import json
+import time
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+class BatchFileWriter:
+    """逐行写入OpenAI兼容批处理格式的JSONL请求文件
+
+    超过单个批次的请求数或文件大小上限时自动切换到下一个文件。
+    """
+    def __init__(self, directory, prefix='batch', max_requests=50000, max_bytes=190 * 1024 * 1024):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.paths = []
+        self.file = None
+        self.count = 0
+        self.size = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _open_next(self):
+        self.close()
+        path = os.path.join(self.directory, f"{self.prefix}_{len(self.paths):03d}.jsonl")
+        self.paths.append(path)
+        self.file = open(path, 'wb')
+        self.count = 0
+        self.size = 0
+
+    def add(self, custom_id, model, messages):
+        """写入一个请求"""
+        line = json.dumps({
+            'custom_id': custom_id,
+            'method': 'POST',
+            'url': BATCH_ENDPOINT,
+            'body': {'model': model, 'messages': messages},
+        }, ensure_ascii=False).encode('utf-8') + b'\n'
+        if (self.file is None or self.count >= self.max_requests or
+                (self.count and self.size + len(line) > self.max_bytes)):
+            self._open_next()
+        self.file.write(line)
+        self.count += 1
+        self.size += len(line)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class BatchJob:
+    """通过OpenAI兼容的 Files + Batches 接口提交批处理文件、轮询状态并读取结果"""
+    def __init__(self, client, poll_interval=60.0, completion_window='24h'):
+        self.client = client
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+
+    def submit(self, path):
+        """上传请求文件并创建批处理任务，返回批处理ID"""
+        with open(path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose='batch')
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=self.completion_window
+        )
+        return batch.id
+
+    def wait(self, batch_id, cancel_token=None):
+        """轮询直到批处理结束，返回最终的批处理对象"""
+        last_status = None
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            counts = batch.request_counts
+            status = batch.status
+            if counts is not None:
+                status = f"{batch.status} ({counts.completed + counts.failed}/{counts.total})"
+            if status != last_status:
+                print(f"批处理 {batch_id}: {status}")
+                last_status = status
+            if batch.status in FINAL_STATUSES:
+                return batch
+            if cancel_token is not None:
+                if cancel_token.wait(self.poll_interval):
+                    cancel_token.raise_if_cancelled()
+            else:
+                time.sleep(self.poll_interval)
+
+    def _read_file(self, file_id):
+        if not file_id:
+            return []
+        content = self.client.files.content(file_id)
+        return [line for line in content.text.splitlines() if line.strip()]
+
+    def results(self, batch):
+        """逐条返回 (custom_id, 响应文本, 错误信息, token用量字典)，响应文本和错误信息二者之一为None"""
+        for line in self._read_file(batch.output_file_id) + self._read_file(batch.error_file_id):
+            item = json.loads(line)
+            custom_id = item.get('custom_id')
+            response = item.get('response') or {}
+            body = response.get('body') or {}
+            if item.get('error') or response.get('status_code') != 200:
+                error = item.get('error') or body.get('error') or f"HTTP {response.get('status_code')}"
+                yield custom_id, None, json.dumps(error, ensure_ascii=False) if not isinstance(error, str) else error, None
+                continue
+            try:
+                yield custom_id, body['choices'][0]['message']['content'], None, body.get('usage')
+            except (KeyError, IndexError, TypeError):
+                yield custom_id, None, "响应格式无效", None
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+请求载荷内存基准 - 使用tracemalloc统计每张图片构建请求消息时的内存分配峰值
+
+用法: python benchmark_payload.py [图片路径 ...]
+不传入图片时会生成一张4000x3000的测试图片。
+"""
+
+import os
+import sys
+import json
+import base64
+import tempfile
+import tracemalloc
+from PIL import Image
+from image_classifier import ImageClassifier, build_data_url
+
+
+def legacy_messages(jpeg_data, prompt):
+    """旧实现：bytes -> base64 bytes -> str -> f-string"""
+    base64_image = base64.b64encode(bytes(jpeg_data)).decode('utf-8')
+    return [{"role": "user", "content": [
+        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}},
+        {"type": "text", "text": prompt}
+    ]}]
+
+
+def measure(func):
+    """返回 (函数执行期间的内存分配峰值, 结果)"""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = func()
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return peak, result
+
+
+def main():
+    image_paths = sys.argv[1:]
+    if not image_paths:
+        path = os.path.join(tempfile.mkdtemp(), 'benchmark.png')
+        Image.effect_noise((4000, 3000), 64).convert('RGB').save(path)
+        image_paths = [path]
+
+    classifier = ImageClassifier(api_base_url='http://localhost', api_key='benchmark',
+                                 classification_prompt='benchmark')
+    # 以较大的目标尺寸放大编码阶段的差异
+    classifier.max_image_size = (4096, 4096)
+
+    print(f"{'图片':<24}{'JPEG':>9}{'构建(旧)':>11}{'构建(新)':>11}{'+JSON(旧)':>12}{'+JSON(新)':>12}{'完整路径':>11}")
+    for image_path in image_paths:
+        with classifier.open_image_data(image_path) as data:
+            jpeg_data = bytes(data)
+        prompt = classifier.classification_prompt
+
+        legacy_build, _ = measure(lambda: legacy_messages(jpeg_data, prompt))
+        new_build, _ = measure(lambda: classifier.build_messages(build_data_url(jpeg_data)))
+        # 加上客户端的JSON序列化，模拟完整的请求体构建
+        legacy_json, _ = measure(lambda: json.dumps(legacy_messages(jpeg_data, prompt)))
+        new_json, _ = measure(
+            lambda: json.dumps(classifier.build_messages(build_data_url(jpeg_data)))
+        )
+        # 预处理 + 编码 + 序列化
+        full, _ = measure(
+            lambda: json.dumps(classifier.build_messages(classifier.encode_image_url(image_path)))
+        )
+        row = [len(jpeg_data), legacy_build, new_build, legacy_json, new_json, full]
+        print(f"{os.path.basename(image_path):<24}" + "".join(f"{value / 1e6:>9.1f}MB" for value in row))
+
+if __name__ == "__main__":
+    main()
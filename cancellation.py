@@ -0,0 +1,62 @@
+import threading
+from threading import Lock
+
+
+class ClassificationCancelled(Exception):
+    """分类任务已被取消"""
+
+
+class CancellationToken:
+    """协作式取消令牌
+
+    处理流程在关键节点检查令牌；正在进行的操作可以注册回调（如关闭流式响应），
+    在取消时立即被调用以中止阻塞中的请求。
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = Lock()
+        self._callbacks = {}
+        self._next_handle = 0
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        """触发取消并调用所有已注册的回调"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"取消回调执行出错: {str(e)}")
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise ClassificationCancelled()
+
+    def register(self, callback):
+        """注册取消回调，返回用于注销的句柄；已取消时立即调用"""
+        with self._lock:
+            if not self._event.is_set():
+                handle = self._next_handle
+                self._next_handle += 1
+                self._callbacks[handle] = callback
+                return handle
+        callback()
+        return None
+
+    def unregister(self, handle):
+        if handle is None:
+            return
+        with self._lock:
+            self._callbacks.pop(handle, None)
+
+    def wait(self, timeout=None):
+        """等待取消，返回是否已取消"""
+        return self._event.wait(timeout)
@@ -0,0 +1,221 @@
+import os
+import time
+import sqlite3
+import hashlib
+from threading import Lock
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """分块计算文件的SHA-1摘要"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def data_hash(data):
+    """计算内存中数据的SHA-1摘要，与file_hash的结果一致"""
+    return hashlib.sha1(data).hexdigest()
+
+
+USAGE_COLUMNS = (
+    ('prompt_tokens', 'INTEGER'), ('completion_tokens', 'INTEGER'), ('cached_tokens', 'INTEGER'),
+    ('image_tokens', 'INTEGER'), ('cost', 'REAL'),
+)
+
+
+class ClassificationIndex:
+    """分类结果的SQLite索引
+
+    使用WAL模式，写入先进入内存缓冲区，累计到batch_size条或超过flush_interval秒后批量提交，
+    查询前会先刷新缓冲区。按类别+时间、哈希和路径建立索引，统计和图库查询无需扫描输出目录。
+    """
+    def __init__(self, db_path, batch_size=50, flush_interval=2.0):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = Lock()
+        self.pending = []
+        self.last_flush = time.monotonic()
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+    def _create_schema(self):
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS classifications (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    source_path TEXT NOT NULL,
+                    output_path TEXT,
+                    file_hash TEXT,
+                    file_size INTEGER,
+                    category TEXT NOT NULL,
+                    raw_response TEXT,
+                    model TEXT,
+                    latency REAL,
+                    classified_at REAL NOT NULL
+                )
+            """)
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_category_time ON classifications (category, classified_at)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_time ON classifications (classified_at)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_hash ON classifications (file_hash)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_output_path ON classifications (output_path)"
+            )
+            # 每张图片的token用量和费用（旧数据库补充字段）
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(classifications)")}
+            for column, column_type in USAGE_COLUMNS:
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE classifications ADD COLUMN {column} {column_type}")
+            # 图片描述（按文件内容哈希保存），类别变化时可在本地重新归类
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS captions (
+                    file_hash TEXT PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    model TEXT,
+                    created_at REAL NOT NULL
+                )
+            """)
+
+    def add(self, source_path, category, output_path=None, file_hash=None, file_size=None,
+            raw_response=None, model=None, latency=None, classified_at=None, usage=None):
+        """添加一条分类记录（缓冲写入），usage为该图片的token用量字典（prompt/completion/cached/image/cost）"""
+        usage = usage or {}
+        record = (
+            source_path, output_path, file_hash, file_size, category,
+            raw_response, model, latency,
+            classified_at if classified_at is not None else time.time(),
+            usage.get('prompt'), usage.get('completion'), usage.get('cached'), usage.get('image'), usage.get('cost')
+        )
+        with self.lock:
+            self.pending.append(record)
+            if (len(self.pending) >= self.batch_size or
+                    time.monotonic() - self.last_flush >= self.flush_interval):
+                self._flush_locked()
+
+    def _flush_locked(self):
+        if self.pending:
+            with self.conn:
+                self.conn.executemany("""
+                    INSERT INTO classifications (
+                        source_path, output_path, file_hash, file_size, category,
+                        raw_response, model, latency, classified_at,
+                        prompt_tokens, completion_tokens, cached_tokens, image_tokens, cost
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, self.pending)
+            self.pending = []
+        self.last_flush = time.monotonic()
+
+    def flush(self):
+        """提交缓冲区中的所有记录"""
+        with self.lock:
+            self._flush_locked()
+
+    def query(self, category=None, since=None, until=None, model=None, limit=None):
+        """按类别、时间范围（Unix时间戳）和模型查询记录，按时间倒序返回字典列表"""
+        conditions = []
+        params = []
+        if category is not None:
+            conditions.append("category = ?")
+            params.append(category)
+        if since is not None:
+            conditions.append("classified_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("classified_at < ?")
+            params.append(until)
+        if model is not None:
+            conditions.append("model = ?")
+            params.append(model)
+
+        sql = "SELECT * FROM classifications"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY classified_at DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+
+        with self.lock:
+            self._flush_locked()
+            rows = self.conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def find_by_hash(self, file_hash):
+        """返回指定文件哈希最近一次的分类记录，不存在时返回None"""
+        with self.lock:
+            self._flush_locked()
+            row = self.conn.execute(
+                "SELECT * FROM classifications WHERE file_hash = ? ORDER BY classified_at DESC LIMIT 1",
+                (file_hash,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def category_counts(self, since=None):
+        """返回各类别的记录数"""
+        sql = "SELECT category, COUNT(*) AS count FROM classifications"
+        params = []
+        if since is not None:
+            sql += " WHERE classified_at >= ?"
+            params.append(since)
+        sql += " GROUP BY category"
+        with self.lock:
+            self._flush_locked()
+            rows = self.conn.execute(sql, params).fetchall()
+        return {row['category']: row['count'] for row in rows}
+
+    def move_outputs(self, moved):
+        """输出文件移动后更新记录中的输出路径，moved为 {旧路径: 新路径}"""
+        with self.lock:
+            self._flush_locked()
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE classifications SET output_path = ? WHERE output_path = ?",
+                    [(os.path.abspath(new), os.path.abspath(old)) for old, new in moved.items()]
+                )
+
+    def set_output_paths(self, placed):
+        """为虚拟整理时没有输出路径的记录补上输出路径，placed为 {来源路径: 输出路径}"""
+        with self.lock:
+            self._flush_locked()
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE classifications SET output_path = ? WHERE source_path = ? AND output_path IS NULL",
+                    [(os.path.abspath(output), os.path.abspath(source)) for source, output in placed.items()]
+                )
+
+    def set_caption(self, file_hash, description, model=None):
+        """保存图片描述，同一哈希已有描述时覆盖"""
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO captions (file_hash, description, model, created_at) VALUES (?, ?, ?, ?)",
+                    (file_hash, description, model, time.time())
+                )
+
+    def get_caption(self, file_hash):
+        """返回指定文件哈希的描述记录，不存在时返回None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT * FROM captions WHERE file_hash = ?", (file_hash,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def close(self):
+        """提交剩余记录并关闭数据库"""
+        with self.lock:
+            self._flush_locked()
+            self.conn.close()
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+from collections import deque
+from threading import Lock
+
+
+class ClassificationStats:
+    """由分类事件驱动的实时统计
+
+    每个事件O(1)更新：本次运行的各类别数量、错误数、处理字节数、吞吐量和预计剩余时间，
+    以及跨会话累计的总数（定期持久化到JSON文件，启动时直接读取，无需扫描输出目录）。
+    """
+    def __init__(self, path=None, save_interval=5.0, window=50):
+        self.path = path
+        self.save_interval = save_interval
+        self.lock = Lock()
+        self.completions = deque(maxlen=window)  # 最近完成时间，用于计算吞吐量
+        self.last_save = time.monotonic()
+
+        self.lifetime = {'counts': {}, 'total': 0, 'errors': 0, 'bytes': 0, 'tokens': empty_tokens()}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.lifetime.update(json.load(f))
+                # 兼容旧版本统计文件中缺少的token字段
+                self.lifetime['tokens'] = dict(empty_tokens(), **self.lifetime['tokens'])
+            except Exception as e:
+                print(f"读取统计文件时出错: {str(e)}")
+        self.start_run(0)
+
+    def start_run(self, total, categories=()):
+        """开始新一轮处理，total为待处理图片数"""
+        with self.lock:
+            self.run_total = total
+            self.run_done = 0
+            self.run_errors = 0
+            self.run_bytes = 0
+            self.run_counts = {category: 0 for category in categories}
+            self.run_tokens = empty_tokens()
+            self.run_start = time.monotonic()
+            self.completions.clear()
+
+    def add_total(self, count=1):
+        """增量模式下追加待处理数量"""
+        with self.lock:
+            self.run_total += count
+
+    def record(self, category, size=0, error=False):
+        """记录一张图片处理完成"""
+        with self.lock:
+            now = time.monotonic()
+            self.completions.append(now)
+            self.run_done += 1
+            self.run_bytes += size
+            self.lifetime['total'] += 1
+            self.lifetime['bytes'] += size
+            if error:
+                self.run_errors += 1
+                self.lifetime['errors'] += 1
+            if category is not None:
+                self.run_counts[category] = self.run_counts.get(category, 0) + 1
+                counts = self.lifetime['counts']
+                counts[category] = counts.get(category, 0) + 1
+            if self.path and now - self.last_save >= self.save_interval:
+                self._save_locked()
+
+    def record_usage(self, prompt_tokens=0, completion_tokens=0, cached_tokens=0, image_tokens=0, cost=0.0):
+        """记录一次API请求的token用量和费用
+
+        cached_tokens为命中提示词缓存的输入token数，image_tokens为输入中图片占用的token数（服务端返回时）
+        """
+        with self.lock:
+            for tokens in (self.run_tokens, self.lifetime['tokens']):
+                tokens['requests'] += 1
+                tokens['prompt'] += prompt_tokens
+                tokens['completion'] += completion_tokens
+                tokens['cached'] += cached_tokens
+                tokens['image'] += image_tokens
+                tokens['cost'] += cost
+
+    def throughput(self):
+        """最近窗口内的处理速度（张/秒）"""
+        with self.lock:
+            return self._throughput_locked()
+
+    def _throughput_locked(self):
+        if len(self.completions) >= 2:
+            span = self.completions[-1] - self.completions[0]
+            if span > 0:
+                return (len(self.completions) - 1) / span
+        elapsed = time.monotonic() - self.run_start
+        return self.run_done / elapsed if elapsed > 0 and self.run_done else 0.0
+
+    def snapshot(self):
+        """返回当前统计的副本"""
+        with self.lock:
+            rate = self._throughput_locked()
+            remaining = max(self.run_total - self.run_done, 0)
+            return {
+                'total': self.run_total,
+                'done': self.run_done,
+                'errors': self.run_errors,
+                'bytes': self.run_bytes,
+                'counts': dict(self.run_counts),
+                'tokens': dict(self.run_tokens),
+                'elapsed': time.monotonic() - self.run_start,
+                'throughput': rate,
+                'eta': remaining / rate if rate > 0 else None,
+                'lifetime': {
+                    'counts': dict(self.lifetime['counts']),
+                    'total': self.lifetime['total'],
+                    'errors': self.lifetime['errors'],
+                    'bytes': self.lifetime['bytes'],
+                    'tokens': dict(self.lifetime['tokens']),
+                },
+            }
+
+    def _save_locked(self):
+        self.last_save = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.lifetime, f, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            print(f"保存统计文件时出错: {str(e)}")
+
+    def save(self):
+        """立即持久化累计统计"""
+        if self.path:
+            with self.lock:
+                self._save_locked()
+
+
+def empty_tokens():
+    return {'requests': 0, 'prompt': 0, 'completion': 0, 'cached': 0, 'image': 0, 'cost': 0.0}
+
+
+def format_duration(seconds):
+    """把秒数格式化为 时:分:秒"""
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
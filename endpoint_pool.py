@@ -0,0 +1,258 @@
+import json
+import threading
+import time
+from threading import Lock
+from openai import OpenAI, APIStatusError, BadRequestError, UnprocessableEntityError
+from cancellation import ClassificationCancelled
+
+# 只与请求内容有关的错误（400无效请求、413图片过大、422无法处理），换端点也无济于事，直接抛出且不计入熔断。
+# 其余错误都算端点故障并切换端点：连接错误和超时、429限流、5xx，以及各端点独立的密钥失效（401/403）、
+# 模型不存在（404）等
+PAYLOAD_ERRORS = (BadRequestError, UnprocessableEntityError)
+
+
+def is_payload_error(error):
+    """错误是否由请求内容本身引起"""
+    if isinstance(error, PAYLOAD_ERRORS):
+        return True
+    return isinstance(error, APIStatusError) and getattr(error, 'status_code', None) == 413
+
+
+class Endpoint:
+    """单个OpenAI兼容的VLM端点及其运行统计"""
+    def __init__(self, api_base_url, api_key, model_name, weight=1.0, name=None):
+        self.api_base_url = api_base_url
+        self.api_key = api_key
+        self.model_name = model_name
+        self.weight = max(float(weight), 0.01)
+        self.name = name or f"{model_name}@{api_base_url}"
+        self.client = OpenAI(api_key=api_key, base_url=api_base_url)
+
+        # 运行统计
+        self.outstanding = 0  # 正在进行的请求数
+        self.requests = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.total_latency = 0.0
+        self.ewma_latency = None  # 指数加权平均延迟（秒）
+
+        # 熔断状态
+        self.consecutive_failures = 0
+        self.open_until = 0.0  # 熔断结束时间，0表示未熔断
+        self.half_open_trial = False  # 半开状态下是否已有试探请求
+
+    def reset_client(self):
+        """关闭当前客户端（使其上阻塞中的请求尽快返回）并换用新客户端"""
+        client, self.client = self.client, OpenAI(api_key=self.api_key, base_url=self.api_base_url)
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        """返回端点统计信息"""
+        successes = self.requests - self.errors - self.cancelled
+        return {
+            'name': self.name,
+            'weight': self.weight,
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'errors': self.errors,
+            'cancelled': self.cancelled,
+            'avg_latency': self.total_latency / successes if successes else None,
+            'ewma_latency': self.ewma_latency,
+            'circuit_open': self.open_until > time.monotonic(),
+        }
+
+
+class EndpointPool:
+    """多端点负载均衡与故障转移
+
+    按 (进行中请求数 + 1) / 权重 选择负载最小的端点，连续失败达到阈值后熔断，
+    冷却结束后进入半开状态放行一个试探请求，成功则恢复。
+    """
+    def __init__(self, endpoints, failure_threshold=3, cooldown=30.0,
+                 health_check_interval=0, latency_alpha=0.2):
+        if not endpoints:
+            raise ValueError("端点列表不能为空")
+        self.endpoints = list(endpoints)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.latency_alpha = latency_alpha
+        self.lock = Lock()
+
+        self._health_thread = None
+        self._health_stop = threading.Event()
+        if health_check_interval and health_check_interval > 0:
+            self.start_health_checks(health_check_interval)
+
+    @classmethod
+    def from_config(cls, config, default_model=None, **kwargs):
+        """从端点配置列表（或其JSON字符串）创建端点池
+
+        每项包含 api_base_url、api_key，可选 model_name、weight、name
+        """
+        if isinstance(config, str):
+            config = json.loads(config)
+        endpoints = [
+            Endpoint(
+                api_base_url=item['api_base_url'],
+                api_key=item['api_key'],
+                model_name=item.get('model_name') or default_model,
+                weight=item.get('weight', 1.0),
+                name=item.get('name')
+            )
+            for item in config
+        ]
+        return cls(endpoints, **kwargs)
+
+    def _is_available(self, endpoint, now):
+        """端点是否可接收请求（未熔断，或处于半开状态且尚无试探请求）"""
+        if endpoint.open_until == 0.0:
+            return True
+        if endpoint.open_until > now:
+            return False
+        return not endpoint.half_open_trial
+
+    def acquire(self, exclude=()):
+        """选择负载最小的可用端点并占用一个请求名额"""
+        with self.lock:
+            now = time.monotonic()
+            candidates = [
+                ep for ep in self.endpoints
+                if ep not in exclude and self._is_available(ep, now)
+            ]
+            if not candidates:
+                return None
+            endpoint = min(
+                candidates,
+                key=lambda ep: ((ep.outstanding + 1) / ep.weight,
+                                ep.ewma_latency if ep.ewma_latency is not None else 0.0)
+            )
+            if endpoint.open_until:
+                endpoint.half_open_trial = True
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint, latency, success, fault=True):
+        """归还请求名额并记录结果
+
+        success为None表示请求被取消；失败时fault为False表示错误由请求内容引起，只计入错误数，不影响熔断。
+        """
+        with self.lock:
+            endpoint.outstanding -= 1
+            if success is None:
+                endpoint.cancelled += 1
+                endpoint.half_open_trial = False
+            elif not success and not fault:
+                endpoint.errors += 1
+                endpoint.half_open_trial = False
+            elif success:
+                endpoint.total_latency += latency
+                if endpoint.ewma_latency is None:
+                    endpoint.ewma_latency = latency
+                else:
+                    endpoint.ewma_latency += self.latency_alpha * (latency - endpoint.ewma_latency)
+                self._close_circuit(endpoint)
+            else:
+                endpoint.errors += 1
+                endpoint.consecutive_failures += 1
+                if endpoint.open_until or endpoint.consecutive_failures >= self.failure_threshold:
+                    self._open_circuit(endpoint)
+
+    def _open_circuit(self, endpoint):
+        endpoint.open_until = time.monotonic() + self.cooldown
+        endpoint.half_open_trial = False
+
+    def _close_circuit(self, endpoint):
+        endpoint.consecutive_failures = 0
+        endpoint.open_until = 0.0
+        endpoint.half_open_trial = False
+
+    def call(self, func):
+        """在端点上执行 func(endpoint)，端点故障（请求内容引起的错误以外的错误，见PAYLOAD_ERRORS）时自动切换到其他端点"""
+        tried = []
+        last_error = None
+        while len(tried) < len(self.endpoints):
+            endpoint = self.acquire(exclude=tried)
+            if endpoint is None:
+                break
+            tried.append(endpoint)
+            start = time.monotonic()
+            try:
+                result = func(endpoint)
+            except ClassificationCancelled:
+                self.release(endpoint, time.monotonic() - start, None)
+                raise
+            except Exception as e:
+                if is_payload_error(e):
+                    # 请求本身的错误不算端点故障，也不再切换到其他端点
+                    self.release(endpoint, time.monotonic() - start, False, fault=False)
+                    raise
+                self.release(endpoint, time.monotonic() - start, False)
+                print(f"端点 {endpoint.name} 请求失败: {str(e)}")
+                last_error = e
+                continue
+            except BaseException:
+                self.release(endpoint, time.monotonic() - start, None)
+                raise
+            self.release(endpoint, time.monotonic() - start, True)
+            return result
+
+        if last_error is not None:
+            raise last_error
+        raise RuntimeError("没有可用的API端点（全部处于熔断状态）")
+
+    def reset_clients(self):
+        """关闭所有端点的客户端并换用新客户端，用于取消时中止进行中的非流式请求"""
+        for endpoint in self.endpoints:
+            endpoint.reset_client()
+
+    def check_health(self):
+        """主动探测所有端点，恢复可用端点、熔断不可用端点"""
+        for endpoint in self.endpoints:
+            try:
+                endpoint.client.models.list()
+                healthy = True
+            except Exception as e:
+                print(f"端点 {endpoint.name} 健康检查失败: {str(e)}")
+                healthy = False
+            with self.lock:
+                if healthy:
+                    self._close_circuit(endpoint)
+                else:
+                    self._open_circuit(endpoint)
+
+    def start_health_checks(self, interval):
+        """启动后台健康检查线程"""
+        if self._health_thread is not None:
+            return
+
+        def loop():
+            while not self._health_stop.wait(interval):
+                self.check_health()
+
+        self._health_thread = threading.Thread(target=loop, daemon=True)
+        self._health_thread.start()
+
+    def stop_health_checks(self):
+        """停止后台健康检查线程"""
+        self._health_stop.set()
+        self._health_thread = None
+
+    def stats(self):
+        """返回所有端点的统计信息"""
+        with self.lock:
+            return [endpoint.stats() for endpoint in self.endpoints]
+
+    def print_stats(self):
+        """打印端点统计"""
+        print("\n端点统计:")
+        print("-" * 30)
+        for item in self.stats():
+            avg = f"{item['avg_latency']:.2f}s" if item['avg_latency'] is not None else "-"
+            state = "熔断" if item['circuit_open'] else "正常"
+            print(f"{item['name']}: 请求 {item['requests']} 次, 失败 {item['errors']} 次, "
+                  f"平均延迟 {avg}, 状态 {state}")
+        print("-" * 30)
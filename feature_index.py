@@ -0,0 +1,214 @@
+import os
+import math
+from threading import Lock
+import numpy as np
+from PIL import Image
+
+FEATURE_SIZE = 64  # 计算颜色直方图和边缘密度时的缩略尺寸
+HASH_SIZE = 32  # 感知哈希DCT的输入尺寸
+HASH_BITS = 8  # 取DCT左上角 8x8 低频系数
+EDGE_THRESHOLD = 0.1  # 灰度梯度超过该值（0~1）视为边缘
+
+# 各组特征的权重，每组特征先归一化到相近的尺度
+FEATURE_WEIGHTS = {'color': 1.0, 'edge': 1.0, 'hash': 0.35, 'size': 0.5}
+
+
+def dct_matrix(size):
+    """正交DCT-II变换矩阵"""
+    n = np.arange(size)
+    matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size))
+    matrix[0] /= math.sqrt(2)
+    return (matrix * math.sqrt(2 / size)).astype(np.float32)
+
+
+DCT_MATRIX = dct_matrix(HASH_SIZE)
+
+
+def extract_features(image_path):
+    """提取图片的特征向量：颜色直方图、边缘密度、感知哈希和尺寸
+
+    各组特征分别归一化并按FEATURE_WEIGHTS加权后拼接，向量间的欧氏距离即相似度。
+    """
+    with Image.open(image_path) as img:
+        width, height = img.size
+        # JPEG按缩略尺寸直接解码
+        img.draft('RGB', (FEATURE_SIZE * 2, FEATURE_SIZE * 2))
+        rgb_image = img.convert('RGB')
+    small = rgb_image.resize((FEATURE_SIZE, FEATURE_SIZE), Image.BILINEAR)
+    pixels = np.asarray(small)
+
+    # 颜色直方图：每通道4级共64格，开方后的欧氏距离即Hellinger距离
+    quantized = (pixels >> 6).astype(np.int32)
+    bins = quantized[..., 0] * 16 + quantized[..., 1] * 4 + quantized[..., 2]
+    histogram = np.bincount(bins.ravel(), minlength=64).astype(np.float32)
+    color = np.sqrt(histogram / histogram.sum())
+
+    # 边缘密度：梯度超过阈值的像素比例及平均梯度
+    gray = pixels.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32) / 255
+    gradient = np.abs(np.diff(gray, axis=1))[:-1, :] + np.abs(np.diff(gray, axis=0))[:, :-1]
+    edge = np.array([(gradient > EDGE_THRESHOLD).mean(), min(gradient.mean() * 4, 1.0)], dtype=np.float32)
+
+    # 感知哈希：低频DCT系数与中位数比较，去掉直流分量
+    hash_gray = np.asarray(rgb_image.convert('L').resize((HASH_SIZE, HASH_SIZE), Image.BILINEAR), dtype=np.float32)
+    coefficients = (DCT_MATRIX @ hash_gray @ DCT_MATRIX.T)[:HASH_BITS, :HASH_BITS].ravel()[1:]
+    bits = np.where(coefficients > np.median(coefficients), 1.0, -1.0).astype(np.float32)
+    phash = bits / math.sqrt(len(bits) * 4)  # 两个哈希的距离范围为0~1
+
+    # 尺寸：宽高比和面积取对数
+    size = np.array([
+        math.log(width / height) / 2,
+        math.log(width * height) / 30,
+    ], dtype=np.float32)
+
+    return np.concatenate([
+        color * FEATURE_WEIGHTS['color'],
+        edge * FEATURE_WEIGHTS['edge'],
+        phash * FEATURE_WEIGHTS['hash'],
+        size * FEATURE_WEIGHTS['size'],
+    ])
+
+
+class FeatureIndex:
+    """已分类图片的特征近邻索引，用于在本地为相似图片打标签
+
+    向量保存在按需扩容的NumPy数组中，支持增量插入和按路径替换；
+    k个最近邻在距离阈值内且按距离加权投票的领先幅度足够大时才给出类别。
+    """
+    def __init__(self, path=None, k=5, max_distance=0.35, min_margin=0.6, min_size=50):
+        self.path = path
+        self.k = k
+        self.max_distance = max_distance
+        self.min_margin = min_margin
+        self.min_size = min_size
+        self.lock = Lock()
+        self.vectors = None
+        self.labels = []
+        self.paths = []
+        self.rows = {}  # 路径 -> 行号
+        self.dirty = False
+        if path and os.path.exists(path):
+            try:
+                self.load(path)
+            except Exception as e:
+                print(f"读取近邻索引时出错: {str(e)}")
+
+    def __len__(self):
+        return len(self.labels)
+
+    def add(self, vector, label, path):
+        """插入一张图片的特征，同一路径已存在时替换"""
+        with self.lock:
+            row = self.rows.get(path)
+            if row is None:
+                row = len(self.labels)
+                if self.vectors is None:
+                    self.vectors = np.empty((64, len(vector)), dtype=np.float32)
+                elif row >= len(self.vectors):
+                    # 容量翻倍，插入均摊O(1)
+                    grown = np.empty((len(self.vectors) * 2, self.vectors.shape[1]), dtype=np.float32)
+                    grown[:row] = self.vectors[:row]
+                    self.vectors = grown
+                self.labels.append(label)
+                self.paths.append(path)
+                self.rows[path] = row
+            else:
+                self.labels[row] = label
+            self.vectors[row] = vector
+            self.dirty = True
+
+    def remove_missing(self, keep):
+        """删除路径不在keep中的条目（文件已移动或删除）"""
+        with self.lock:
+            kept = [row for row, path in enumerate(self.paths) if path in keep]
+            if len(kept) == len(self.paths):
+                return 0
+            removed = len(self.paths) - len(kept)
+            self.vectors = self.vectors[kept] if kept else None
+            self.labels = [self.labels[row] for row in kept]
+            self.paths = [self.paths[row] for row in kept]
+            self.rows = {path: row for row, path in enumerate(self.paths)}
+            self.dirty = True
+            return removed
+
+    def rename(self, moved):
+        """文件移动后更新条目的路径，moved为 {旧路径: 新路径}"""
+        with self.lock:
+            for old_path, new_path in moved.items():
+                row = self.rows.pop(os.path.abspath(old_path), None)
+                if row is None:
+                    continue
+                self.paths[row] = os.path.abspath(new_path)
+                self.rows[self.paths[row]] = row
+                self.dirty = True
+
+    def sync(self, found):
+        """与 {图片路径: 类别} 同步：删除已不存在的条目，为新文件提取特征"""
+        found = {os.path.abspath(path): category for path, category in found.items()}
+        removed = self.remove_missing(found)
+
+        added = 0
+        for path, category in found.items():
+            row = self.rows.get(path)
+            if row is not None and self.labels[row] == category:
+                continue
+            try:
+                self.add(extract_features(path), category, path)
+                added += 1
+            except Exception as e:
+                print(f"提取图片特征时出错 {path}: {str(e)}")
+        if added or removed:
+            print(f"近邻索引已同步：新增 {added} 张，移除 {removed} 张，共 {len(self)} 张")
+        return added, removed
+
+    def predict(self, vector):
+        """返回 (类别, 投票领先幅度, 最近距离)，近邻不足或不一致时返回None"""
+        with self.lock:
+            count = len(self.labels)
+            if count < max(self.min_size, self.k):
+                return None
+            distances = np.sqrt(((self.vectors[:count] - vector) ** 2).sum(axis=1))
+            nearest = np.argpartition(distances, self.k - 1)[:self.k]
+            nearest = nearest[np.argsort(distances[nearest])]
+            labels = [self.labels[row] for row in nearest]
+
+        if distances[nearest[-1]] > self.max_distance:
+            return None
+        votes = {}
+        for row, label in zip(nearest, labels):
+            votes[label] = votes.get(label, 0.0) + 1.0 / (distances[row] + 1e-3)
+        ranked = sorted(votes.values(), reverse=True)
+        margin = (ranked[0] - (ranked[1] if len(ranked) > 1 else 0.0)) / sum(ranked)
+        if margin < self.min_margin:
+            return None
+        label = max(votes, key=votes.get)
+        return label, margin, float(distances[nearest[0]])
+
+    def save(self, path=None):
+        """保存到.npz文件（先写临时文件再替换）"""
+        path = path or self.path
+        if not path:
+            return
+        with self.lock:
+            count = len(self.labels)
+            vectors = self.vectors[:count] if count else np.empty((0, 0), dtype=np.float32)
+            labels = np.array(self.labels, dtype=str)
+            paths = np.array(self.paths, dtype=str)
+            self.dirty = False
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            np.savez(f, vectors=vectors, labels=labels, paths=paths)
+        os.replace(temp_path, path)
+
+    def load(self, path):
+        """从.npz文件读取"""
+        with np.load(path) as data:
+            vectors = data['vectors']
+            labels = [str(label) for label in data['labels']]
+            paths = [str(item) for item in data['paths']]
+        with self.lock:
+            self.vectors = vectors.astype(np.float32) if len(labels) else None
+            self.labels = labels
+            self.paths = paths
+            self.rows = {item: row for row, item in enumerate(paths)}
+            self.dirty = False
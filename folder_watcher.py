@@ -0,0 +1,182 @@
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+
+# inotify事件常量（见 <sys/inotify.h>）
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifySource:
+    """基于Linux inotify的目录事件源（通过ctypes调用libc，无需额外依赖）"""
+    def __init__(self, directory):
+        libc_name = ctypes.util.find_library('c')
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"无法监听目录: {directory}")
+        self.directory = directory
+
+    def wait(self, timeout):
+        """等待事件，返回 (发生变化的文件名列表, 是否需要全量重新扫描)"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return [], False
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return [], False
+
+        names = []
+        overflow = False
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+            elif name:
+                names.append(os.fsdecode(name))
+        return names, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FolderWatcher:
+    """监听输入目录中新出现的图片，文件写入稳定后回调
+
+    Linux上使用inotify，其他平台或inotify不可用时退化为定时轮询。
+    文件的大小和修改时间在debounce秒内保持不变才视为写入完成，避免处理写了一半的文件。
+    """
+    def __init__(self, directory, on_file_ready, debounce=1.0, poll_interval=1.0,
+                 extensions=IMAGE_EXTENSIONS, use_inotify=None):
+        self.directory = directory
+        self.on_file_ready = on_file_ready
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.extensions = extensions
+        self.use_inotify = sys.platform.startswith('linux') if use_inotify is None else use_inotify
+
+        self.pending = {}  # 文件名 -> (大小, 修改时间, 最近一次变化的时间)
+        self.reported = {}  # 文件名 -> 已回调时的修改时间，避免重复处理
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def is_candidate(self, name):
+        """是否为需要处理的图片文件"""
+        return name.lower().endswith(self.extensions)
+
+    def scan(self):
+        """全量扫描目录，把所有图片加入待确认队列"""
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if not (entry.is_file() and self.is_candidate(entry.name)):
+                        continue
+                    # 已处理且未再修改的文件不再加入队列
+                    if self.reported.get(entry.name) == entry.stat().st_mtime:
+                        continue
+                    self.touch(entry.name)
+        except FileNotFoundError:
+            pass
+
+    def touch(self, name):
+        """把文件加入待确认列表；已在列表中时不做处理，防抖计时由check_pending在大小或修改时间变化时重新开始"""
+        if name not in self.pending:
+            self.pending[name] = (None, None, time.monotonic())
+
+    def check_pending(self):
+        """检查待确认文件，写入稳定的文件触发回调"""
+        now = time.monotonic()
+        for name, (size, mtime, changed_at) in list(self.pending.items()):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self.pending[name]
+                continue
+
+            if (stat.st_size, stat.st_mtime) != (size, mtime):
+                self.pending[name] = (stat.st_size, stat.st_mtime, now)
+                continue
+            if now - changed_at < self.debounce:
+                continue
+
+            del self.pending[name]
+            if self.reported.get(name) == stat.st_mtime:
+                continue
+            self.reported[name] = stat.st_mtime
+            try:
+                self.on_file_ready(path)
+            except Exception as e:
+                print(f"处理新文件 {name} 时出错: {str(e)}")
+
+    def forget(self, path):
+        """文件已被移除或处理完毕后清除记录，使同名新文件可以再次触发"""
+        self.reported.pop(os.path.basename(path), None)
+
+    def run(self):
+        """监听循环（阻塞直到stop被调用）"""
+        source = None
+        if self.use_inotify:
+            try:
+                source = InotifySource(self.directory)
+                print(f"使用inotify监听目录: {self.directory}")
+            except Exception as e:
+                print(f"inotify不可用，改用轮询: {str(e)}")
+        if source is None:
+            print(f"轮询监听目录: {self.directory} (间隔 {self.poll_interval}s)")
+
+        # 启动时处理目录中已有的文件
+        self.scan()
+        try:
+            while not self.stop_event.is_set():
+                # 有待确认文件时缩短等待时间，以便及时完成防抖
+                timeout = min(self.debounce / 4, self.poll_interval) if self.pending else self.poll_interval
+                if source is not None:
+                    names, overflow = source.wait(timeout)
+                    if overflow:
+                        self.scan()
+                    for name in names:
+                        if self.is_candidate(name):
+                            self.touch(name)
+                else:
+                    self.stop_event.wait(timeout)
+                    self.scan()
+                self.check_pending()
+        finally:
+            if source is not None:
+                source.close()
+
+    def start(self):
+        """在后台线程中启动监听"""
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """停止监听"""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
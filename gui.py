@@ -1,9 +1,11 @@
 import os
 import sys
+import time
 import threading
-import shutil
+import concurrent.futures
 import json
 from pathlib import Path
+from collections import deque
 from PIL import Image
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                              QHBoxLayout, QPushButton, QLabel, QScrollArea,
@@ -14,56 +16,181 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                              QToolButton, QSpacerItem)
 from PyQt5.QtCore import QRect, QSize, QPoint
 from PyQt5.QtCore import Qt, QSize, QThread, pyqtSignal, QMimeData, QPoint, QSettings, QTimer
-from PyQt5.QtGui import QPixmap, QDragEnterEvent, QDropEvent, QPalette, QColor, QFont
+from PyQt5.QtGui import QPixmap, QDragEnterEvent, QDropEvent, QPalette, QColor, QFont, QImageReader
 from image_classifier import ImageClassifier
+from classification_stats import format_duration
 from dotenv import load_dotenv
 
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+
+
+class ScanThread(QThread):
+    """在后台递归扫描拖入或选择的路径，分批发送找到的图片，避免大文件夹阻塞界面"""
+    files_found = pyqtSignal(list)
+    scan_finished = pyqtSignal(int)  # 扫描结束，参数为找到的图片数
+
+    def __init__(self, paths, chunk_size=500, chunk_interval=0.1):
+        super().__init__()
+        self.paths = paths
+        self.chunk_size = chunk_size
+        self.chunk_interval = chunk_interval
+        self.is_running = True
+
+    def iter_image_files(self):
+        for path in self.paths:
+            if os.path.isfile(path):
+                if path.lower().endswith(IMAGE_EXTENSIONS):
+                    yield path
+            elif os.path.isdir(path):
+                for root, _, files in os.walk(path):
+                    if not self.is_running:
+                        return
+                    for file in files:
+                        if file.lower().endswith(IMAGE_EXTENSIONS):
+                            yield os.path.join(root, file)
+
+    def run(self):
+        chunk = []
+        count = 0
+        last_emit = time.monotonic()
+        for file_path in self.iter_image_files():
+            chunk.append(file_path)
+            count += 1
+            # 攒满一批或距上次发送超过chunk_interval时发送
+            if len(chunk) >= self.chunk_size or time.monotonic() - last_emit >= self.chunk_interval:
+                self.files_found.emit(chunk)
+                chunk = []
+                last_emit = time.monotonic()
+        if chunk and self.is_running:
+            self.files_found.emit(chunk)
+        self.scan_finished.emit(count)
+
+    def stop(self):
+        self.is_running = False
+
+
 class ClassificationThread(QThread):
-    """处理图片分类的后台线程"""
-    progress_signal = pyqtSignal(str)
-    progress_value = pyqtSignal(int)  # 新增进度值信号
+    """处理图片分类的后台线程
+    
+    图片在线程池中并发分类，进度在工作线程内合并，按固定帧率（PROGRESS_FPS，默认10Hz）
+    发送一次汇总快照，避免每张图片一个跨线程信号堆积在界面线程。
+    """
+    progress_update = pyqtSignal(dict)  # 汇总进度快照（见ClassificationStats.snapshot）
     finished_signal = pyqtSignal()
+    cancelled_signal = pyqtSignal(int)  # 分类被停止，参数为已完成数量
     error_signal = pyqtSignal(str)
 
-    def __init__(self, classifier, images, output_dir):
+    def __init__(self, classifier, images, output_dir, selected=()):
         super().__init__()
         self.classifier = classifier
         self.images = images
         self.output_dir = output_dir
+        # 待处理图片按调度策略排队，用户选中的图片优先
+        self.queue = classifier.task_queue()
+        self.selected = set(selected)
         self.is_running = True
+        self.frame_interval = 1.0 / max(float(os.getenv('PROGRESS_FPS', '10')), 1.0)
 
     def run(self):
         try:
-            total = len(self.images)
-            for i, image_path in enumerate(self.images, 1):
-                if not self.is_running:
-                    break
-                
-                # 发送进度信息
-                progress = int((i / total) * 100)
-                self.progress_value.emit(progress)
-                self.progress_signal.emit(f'正在处理 {i}/{total}: {os.path.basename(image_path)}')
-                
-                # 获取分类结果
-                category = self.classifier.classify_image(image_path)
-                
-                # 移动文件到对应目录
-                dest_dir = os.path.join(self.output_dir, category)
-                os.makedirs(dest_dir, exist_ok=True)
-                shutil.copy2(image_path, dest_dir)
+            # 预检文件头，跳过损坏和不支持的图片（只写隔离报告，不移动用户的原文件）
+            checked = self.classifier.preflight(self.images, self.output_dir, move_bad=False)
+            total = len(checked)
+            stats = self.classifier.stats
+            stats.start_run(total, self.classifier.valid_categories + ["其他"])
+            self.classifier.reset_cancellation()
+            max_pending = max(self.classifier.max_pending_tasks, self.classifier.max_workers)
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.classifier.max_workers)
+            pending = set()
+            for image_path in checked:
+                self.queue.push(image_path, selected=image_path in self.selected)
+            index = 0
+            exhausted = False
+            budget = self.classifier.budget
+            next_frame = 0.0
+            try:
+                while self.is_running and (pending or not exhausted):
+                    # 预算用尽后不再提交新任务
+                    if budget is not None and budget.exhausted:
+                        exhausted = True
+                    # 补充任务到在途上限
+                    while not exhausted and len(pending) < max_pending:
+                        image_path = self.queue.pop()
+                        if image_path is None:
+                            exhausted = True
+                            break
+                        pending.add(executor.submit(
+                            self.classifier.process_single_image,
+                            (os.path.basename(image_path), os.path.dirname(image_path),
+                             self.output_dir, index, total)
+                        ))
+                        index += 1
+                    
+                    # 有任务完成或到达下一帧时醒来，只在帧边界发送进度
+                    timeout = max(next_frame - time.monotonic(), 0.0)
+                    _, pending = concurrent.futures.wait(
+                        pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    now = time.monotonic()
+                    if now >= next_frame:
+                        self.progress_update.emit(stats.snapshot())
+                        next_frame = now + self.frame_interval
+            finally:
+                # 停止时丢弃排队中的任务，进行中的任务最多再等待cancel_grace秒
+                executor.shutdown(wait=False, cancel_futures=True)
+                concurrent.futures.wait(
+                    pending, timeout=None if self.is_running else self.classifier.cancel_grace
+                )
             
-            self.progress_value.emit(100)  # 确保进度条到达100%
+            # 保存已完成部分的结果
+            if self.classifier.index is not None:
+                self.classifier.index.flush()
+            stats.save()
+            if budget is not None:
+                budget.save()
+            snapshot = stats.snapshot()
+            self.progress_update.emit(snapshot)
+            if not self.is_running:
+                self.cancelled_signal.emit(snapshot['done'])
+                return
+            if budget is not None and budget.exhausted:
+                self.error_signal.emit(f"已达到{budget.exhausted}，已完成 {snapshot['done']}/{total} 张，"
+                                       f"调整预算后重新运行即可继续")
+                return
             self.finished_signal.emit()
         except Exception as e:
             self.error_signal.emit(str(e))
 
+    def prioritize(self, image_path):
+        """分类过程中把尚未开始处理的图片提前，返回是否成功（可在界面线程中调用）"""
+        return self.queue.promote(image_path)
+
     def stop(self):
         self.is_running = False
+        self.classifier.cancel()
+
+
+class RecategorizeThread(QThread):
+    """按已保存的图片描述重新整理输出目录的后台线程"""
+    finished_signal = pyqtSignal(dict)
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, classifier, output_dir):
+        super().__init__()
+        self.classifier = classifier
+        self.output_dir = output_dir
+
+    def run(self):
+        try:
+            self.finished_signal.emit(self.classifier.recategorize_output(self.output_dir) or {})
+        except Exception as e:
+            self.error_signal.emit(str(e))
 
 
 class ImagePreviewWidget(QWidget):
     """图片预览组件"""
     removed = pyqtSignal(str)  # 发送被删除图片的路径
+    clicked = pyqtSignal(str)  # 点击预览选中图片，选中的图片优先分类
     
     def __init__(self, image_path, size=QSize(200, 200)):
         super().__init__()
@@ -143,15 +270,32 @@ class ImagePreviewWidget(QWidget):
             }
         """)
         
+    def set_selected(self, selected):
+        """切换选中状态的边框"""
+        self.frame.setStyleSheet(self.frame.styleSheet().replace(
+            "border: 1px solid #e0e0e0;" if selected else "border: 2px solid #0d6efd;",
+            "border: 2px solid #0d6efd;" if selected else "border: 1px solid #e0e0e0;"
+        ))
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.clicked.emit(self.image_path)
+        super().mousePressEvent(event)
+
     def remove_self(self):
         """删除自身组件"""
         self.removed.emit(self.image_path)
         self.deleteLater()
 
     def load_image(self):
-        pixmap = QPixmap(self.image_path)
-        scaled_pixmap = pixmap.scaled(self.size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-        self.image_label.setPixmap(scaled_pixmap)
+        # 直接按缩略图尺寸解码，避免为每张图片保留全分辨率像素
+        reader = QImageReader(self.image_path)
+        reader.setAutoTransform(True)
+        original_size = reader.size()
+        if original_size.isValid():
+            reader.setScaledSize(original_size.scaled(self.size, Qt.KeepAspectRatio))
+        image = reader.read()
+        self.image_label.setPixmap(QPixmap.fromImage(image))
 
 
 class FlowLayout(QLayout):
@@ -227,7 +371,7 @@ class FlowLayout(QLayout):
 
 class DropArea(QScrollArea):
     """支持拖放的图片预览区域"""
-    files_dropped = pyqtSignal(list)
+    paths_dropped = pyqtSignal(list)  # 拖入的文件和文件夹路径，由主窗口在后台扫描
 
     def __init__(self):
         super().__init__()
@@ -295,27 +439,10 @@ class DropArea(QScrollArea):
         if event.mimeData().hasUrls():
             event.acceptProposedAction()
 
-    def get_image_files(self, path):
-        """递归获取文件夹中的所有图片文件"""
-        image_files = []
-        if os.path.isfile(path):
-            if path.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-                image_files.append(path)
-        elif os.path.isdir(path):
-            for root, _, files in os.walk(path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    if file_path.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-                        image_files.append(file_path)
-        return image_files
-
     def dropEvent(self, event: QDropEvent):
         dropped_paths = [url.toLocalFile() for url in event.mimeData().urls()]
-        files = []
-        for path in dropped_paths:
-            files.extend(self.get_image_files(path))
-        if files:
-            self.files_dropped.emit(files)
+        if dropped_paths:
+            self.paths_dropped.emit(dropped_paths)
 
 
 class ConfigDialog(QDialog):
@@ -407,8 +534,14 @@ class ImageClassifierApp(QMainWindow):
     """图片分类器GUI应用"""
     def __init__(self):
         super().__init__()
-        self.images = []
+        self.images = {}  # 图片路径 -> None，按添加顺序去重
+        self.selected_images = set()  # 点击选中的图片，分类时优先处理
         self.classification_thread = None
+        self.recategorize_thread = None
+        self.scan_threads = set()
+        # 待创建的预览，由定时器分批创建，避免一次性在界面线程中解码大量缩略图
+        self.preview_queue = deque()
+        self.preview_batch = int(os.getenv('PREVIEW_BATCH', '20'))
         
         # 加载配置
         self.settings = QSettings("VLMClassifier", "ImageClassifier")
@@ -545,6 +678,9 @@ class ImageClassifierApp(QMainWindow):
         # 设置输入和输出目录
         self.input_dir = os.getenv('INPUT_DIR', os.path.join(app_data_dir, 'input'))
         self.output_dir = os.getenv('OUTPUT_DIR', os.path.join(app_data_dir, 'output'))
+        # 分类结果索引数据库和累计统计
+        self.index_path = os.getenv('INDEX_DB_PATH', os.path.join(app_data_dir, 'classifications.db'))
+        self.stats_path = os.getenv('STATS_PATH', os.path.join(app_data_dir, 'stats.json'))
         
         # 创建输入和输出目录
         os.makedirs(self.input_dir, exist_ok=True)
@@ -639,7 +775,10 @@ class ImageClassifierApp(QMainWindow):
         
         # 图片预览区域
         self.preview_area = DropArea()
-        self.preview_area.files_dropped.connect(self.add_images)
+        self.preview_area.paths_dropped.connect(self.scan_paths)
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setInterval(15)
+        self.preview_timer.timeout.connect(self.create_pending_previews)
         left_layout.addWidget(self.preview_area)
         
         # 进度条
@@ -883,6 +1022,7 @@ class ImageClassifierApp(QMainWindow):
         }
         
         # 保存配置
+        old_categories = self.config.get('valid_categories')
         self.save_config(new_config)
         
         # 如果分类器尚未初始化，则初始化它
@@ -895,7 +1035,9 @@ class ImageClassifierApp(QMainWindow):
                     model_name=new_config.get('model_name'),
                     classification_prompt=new_config.get('classification_prompt'),
                     valid_categories=new_config.get('valid_categories'),
-                    max_workers=new_config.get('max_workers', 4)
+                    max_workers=new_config.get('max_workers', 4),
+                    index_path=self.index_path,
+                    stats_path=self.stats_path
                 )
                 # 更新类别列表
                 self.categories = self.classifier.valid_categories + ["其他"]
@@ -923,6 +1065,46 @@ class ImageClassifierApp(QMainWindow):
         # 提示用户配置已更新
         QMessageBox.information(self, "配置已更新", 
                               "配置已成功更新！现在可以直接使用新的配置进行分类。")
+        
+        # 描述模式下类别变化时，可以按已保存的描述在本地重新整理输出目录
+        if (self.classifier is not None and self.classifier.caption_mode
+                and new_config['valid_categories'] != old_categories):
+            reply = QMessageBox.question(
+                self,
+                "重新归类",
+                "分类类别已更改，是否按已保存的图片描述重新整理输出目录？\n\n"
+                "只有没有描述或描述无法匹配新类别的图片会重新请求API。",
+                QMessageBox.Yes | QMessageBox.No,
+                QMessageBox.Yes
+            )
+            if reply == QMessageBox.Yes:
+                self.start_recategorize()
+
+    def start_recategorize(self):
+        """在后台线程中重新归类输出目录"""
+        if self.classification_thread and self.classification_thread.isRunning():
+            QMessageBox.information(self, "提示", "正在分类，请等待分类完成后再重新归类。")
+            return
+        self.start_btn.setEnabled(False)
+        self.statusBar().showMessage("正在重新归类输出目录...")
+        self.recategorize_thread = RecategorizeThread(self.classifier, self.output_dir)
+        self.recategorize_thread.finished_signal.connect(self.recategorize_finished)
+        self.recategorize_thread.error_signal.connect(self.recategorize_error)
+        self.recategorize_thread.start()
+
+    def recategorize_finished(self, summary):
+        """重新归类完成"""
+        self.start_btn.setEnabled(True)
+        self.statusBar().showMessage(
+            f"重新归类完成：本地归类 {summary.get('local', 0)} 张，请求API {summary.get('api', 0)} 张，"
+            f"移动 {summary.get('moved', 0)} 张，失败 {summary.get('failed', 0)} 张"
+        )
+
+    def recategorize_error(self, error_msg):
+        """重新归类出错"""
+        self.start_btn.setEnabled(True)
+        self.statusBar().showMessage("重新归类出错")
+        QMessageBox.critical(self, "错误", f"重新归类时出错：{error_msg}")
     
     def apply_styles(self):
         self.setStyleSheet("""
@@ -1181,51 +1363,93 @@ class ImageClassifierApp(QMainWindow):
         dialog.setNameFilter("所有文件 (*)")
         
         if dialog.exec_():
-            selected_files = dialog.selectedFiles()
-            files = []
-            for path in selected_files:
-                if os.path.isdir(path):
-                    # 如果是文件夹，递归获取所有图片
-                    for root, _, filenames in os.walk(path):
-                        for filename in filenames:
-                            file_path = os.path.join(root, filename)
-                            if file_path.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-                                files.append(file_path)
-                elif path.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-                    # 如果是图片文件，直接添加
-                    files.append(path)
-            
-            if files:
-                self.add_images(files)
+            self.scan_paths(dialog.selectedFiles())
+
+    def scan_paths(self, paths):
+        """在后台扫描文件和文件夹，找到的图片分批加入预览区域"""
+        thread = ScanThread(paths)
+        # 已停止的扫描线程仍在事件队列中的批次直接丢弃
+        thread.files_found.connect(lambda files, thread=thread: thread.is_running and self.add_images(files))
+        thread.scan_finished.connect(lambda count, thread=thread: self.scan_finished(thread, count))
+        self.scan_threads.add(thread)
+        self.statusBar().showMessage("正在扫描文件...")
+        thread.start()
+
+    def scan_finished(self, thread, count):
+        """扫描线程结束"""
+        self.scan_threads.discard(thread)
+        thread.wait()
+        thread.deleteLater()
+        if count == 0:
+            self.statusBar().showMessage("未找到图片文件")
+        elif not self.scan_threads:
+            self.statusBar().showMessage(f"扫描完成，共 {len(self.images)} 个文件")
+
+    def stop_scans(self):
+        """停止所有进行中的扫描"""
+        for thread in list(self.scan_threads):
+            thread.stop()
 
     def add_images(self, files):
-        """添加图片到预览区域"""
-        if not files:
+        """添加图片到预览区域（预览由定时器分批创建）"""
+        added_count = 0
+        for file in files:
+            if file not in self.images:
+                self.images[file] = None
+                self.preview_queue.append(file)
+                added_count += 1
+        if not added_count:
+            if not self.scan_threads:
+                self.statusBar().showMessage("所选文件已存在")
             return
             
         # 清除提示标签
         if self.preview_area.hint_label.isVisible():
             self.preview_area.hint_label.hide()
+        if not self.preview_timer.isActive():
+            self.preview_timer.start()
         
-        # 添加新的图片预览
-        added_count = 0
-        for file in files:
-            if file not in self.images:
-                self.images.append(file)
-                preview = ImagePreviewWidget(file)
-                preview.removed.connect(self.remove_image)
-                self.preview_area.layout.addWidget(preview)
-                added_count += 1
-        
-        if added_count > 0:
-            self.statusBar().showMessage(f"已添加 {added_count} 个文件")
+        if self.scan_threads:
+            self.statusBar().showMessage(f"正在扫描文件... 已添加 {len(self.images)} 个文件")
         else:
-            self.statusBar().showMessage("所选文件已存在")
+            self.statusBar().showMessage(f"已添加 {added_count} 个文件")
+
+    def create_pending_previews(self):
+        """每次定时器触发时创建一批预览组件"""
+        created = 0
+        while self.preview_queue and created < self.preview_batch:
+            file = self.preview_queue.popleft()
+            # 创建前已被移除或清空的图片不再创建预览
+            if file not in self.images:
+                continue
+            preview = ImagePreviewWidget(file)
+            preview.removed.connect(self.remove_image)
+            preview.clicked.connect(lambda path, preview=preview: self.toggle_selected(path, preview))
+            self.preview_area.layout.addWidget(preview)
+            created += 1
+        if not self.preview_queue:
+            self.preview_timer.stop()
             
+    def toggle_selected(self, image_path, preview):
+        """分类前点击切换选中；分类过程中点击把尚未处理的图片提前"""
+        if self.classification_thread and self.classification_thread.isRunning():
+            if image_path not in self.selected_images and self.classification_thread.prioritize(image_path):
+                self.selected_images.add(image_path)
+                preview.set_selected(True)
+                self.statusBar().showMessage(f"已提前处理: {os.path.basename(image_path)}")
+            return
+        if image_path in self.selected_images:
+            self.selected_images.discard(image_path)
+            preview.set_selected(False)
+        else:
+            self.selected_images.add(image_path)
+            preview.set_selected(True)
+        self.statusBar().showMessage(f"已选中 {len(self.selected_images)} 张图片，开始分类时优先处理")
+
     def remove_image(self, image_path):
         """移除指定图片"""
-        if image_path in self.images:
-            self.images.remove(image_path)
+        self.images.pop(image_path, None)
+        self.selected_images.discard(image_path)
             
         # 如果没有图片了，显示提示标签
         if not self.images:
@@ -1247,8 +1471,11 @@ class ImageClassifierApp(QMainWindow):
         )
         
         if reply == QMessageBox.Yes:
-            # 清空图片列表
+            # 停止扫描并清空图片列表
+            self.stop_scans()
             self.images.clear()
+            self.selected_images.clear()
+            self.preview_queue.clear()
             
             # 移除所有预览组件
             while self.preview_area.layout.count() > 1:  # 保留hint_label
@@ -1262,6 +1489,9 @@ class ImageClassifierApp(QMainWindow):
 
     def start_classification(self):
         """开始分类过程"""
+        if self.scan_threads:
+            QMessageBox.information(self, "提示", "正在扫描文件，请等待扫描完成后再开始分类。")
+            return
         if not self.images:
             QMessageBox.warning(self, "警告", "请先选择要分类的图片！")
             return
@@ -1282,21 +1512,25 @@ class ImageClassifierApp(QMainWindow):
             return
             
         if self.classification_thread and self.classification_thread.isRunning():
+            # 不在界面线程中等待，线程结束后通过cancelled_signal恢复界面
             self.classification_thread.stop()
-            self.classification_thread.wait()
-            self.start_btn.setText("开始分类")
-            self.statusBar().showMessage("分类已停止")
+            self.start_btn.setEnabled(False)
+            self.statusBar().showMessage("正在停止...")
             return
 
         # 初始化分类器（如果还没有初始化）
         try:
+            if self.classifier is not None:
+                self.classifier.close()
             self.classifier = ImageClassifier(
                 api_base_url=self.config.get('api_base_url'),
                 api_key=self.config.get('api_key'),
                 model_name=self.config.get('model_name'),
                 classification_prompt=self.config.get('classification_prompt'),
                 valid_categories=self.config.get('valid_categories'),
-                max_workers=self.config.get('max_workers', 4)
+                max_workers=self.config.get('max_workers', 4),
+                index_path=self.index_path,
+                stats_path=self.stats_path
             )
             # 更新类别列表
             self.categories = self.classifier.valid_categories + ["其他"]
@@ -1313,7 +1547,7 @@ class ImageClassifierApp(QMainWindow):
         
         # 创建并启动分类线程
         self.classification_thread = ClassificationThread(
-            self.classifier, self.images, self.output_dir
+            self.classifier, list(self.images), self.output_dir, self.selected_images
         )
         
         # 显示进度条
@@ -1321,15 +1555,29 @@ class ImageClassifierApp(QMainWindow):
         self.progress_bar.show()
         
         # 连接信号
-        self.classification_thread.progress_signal.connect(
-            lambda msg: self.statusBar().showMessage(msg)
-        )
-        self.classification_thread.progress_value.connect(self.progress_bar.setValue)
+        self.classification_thread.progress_update.connect(self.update_progress)
         self.classification_thread.finished_signal.connect(self.classification_finished)
+        self.classification_thread.cancelled_signal.connect(self.classification_cancelled)
         self.classification_thread.error_signal.connect(self.classification_error)
         
         self.classification_thread.start()
 
+    def update_progress(self, snapshot):
+        """根据汇总快照刷新进度条和状态栏（每帧最多调用一次）"""
+        total = snapshot['total']
+        done = snapshot['done']
+        self.progress_bar.setValue(int(done * 100 / total) if total else 0)
+        counts = "  ".join(
+            f"{category} {count}" for category, count in snapshot['counts'].items() if count
+        )
+        message = (f"已完成 {done}/{total}  速度 {snapshot['throughput']:.1f}张/秒  "
+                   f"剩余 {format_duration(snapshot['eta'])}")
+        if snapshot['errors']:
+            message += f"  失败 {snapshot['errors']}"
+        if counts:
+            message += f"  |  {counts}"
+        self.statusBar().showMessage(message)
+
     def classification_finished(self):
         """分类完成的处理"""
         self.select_btn.setEnabled(True)
@@ -1342,13 +1590,37 @@ class ImageClassifierApp(QMainWindow):
                 item.widget().deleteLater()
         
         self.images.clear()
+        self.selected_images.clear()
+        self.preview_queue.clear()
         self.preview_area.hint_label.show()
         
         # 隐藏进度条
         self.progress_bar.hide()
         
-        self.statusBar().showMessage("分类完成！")
-        QMessageBox.information(self, "完成", "所有图片已完成分类！")
+        # 汇总本次分类统计
+        snapshot = self.classifier.stats.snapshot()
+        summary = "\n".join(
+            f"{category}: {count} 张" for category, count in snapshot['counts'].items() if count
+        )
+        if snapshot['errors']:
+            summary += f"\n失败: {snapshot['errors']} 张"
+        tokens = snapshot['tokens']
+        if tokens['requests']:
+            summary += (f"\n\nToken用量: 输入 {tokens['prompt']}（命中缓存 {tokens['cached']}），"
+                        f"输出 {tokens['completion']}")
+        self.statusBar().showMessage(
+            f"分类完成！共 {snapshot['done']} 张，耗时 {format_duration(snapshot['elapsed'])}"
+        )
+        QMessageBox.information(self, "完成", f"所有图片已完成分类！\n\n{summary}")
+
+    def classification_cancelled(self, done):
+        """分类被停止后的处理"""
+        self.select_btn.setEnabled(True)
+        self.start_btn.setEnabled(True)
+        self.start_btn.setText("开始分类")
+        self.progress_bar.hide()
+        self.progress_bar.setValue(0)
+        self.statusBar().showMessage(f"分类已停止，已完成 {done} 张")
 
     def classification_error(self, error_msg):
         """处理分类过程中的错误"""
@@ -1371,6 +1643,10 @@ class ImageClassifierApp(QMainWindow):
 
 
 if __name__ == "__main__":
+    # 打包后的程序启动预处理子进程时需要
+    import multiprocessing
+    multiprocessing.freeze_support()
+    
     # 添加日志文件
     import logging
     import tempfile
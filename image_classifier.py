@@ -1,17 +1,283 @@
 import os
+import sys
+import re
 import base64
+import binascii
 import json
 from openai import OpenAI
-from PIL import Image
+from PIL import Image, ExifTags, ImageChops, ImageStat
 from tqdm import tqdm
 import shutil
 from dotenv import load_dotenv
+import io
+import gc
+import math
+import time
+import contextlib
+import tarfile
+import zipfile
 import concurrent.futures
-from threading import Lock
+import random
+from threading import Lock, BoundedSemaphore, local
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+from endpoint_pool import EndpointPool
+from classification_index import ClassificationIndex, file_hash, data_hash
+from folder_watcher import FolderWatcher
+from classification_stats import ClassificationStats, format_duration, empty_tokens
+from cancellation import CancellationToken, ClassificationCancelled
+from request_hedger import RequestHedger
+from batch_job import BatchFileWriter, BatchJob
+from preflight import inspect_image, inspect_images, quarantine
+from archive_io import ArchiveReader, ArchiveOutput, is_archive
+from input_sources import PrefetchReader, open_source, is_remote
+from usage_budget import UsageBudget, BudgetExceeded, usage_cost
+from task_queue import PriorityTaskQueue, PRIORITY_POLICIES
+from output_layout import OutputLayout, MANIFEST_NAME
+from virtual_manifest import ManifestWriter, read_manifest
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+NEIGHBOR_MODEL = 'nearest-neighbor'  # 由近邻索引在本地标注的结果的模型名
+
+DEFAULT_CAPTION_PROMPT = (
+    "请用一句话描述这张图片的内容和风格，然后给出不超过8个中文关键词标签。"
+    "格式：描述：……；标签：标签1 标签2 ……"
+)
+
+
+def current_rss_mb():
+    """返回当前进程的常驻内存（MB），无法获取时返回None"""
+    try:
+        # Linux: /proc/self/statm 第二列为常驻页数
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except Exception:
+        return None
+
+
+def init_preprocess_worker():
+    """预处理子进程的初始化：提前加载Pillow的全部格式插件，避免每张图片重复加载"""
+    Image.init()
+
+
+EXIF_ORIENTATION = 0x0112
+EXIF_THUMBNAIL_OFFSET = 0x0201
+EXIF_THUMBNAIL_LENGTH = 0x0202
+# EXIF方向值对应的纠正操作
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def read_exif_thumbnail(img):
+    """读取JPEG中EXIF内嵌的缩略图，不存在时返回None"""
+    exif_bytes = img.info.get('exif')
+    if not exif_bytes:
+        return None
+    ifd1 = img.getexif().get_ifd(ExifTags.IFD.IFD1)
+    offset = ifd1.get(EXIF_THUMBNAIL_OFFSET)
+    length = ifd1.get(EXIF_THUMBNAIL_LENGTH)
+    if not offset or not length:
+        return None
+    # 偏移量相对于TIFF头，APP1段中TIFF头前有6字节的"Exif\0\0"
+    tiff_start = 6 if exif_bytes.startswith(b'Exif\x00\x00') else 0
+    data = exif_bytes[tiff_start + offset:tiff_start + offset + length]
+    if not data.startswith(b'\xff\xd8'):
+        return None
+    thumbnail = Image.open(io.BytesIO(data))
+    thumbnail.load()
+    return thumbnail
+
+
+ANIMATION_CANDIDATES = 12  # 动图中参与挑选的候选帧数
+ANIMATION_SCAN_FRAMES = 120  # GIF/WebP只能顺序解码，候选帧只从前这么多帧中选取以限制解码开销
+ANIMATION_SIGNATURE_SIZE = (32, 32)  # 计算帧间差异时使用的缩略尺寸
+
+
+def sample_animation_frames(img, frame_count, tile_size):
+    """从动图中挑选差异最大的若干帧，返回按时间顺序排列的缩小后的RGB帧
+    
+    候选帧均匀分布在前ANIMATION_SCAN_FRAMES帧内，几百帧的动图也不会被全量解码；
+    先选内容最丰富的帧，再依次选与已选帧差异最大的帧，跳过空白的淡入帧。
+    """
+    total = min(img.n_frames, ANIMATION_SCAN_FRAMES)
+    step = max(total / ANIMATION_CANDIDATES, 1)
+    indices = sorted({int(i * step) for i in range(min(total, ANIMATION_CANDIDATES))})
+    
+    candidates = []
+    for index in indices:
+        img.seek(index)
+        frame = img.convert('RGB')
+        frame.thumbnail(tile_size, Image.Resampling.BILINEAR)
+        signature = frame.convert('L').resize(ANIMATION_SIGNATURE_SIZE)
+        detail = ImageStat.Stat(signature).stddev[0]
+        candidates.append((index, frame, signature, detail))
+    
+    # 纯色帧（淡入淡出、空白首帧）不参与挑选，除非所有候选帧都是纯色
+    candidates = [item for item in candidates if item[3] >= 2.0] or candidates
+    chosen = [max(candidates, key=lambda item: item[3])]
+    while len(chosen) < min(frame_count, len(candidates)):
+        def distance(item):
+            return min(ImageStat.Stat(ImageChops.difference(item[2], other[2])).mean[0]
+                       for other in chosen)
+        remaining = [item for item in candidates if item not in chosen]
+        best = max(remaining, key=distance)
+        # 剩余帧都与已选帧几乎相同时不再增加
+        if distance(best) < 1.0:
+            break
+        chosen.append(best)
+    return [item[1] for item in sorted(chosen, key=lambda item: item[0])]
+
+
+def tile_frames(frames):
+    """把多帧拼接为网格图"""
+    columns = math.ceil(math.sqrt(len(frames)))
+    rows = math.ceil(len(frames) / columns)
+    tile_w = max(frame.width for frame in frames)
+    tile_h = max(frame.height for frame in frames)
+    canvas = Image.new('RGB', (tile_w * columns, tile_h * rows), (255, 255, 255))
+    for i, frame in enumerate(frames):
+        canvas.paste(frame, ((i % columns) * tile_w, (i // columns) * tile_h))
+    return canvas
+
+
+def compress_image(image_path, max_image_size, jpeg_quality, use_exif_thumbnail=True,
+                   animation_frames=4, reducing_gap=None):
+    """解码、按最大尺寸等比缩放并压缩为JPEG，返回内存中的BytesIO
+    
+    按EXIF方向纠正旋转（在缩放后进行，开销只与目标尺寸有关）。JPEG在DCT域缩小解码；
+    内嵌缩略图不小于目标尺寸时直接使用缩略图，完全跳过原图解码。
+    GIF/WebP动图挑选animation_frames个代表帧拼成网格图，不大于1时只使用第一帧。
+    reducing_gap不为None时先按整数倍快速缩小再做LANCZOS缩放，用于超大图片。
+    """
+    with Image.open(image_path) as img:
+        # 只有GIF/WebP动图走多帧路径；MPO（多画面JPEG）和多页TIFF按普通照片处理第一帧
+        if animation_frames > 1 and img.format in ('GIF', 'WEBP') and getattr(img, 'is_animated', False):
+            columns = math.ceil(math.sqrt(animation_frames))
+            rows = math.ceil(animation_frames / columns)
+            tile_size = (max(max_image_size[0] // columns, 1), max(max_image_size[1] // rows, 1))
+            frames = sample_animation_frames(img, animation_frames, tile_size)
+            buffer = io.BytesIO()
+            tile_frames(frames).save(buffer, 'JPEG', quality=jpeg_quality, optimize=True)
+            return buffer
+        
+        orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+        
+        # 计算调整后的大小（保持宽高比），旋转90°的方向按旋转后的宽高计算
+        width, height = img.size
+        max_w, max_h = max_image_size
+        if orientation in (5, 6, 7, 8):
+            max_w, max_h = max_h, max_w
+        ratio = min(max_w/width, max_h/height, 1.0)
+        target_size = (max(int(width*ratio), 1), max(int(height*ratio), 1))
+        
+        source = None
+        if use_exif_thumbnail and img.format in ('JPEG', 'MPO') and ratio < 1.0:
+            try:
+                thumbnail = read_exif_thumbnail(img)
+            except Exception:
+                thumbnail = None
+            # 缩略图需足够大且宽高比一致（避免带黑边的缩略图）
+            if (thumbnail is not None and
+                    thumbnail.width >= target_size[0] and thumbnail.height >= target_size[1] and
+                    abs(thumbnail.width / thumbnail.height - width / height) < 0.02 * width / height):
+                source = thumbnail
+        
+        if source is None:
+            if img.format in ('JPEG', 'MPO'):
+                img.draft('RGB', target_size)
+            source = img
+        
+        # 转换为RGB模式（处理RGBA等其他格式）
+        if source.mode != 'RGB':
+            source = source.convert('RGB')
+        if source.size != target_size:
+            source = source.resize(target_size, Image.Resampling.LANCZOS, reducing_gap=reducing_gap)
+        if orientation in ORIENTATION_TRANSPOSE:
+            source = source.transpose(ORIENTATION_TRANSPOSE[orientation])
+        
+        buffer = io.BytesIO()
+        source.save(buffer, 'JPEG', quality=jpeg_quality, optimize=True)
+    return buffer
+
+
+def preprocess_to_shared_memory(image_path, max_image_size, jpeg_quality, use_exif_thumbnail=True,
+                                animation_frames=4, reducing_gap=None):
+    """在子进程中预处理图片，结果写入共享内存
+    
+    返回 (共享内存名称, 数据长度, 原始文件大小)，由父进程读取后负责释放共享内存。
+    """
+    data = compress_image(
+        image_path, max_image_size, jpeg_quality, use_exif_thumbnail, animation_frames, reducing_gap
+    ).getbuffer()
+    # 共享内存的生命周期交给父进程管理，子进程不跟踪，避免退出时被误回收
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1), track=False)
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+        if os.name == 'posix':
+            # 只有POSIX共享内存会登记到resource_tracker，登记的名称带前导斜杠，shm.name已去掉
+            resource_tracker.unregister('/' + shm.name, 'shared_memory')
+    try:
+        shm.buf[:len(data)] = data
+        return shm.name, len(data), os.path.getsize(image_path)
+    finally:
+        data.release()
+        shm.close()
+
+
+def source_location(path):
+    """记录到索引和清单中的来源路径：本地路径转为绝对路径，远程位置（URL、s3://）保持原样"""
+    return path if is_remote(path) else os.path.abspath(path)
+
+
+DATA_URL_PREFIX = b'data:image/jpeg;base64,'
+# 响应文本的分词边界：空白和中英文标点（中文回复通常没有空白，靠标点断句）
+WORD_SEPARATOR = re.compile(r"[\s,.;:!?'\"()\[\]，。、；：！？“”‘’（）《》【】「」]+")
+BASE64_CHUNK_SIZE = 3 * 64 * 1024  # 3的倍数，保证分块编码结果可以直接拼接
+
+
+def image_source(image_path, data=None):
+    """Pillow可以打开的图片来源：内存中的数据（如压缩包成员）或文件路径"""
+    return io.BytesIO(data) if data is not None else image_path
+
+
+def build_data_url(data):
+    """把JPEG数据编码为data URL
+    
+    预先分配最终长度的缓冲区，按块base64编码后直接写入，只在最后生成一次str，
+    避免 bytes -> base64 bytes -> str -> f-string 的多次整份复制。
+    """
+    view = memoryview(data)
+    size = len(view)
+    prefix_len = len(DATA_URL_PREFIX)
+    buffer = bytearray(prefix_len + 4 * ((size + 2) // 3))
+    buffer[:prefix_len] = DATA_URL_PREFIX
+    pos = prefix_len
+    for start in range(0, size, BASE64_CHUNK_SIZE):
+        encoded = binascii.b2a_base64(view[start:start + BASE64_CHUNK_SIZE], newline=False)
+        buffer[pos:pos + len(encoded)] = encoded
+        pos += len(encoded)
+    return buffer.decode('ascii')
+
 
 class ImageClassifier:
     def __init__(self, api_base_url=None, api_key=None, model_name='qwen-vl-plus-latest', 
-                 classification_prompt=None, valid_categories=None, max_workers=4):
+                 classification_prompt=None, valid_categories=None, max_workers=4,
+                 use_stream=None, endpoints=None, index_path=None, preprocess_processes=None,
+                 stats_path=None):
         # 尝试从环境变量加载默认配置（如果未提供参数）
         if api_base_url is None or api_key is None or classification_prompt is None:
             load_dotenv()
@@ -31,10 +297,77 @@ class ImageClassifier:
         
         # 并发配置
         self.max_workers = max_workers
+        # 同时在途（执行中+排队中）的任务上限，避免大批量时一次性提交全部任务
+        self.max_pending_tasks = int(os.getenv('MAX_PENDING_TASKS', str(max_workers * 2)))
+        # 内存上限（MB），超过时暂停提交新任务直到在途任务完成，0表示不限制
+        self.memory_limit_mb = float(os.getenv('MEMORY_LIMIT_MB', '0'))
+        
+        # 流式响应配置：匹配到类别后立即中止生成，减少尾部延迟和输出token
+        if use_stream is None:
+            use_stream = os.getenv('USE_STREAM', 'false').lower() == 'true'
+        self.use_stream = use_stream
         
         # 图片处理配置
-        self.max_image_size = (1024, 1024)  # 最大图片尺寸
+        max_side = int(os.getenv('MAX_IMAGE_SIZE', '1024'))
+        self.max_image_size = (max_side, max_side)  # 最大图片尺寸
+        # 内嵌EXIF缩略图不小于目标尺寸时直接使用，跳过原图解码
+        self.use_exif_thumbnail = os.getenv('USE_EXIF_THUMBNAIL', 'true').lower() == 'true'
+        # 动图抽取的代表帧数，拼成网格图发送，1表示只使用第一帧
+        self.animation_frames = int(os.getenv('ANIMATION_FRAMES', '4'))
         self.jpeg_quality = 85  # JPEG压缩质量
+        # 预处理进程数：大于0时在进程池中解码和缩放图片，绕开GIL，0表示在当前线程中处理
+        if preprocess_processes is None:
+            preprocess_processes = int(os.getenv('PREPROCESS_PROCESSES', '0'))
+        self.preprocess_processes = preprocess_processes
+        self.preprocess_pool = None
+        self.preprocess_pool_lock = Lock()
+        
+        # 预检：提交前只读文件头检查格式、尺寸和完整性，损坏或不支持的文件移入隔离目录
+        self.preflight_enabled = os.getenv('PREFLIGHT', 'true').lower() == 'true'
+        self.preflight_workers = int(os.getenv('PREFLIGHT_WORKERS', '8'))
+        # 超过该像素数的图片视为无法处理，默认与Pillow的解压炸弹上限一致
+        max_pixels = os.getenv('PREFLIGHT_MAX_PIXELS') or 2 * (Image.MAX_IMAGE_PIXELS or 0)
+        self.max_pixels = int(float(max_pixels)) or sys.maxsize
+        # 超过该像素数的图片走缩小解码通道，并限制同时解码的数量
+        self.large_pixels = int(float(os.getenv('PREFLIGHT_LARGE_PIXELS', '40000000')))
+        self.large_images = set()
+        self.large_image_slots = BoundedSemaphore(max(int(os.getenv('LARGE_IMAGE_CONCURRENCY', '1')), 1))
+        self.quarantine_dir = os.getenv('QUARANTINE_DIR')
+        # 预处理失败时只在原图不超过该大小（MB）时发送原图
+        self.raw_fallback_max_mb = float(os.getenv('RAW_FALLBACK_MAX_MB', '4'))
+        
+        # 输出布局：flat平铺，hash/date在类别目录下分片并维护清单，适合单个类别有大量文件的情况
+        self.output_layout_mode = os.getenv('OUTPUT_LAYOUT', 'flat').lower()
+        self.output_shard_levels = int(os.getenv('OUTPUT_SHARD_LEVELS', '1'))
+        self.output_layouts = {}
+        
+        # 虚拟整理：只把分类结果写入清单（可选符号链接），不复制文件，之后用 --apply 一次性整理
+        self.virtual_organize = os.getenv('VIRTUAL_ORGANIZE', 'false').lower() == 'true'
+        self.virtual_manifest_path = os.getenv('VIRTUAL_MANIFEST')
+        self.virtual_symlinks = os.getenv('VIRTUAL_SYMLINKS', 'false').lower() == 'true'
+        self.manifest_writers = {}
+        
+        # 压缩包输入：直接读取输入目录中zip/tar包内的图片，不解压到磁盘
+        self.archive_input = os.getenv('ARCHIVE_INPUT', 'true').lower() == 'true'
+        # tar只能顺序读取，后台预读的数据量上限（MB）
+        self.archive_readahead_mb = float(os.getenv('ARCHIVE_READAHEAD_MB', '64'))
+        self.archive_max_member_mb = float(os.getenv('ARCHIVE_MAX_MEMBER_MB', '200'))
+        # 压缩包中图片的输出方式：files按类别输出为文件，archive按类别写入<类别>.zip
+        self.archive_output = os.getenv('ARCHIVE_OUTPUT', 'files').lower()
+        # 本次运行中有成员未读取或未保存的压缩包，清理输入文件夹时保留
+        self.incomplete_archives = set()
+        
+        # 远程输入（INPUT_DIR为http(s)://目录索引或s3://bucket/prefix）：并发预取，下载与分类重叠
+        self.prefetch_workers = int(os.getenv('PREFETCH_WORKERS', '4'))
+        self.prefetch_mb = float(os.getenv('PREFETCH_MB', '64'))
+        
+        # 调度策略：fifo按扫描顺序，smallest小图片优先，oldest修改时间早的优先；
+        # aging为每等待一秒提升的优先级（smallest下相当于1MB），避免后加入的图片长期饿死先到的大图片
+        self.priority_policy = os.getenv('PRIORITY_POLICY', 'fifo').lower()
+        if self.priority_policy not in PRIORITY_POLICIES:
+            print(f"未知的调度策略: {self.priority_policy}，使用fifo")
+            self.priority_policy = 'fifo'
+        self.priority_aging = float(os.getenv('PRIORITY_AGING', '0.1'))
         
         # 初始化OpenAI客户端（如果有必要的配置）
         self.client = None
@@ -47,143 +380,694 @@ class ImageClassifier:
             except Exception as e:
                 print(f"OpenAI客户端初始化失败: {str(e)}")
         
+        # 多端点配置：提供端点列表（或API_ENDPOINTS环境变量的JSON）时在端点间负载均衡和故障转移
+        self.endpoint_pool = None
+        endpoints = endpoints if endpoints is not None else os.getenv('API_ENDPOINTS')
+        if endpoints:
+            try:
+                self.endpoint_pool = EndpointPool.from_config(
+                    endpoints,
+                    default_model=self.model_name,
+                    failure_threshold=int(os.getenv('ENDPOINT_FAILURE_THRESHOLD', '3')),
+                    cooldown=float(os.getenv('ENDPOINT_COOLDOWN', '30')),
+                    health_check_interval=float(os.getenv('ENDPOINT_HEALTH_CHECK_INTERVAL', '0'))
+                )
+                print("已启用多端点:", [endpoint.name for endpoint in self.endpoint_pool.endpoints])
+            except Exception as e:
+                print(f"端点池初始化失败: {str(e)}")
+        
+        # 分类结果索引（SQLite），记录每张图片的分类结果、原始响应、模型和延迟
+        self.index = None
+        index_path = index_path or os.getenv('INDEX_DB_PATH')
+        if index_path:
+            try:
+                self.index = ClassificationIndex(index_path)
+            except Exception as e:
+                print(f"分类索引初始化失败: {str(e)}")
+        
+        # 按提示词缓存的系统消息，保证请求前缀逐字节一致
+        self.system_messages = {}
+        
+        # 描述模式：每张图片只请求一次描述并保存，类别变化后在本地按描述重新归类
+        self.caption_mode = os.getenv('CAPTION_MODE', 'false').lower() == 'true'
+        self.caption_prompt = os.getenv('CAPTION_PROMPT') or DEFAULT_CAPTION_PROMPT
+        if self.caption_mode and self.index is None:
+            print("描述模式需要配置INDEX_DB_PATH保存图片描述，已关闭描述模式")
+            self.caption_mode = False
+        
+        # 近邻索引：与已分类图片高度相似且近邻类别一致的图片在本地标注，不请求API
+        self.neighbors = None
+        self.neighbor_hits = 0
+        neighbor_path = os.getenv('NEIGHBOR_INDEX_PATH')
+        if neighbor_path:
+            try:
+                from feature_index import FeatureIndex
+                self.neighbors = FeatureIndex(
+                    neighbor_path,
+                    k=int(os.getenv('NEIGHBOR_K', '5')),
+                    max_distance=float(os.getenv('NEIGHBOR_MAX_DISTANCE', '0.35')),
+                    min_margin=float(os.getenv('NEIGHBOR_MIN_MARGIN', '0.6')),
+                    min_size=int(os.getenv('NEIGHBOR_MIN_SIZE', '50'))
+                )
+            except ImportError as e:
+                print(f"近邻索引需要安装numpy，已关闭: {str(e)}")
+        
+        # 实时统计（各类别数量、吞吐量、预计剩余时间），累计值持久化到STATS_PATH
+        self.stats = ClassificationStats(stats_path or os.getenv('STATS_PATH'))
+        
+        # 取消令牌：cancel()后丢弃排队任务、中止进行中的请求
+        self.cancel_token = CancellationToken()
+        # 取消后等待进行中任务结束的最长时间（秒）
+        self.cancel_grace = float(os.getenv('CANCEL_GRACE_PERIOD', '0.5'))
+        
+        # 单次请求截止时间，避免个别慢响应按客户端默认超时长时间占用线程
+        self.request_timeout = float(os.getenv('REQUEST_TIMEOUT', '60')) or None
+        # 对冲请求：额外请求数占总请求数的比例上限，0表示关闭
+        hedge_budget = float(os.getenv('HEDGE_BUDGET', '0'))
+        self.hedger = None
+        if hedge_budget > 0:
+            self.hedger = RequestHedger(
+                budget=hedge_budget,
+                percentile=float(os.getenv('HEDGE_PERCENTILE', '0.95')),
+                min_samples=int(os.getenv('HEDGE_MIN_SAMPLES', '20')),
+                max_workers=max_workers * 2
+            )
+        
+        # 用量与预算：按每百万token单价计算费用，配置了预算时在接近上限时减速、超出前停止
+        self.prices = (
+            float(os.getenv('PRICE_INPUT_PER_M', '0')),
+            float(os.getenv('PRICE_OUTPUT_PER_M', '0')),
+            float(os.getenv('PRICE_CACHED_PER_M') or os.getenv('PRICE_INPUT_PER_M', '0')),
+        )
+        self.budget = UsageBudget.from_env()
+        if self.budget is not None and self.use_stream and (self.budget.max_tokens or self.budget.max_cost):
+            # 流式请求提前中止时服务端不返回token用量，预算无法计数
+            print("配置了token或费用预算，已关闭流式请求（USE_STREAM）")
+            self.use_stream = False
+        # 当前线程正在处理的图片的用量累计（见track_usage）
+        self.usage_context = local()
+        
         # 初始化计数器锁
         self.counter_lock = Lock()
-        self.category_counter = {}
         
         print("有效的分类类别：", self.valid_categories)
 
-    def preprocess_image(self, image_path):
-        """预处理图片：调整大小和压缩"""
+    def preprocess_image(self, image_path, source_data=None):
+        """预处理图片：调整大小和压缩，返回内存中的JPEG数据（memoryview），失败时返回None
+        
+        source_data不为None时处理内存中的原图数据，image_path只用于显示。
+        """
         try:
-            # 打开图片
-            with Image.open(image_path) as img:
-                # 转换为RGB模式（处理RGBA等其他格式）
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # 获取原始大小
-                original_size = img.size
-                
-                # 计算调整后的大小（保持宽高比）
-                width, height = original_size
-                max_w, max_h = self.max_image_size
-                
-                if width > max_w or height > max_h:
-                    # 计算缩放比例
-                    ratio = min(max_w/width, max_h/height)
-                    new_size = (int(width*ratio), int(height*ratio))
-                    img = img.resize(new_size, Image.Resampling.LANCZOS)
-                
-                # 创建临时文件用于存储处理后的图片
-                temp_file = os.path.join(os.path.dirname(image_path), f"temp_{os.path.basename(image_path)}")
-                
-                # 保存压缩后的图片
-                img.save(temp_file, 'JPEG', quality=self.jpeg_quality, optimize=True)
-                
-                # 打印图片大小信息
-                original_size_mb = os.path.getsize(image_path) / (1024 * 1024)
-                processed_size_mb = os.path.getsize(temp_file) / (1024 * 1024)
-                print(f"图片大小: {original_size_mb:.1f}MB -> {processed_size_mb:.1f}MB")
-                
-                return temp_file
+            with self.decode_slot(image_path) as reducing_gap:
+                data = compress_image(
+                    image_source(image_path, source_data), self.max_image_size, self.jpeg_quality,
+                    self.use_exif_thumbnail, self.animation_frames, reducing_gap
+                ).getbuffer()
+            
+            # 打印图片大小信息
+            original_size = len(source_data) if source_data is not None else os.path.getsize(image_path)
+            original_size_mb = original_size / (1024 * 1024)
+            processed_size_mb = len(data) / (1024 * 1024)
+            print(f"图片大小: {original_size_mb:.1f}MB -> {processed_size_mb:.1f}MB")
+            
+            return data
                 
         except Exception as e:
             print(f"预处理图片时出错: {str(e)}")
-            return image_path
+            return None
+
+    @contextlib.contextmanager
+    def decode_slot(self, image_path):
+        """预检标记为超大的图片在解码期间占用一个名额，产出缩放时使用的reducing_gap"""
+        if image_path not in self.large_images:
+            yield None
+            return
+        with self.large_image_slots:
+            yield 2.0
+
+    def get_preprocess_pool(self):
+        """懒加载预处理进程池
+        
+        进程池在工作线程中创建，此时已有其他线程在运行；fork多线程进程可能使子进程死锁，
+        因此用forkserver（不支持时用spawn）启动子进程。
+        """
+        with self.preprocess_pool_lock:
+            if self.preprocess_pool is None:
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self.preprocess_pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.preprocess_processes,
+                    mp_context=multiprocessing.get_context(method),
+                    initializer=init_preprocess_worker
+                )
+            return self.preprocess_pool
+
+    @contextlib.contextmanager
+    def open_image_data(self, image_path, source_data=None):
+        """获取预处理后的JPEG数据，以memoryview形式在with块内有效
+        
+        启用进程池时直接引用共享内存（内存中的原图数据在当前线程处理）；
+        预处理失败时退回原始文件内容（原图不超过RAW_FALLBACK_MAX_MB时）。
+        """
+        if self.preprocess_processes > 0 and source_data is None:
+            shm = None
+            try:
+                with self.decode_slot(image_path) as reducing_gap:
+                    future = self.get_preprocess_pool().submit(
+                        preprocess_to_shared_memory, image_path, self.max_image_size,
+                        self.jpeg_quality, self.use_exif_thumbnail, self.animation_frames, reducing_gap
+                    )
+                    shm_name, size, original_size = future.result()
+                shm = shared_memory.SharedMemory(name=shm_name)
+                print(f"图片大小: {original_size / (1024 * 1024):.1f}MB -> {size / (1024 * 1024):.1f}MB")
+            except Exception as e:
+                # 进程池预处理失败时退回线程内处理
+                print(f"进程池预处理图片时出错: {str(e)}")
+            if shm is not None:
+                try:
+                    with shm.buf[:size] as view:
+                        yield view
+                finally:
+                    shm.close()
+                    shm.unlink()
+                return
+        
+        data = self.preprocess_image(image_path, source_data)
+        if data is None:
+            # 预处理失败时发送原始文件，过大的原图不发送
+            original_size = len(source_data) if source_data is not None else os.path.getsize(image_path)
+            if original_size > self.raw_fallback_max_mb * 1024 * 1024:
+                raise ValueError(f"预处理失败且原图超过 {self.raw_fallback_max_mb:g}MB，不发送原图")
+            if source_data is not None:
+                data = memoryview(source_data)
+            else:
+                with open(image_path, 'rb') as image_file:
+                    data = memoryview(image_file.read())
+        try:
+            yield data
+        finally:
+            data.release()
 
     def encode_image(self, image_path):
         """将图片转换为base64编码"""
-        # 首先预处理图片
-        processed_image_path = self.preprocess_image(image_path)
-        
         try:
-            # 读取并编码图片
-            with open(processed_image_path, 'rb') as image_file:
-                encoded = base64.b64encode(image_file.read()).decode('utf-8')
-            
-            # 如果是临时文件，则删除
-            if processed_image_path != image_path:
-                os.remove(processed_image_path)
-            
-            return encoded
+            with self.open_image_data(image_path) as data:
+                return base64.b64encode(data).decode('utf-8')
         except Exception as e:
             print(f"编码图片时出错: {str(e)}")
-            # 确保清理临时文件
-            if processed_image_path != image_path and os.path.exists(processed_image_path):
-                os.remove(processed_image_path)
             raise
 
+    def encode_image_url(self, image_path, source_data=None):
+        """将图片转换为可直接放入请求的data URL"""
+        try:
+            with self.open_image_data(image_path, source_data) as data:
+                return build_data_url(data)
+        except Exception as e:
+            print(f"编码图片时出错: {str(e)}")
+            raise
+
+    # 响应文本中的关键词与预定义类别的映射关系（按优先级排列）
+    category_mapping = {
+        '二次元': ['二次元', '动漫', '漫画', '插画', 'anime', '动画'],
+        '生活照片': ['生活', '日常', '照片', '风景', '人物', '自拍', '食物'],
+        '宠物': ['宠物', '猫', '狗', '喵', '汪', 'cat', 'dog'],
+        '工作': ['工作', '办公', '会议', '文档', '代码', '笔记', '项目'],
+        '表情包': ['表情包', '表情', 'meme', 'memes', '梗图', '搞笑', '笑话', '梗']
+    }
+
+    def match_word(self, word):
+        """返回单个词命中的最高优先级类别，未命中返回None"""
+        for category, keywords in self.category_mapping.items():
+            if any(keyword in word for keyword in keywords):
+                return category
+        return None
+
     def get_closest_category(self, response_text):
         """获取最接近的预定义类别"""
-        response_text = response_text.lower()
-        # 创建响应文本与预定义类别的映射关系
-        category_mapping = {
-            '二次元': ['二次元', '动漫', '漫画', '插画', 'anime', '动画'],
-            '生活照片': ['生活', '日常', '照片', '风景', '人物', '自拍', '食物'],
-            '宠物': ['宠物', '猫', '狗', '喵', '汪', 'cat', 'dog'],
-            '工作': ['工作', '办公', '会议', '文档', '代码', '笔记', '项目'],
-            '表情包': ['表情包', '表情', 'meme', 'memes', '梗图', '搞笑', '笑话', '梗']
-        }
-        
         # 遍历响应文本中的每个词
-        for word in response_text.split():
-            for category, keywords in category_mapping.items():
-                if any(keyword in word for keyword in keywords):
-                    return category
+        for word in WORD_SEPARATOR.split(response_text.lower()):
+            category = self.match_word(word)
+            if category:
+                return category
         
         # 如果没有找到匹配的类别，返回"其他"
         return "其他"
 
+    def match_partial_response(self, partial_text):
+        """判断流式响应的前缀是否已能唯一确定类别，未确定时返回None
+        
+        与get_closest_category的判定规则一致：一旦前缀给出的结果不会再被后续文本改变即返回。
+        """
+        words = [word for word in WORD_SEPARATOR.split(partial_text.lower()) if word]
+        if not words:
+            return None
+        
+        # 末尾不是分隔符时，最后一个词可能仍在生成中
+        finished_words = words if WORD_SEPARATOR.match(partial_text[-1]) else words[:-1]
+        for word in finished_words:
+            category = self.match_word(word)
+            if category:
+                return category
+        
+        # 未完成的词已命中最高优先级类别时，后续文本也无法改变结果
+        if len(finished_words) < len(words):
+            category = self.match_word(words[-1])
+            if category and category == next(iter(self.category_mapping)):
+                return category
+        return None
+
+    # 几乎出现在所有描述中的泛化关键词，权重较低，只在没有更具体的关键词时起决定作用
+    generic_keywords = {'照片', '人物', '生活', '日常'}
+
+    def map_description(self, description):
+        """把保存的图片描述映射到当前类别，无法映射时返回None
+        
+        关键词按整词匹配且每个只计一次：较长的关键词先匹配，已匹配的文字不再参与较短关键词的匹配
+        （“表情包”不会再计一次“表情”），英文关键词按单词边界匹配。类别名权重为2，泛化关键词为0.25，
+        其余为1，取得分最高的类别，得分相同时按类别顺序。
+        """
+        text = description.lower()
+        keywords = {}
+        for category in self.valid_categories:
+            for keyword in (category.lower(), *self.category_mapping.get(category, [])):
+                keywords.setdefault(keyword, category)
+        scores = {}
+        for keyword in sorted(keywords, key=len, reverse=True):
+            if keyword.isascii():
+                pattern = rf"(?<![a-z0-9]){re.escape(keyword)}(?![a-z0-9])"
+            else:
+                pattern = re.escape(keyword)
+            text, hits = re.subn(pattern, ' ', text)
+            if not hits:
+                continue
+            category = keywords[keyword]
+            if keyword in self.generic_keywords:
+                weight = 0.25
+            elif keyword == category.lower():
+                weight = 2.0
+            else:
+                weight = 1.0
+            scores[category] = scores.get(category, 0) + weight
+        if not scores:
+            return None
+        best = max(scores.values())
+        return next(category for category in self.valid_categories if scores.get(category) == best)
+
+    def system_message(self, prompt=None):
+        """返回放在消息最前面的固定指令（提示词和类别列表）
+        
+        按 (提示词, 类别) 缓存，每次请求复用同一对象，保证前缀逐字节一致以命中服务端的提示词缓存；
+        提示词或类别被修改后自动重新生成。
+        """
+        if prompt is None:
+            text = self.classification_prompt
+            if self.valid_categories:
+                text = f"{text}\n\n可选类别：{'、'.join(self.valid_categories + ['其他'])}"
+        else:
+            text = prompt
+        message = self.system_messages.get(text)
+        if message is None:
+            message = {"role": "system", "content": text}
+            self.system_messages[text] = message
+        return message
+
+    def build_messages(self, image_url, prompt=None):
+        """构建分类请求的消息列表，image_url为图片的data URL，prompt默认为分类提示词
+        
+        固定指令在前、图片在后，不同图片的请求共享相同的前缀。
+        """
+        return [
+            self.system_message(prompt),
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": image_url
+                        }
+                    }
+                ]
+            }
+        ]
+
+    def record_usage(self, usage):
+        """记录响应中的token用量，包括命中提示词缓存的输入token数和图片token数
+        
+        同时计入统计、预算，以及当前线程正在处理的图片（track_usage）。
+        """
+        if usage is None:
+            return
+        def field(obj, name):
+            # 批处理结果中的用量是字典，SDK响应中是对象
+            if obj is None:
+                return None
+            return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+        
+        details = field(usage, 'prompt_tokens_details')
+        # OpenAI/通义千问在prompt_tokens_details.cached_tokens中返回，DeepSeek使用prompt_cache_hit_tokens
+        cached = field(details, 'cached_tokens') or field(usage, 'prompt_cache_hit_tokens') or 0
+        image_tokens = field(details, 'image_tokens') or 0
+        prompt_tokens = field(usage, 'prompt_tokens') or 0
+        completion_tokens = field(usage, 'completion_tokens') or 0
+        cost = usage_cost(prompt_tokens, completion_tokens, cached, *self.prices)
+        self.stats.record_usage(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cached_tokens=cached,
+            image_tokens=image_tokens,
+            cost=cost
+        )
+        if self.budget is not None:
+            self.budget.record(prompt_tokens, completion_tokens, cached)
+        current = getattr(self.usage_context, 'usage', None)
+        if current is not None:
+            with self.counter_lock:
+                current['requests'] += 1
+                current['prompt'] += prompt_tokens
+                current['completion'] += completion_tokens
+                current['cached'] += cached
+                current['image'] += image_tokens
+                current['cost'] += cost
+
+    @contextlib.contextmanager
+    def track_usage(self, usage):
+        """在with块内把当前线程的请求用量累计到usage字典"""
+        previous = getattr(self.usage_context, 'usage', None)
+        self.usage_context.usage = usage
+        try:
+            yield usage
+        finally:
+            self.usage_context.usage = previous
+
+    def request_streaming_category(self, client, model_name, messages, token=None, timeout=None):
+        """以流式方式请求分类，匹配到类别后立即中止生成
+        
+        服务端在流的最后一个数据块中返回token用量，读完整个流时记录；提前中止时没有用量。
+        返回 (已接收的响应文本, 类别)
+        """
+        token = token or self.cancel_token
+        stream = client.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            stream=True,
+            stream_options={'include_usage': True},
+            timeout=timeout
+        )
+        response_text = ''
+        category = None
+        usage = None
+        # 之前的完整词都已检查过且未命中，每次只需检查最后一个词起的文本
+        tail = 0
+        # 取消时关闭流，中止阻塞中的读取
+        handle = token.register(stream.close)
+        try:
+            for chunk in stream:
+                usage = getattr(chunk, 'usage', None) or usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                response_text += delta
+                category = self.match_partial_response(response_text[tail:])
+                if category:
+                    break
+                for separator in WORD_SEPARATOR.finditer(delta):
+                    tail = len(response_text) - len(delta) + separator.end()
+        except Exception:
+            token.raise_if_cancelled()
+            raise
+        finally:
+            # 关闭连接，服务端随之停止生成剩余token
+            token.unregister(handle)
+            stream.close()
+        
+        self.record_usage(usage)
+        if category is None:
+            category = self.get_closest_category(response_text)
+        return response_text, category
+
+    def request_category(self, client, model_name, messages, token=None, timeout=None, stream=None):
+        """向指定客户端请求分类，返回 (响应文本, 类别)
+        
+        token为本次请求的取消令牌（默认使用全局令牌），timeout为本次请求的超时时间（秒），
+        stream为None时按use_stream配置决定是否使用流式请求
+        """
+        token = token or self.cancel_token
+        if self.use_stream if stream is None else stream:
+            return self.request_streaming_category(client, model_name, messages, token, timeout)
+        
+        # 准备API请求
+        try:
+            completion = client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                timeout=timeout
+            )
+        except Exception:
+            # 取消时连接被关闭导致的错误按取消处理
+            token.raise_if_cancelled()
+            raise
+        
+        self.record_usage(completion.usage)
+        
+        # 从 API响应中提取类别并匹配到预定义类别
+        response_text = completion.choices[0].message.content
+        return response_text, self.get_closest_category(response_text)
+
+    def request_with_failover(self, messages, token=None, timeout=None, stream=None):
+        """发送一次分类请求（配置了端点池时自动故障转移），返回 (响应文本, 类别, 模型)"""
+        if self.endpoint_pool is not None:
+            return self.endpoint_pool.call(
+                lambda endpoint: self.request_category(endpoint.client, endpoint.model_name,
+                                                       messages, token, timeout, stream)
+                + (endpoint.model_name,)
+            )
+        return self.request_category(self.client, self.model_name, messages, token, timeout, stream) + (self.model_name,)
+
+    def send_request(self, messages, stream=None):
+        """在截止时间内发送请求（启用对冲时由hedger调度），返回 (响应文本, 类别, 模型)"""
+        if self.hedger is not None:
+            # 对冲请求在hedger的线程中执行，用量仍计入当前图片
+            usage = getattr(self.usage_context, 'usage', None)
+            
+            def attempt(token, timeout):
+                with self.track_usage(usage):
+                    return self.request_with_failover(messages, token, timeout, stream)
+            
+            # 超过近期p95延迟仍未返回时发送对冲请求，先返回者获胜
+            return self.hedger.run(
+                attempt,
+                deadline=self.request_timeout,
+                parent_token=self.cancel_token
+            )
+        return self.request_with_failover(messages, timeout=self.request_timeout, stream=stream)
+
+    def classify_with_caption(self, image_path, source_data=None):
+        """描述模式下分类：优先使用已保存的描述，没有时请求一次描述并保存
+        
+        描述无法映射到当前类别时才用分类提示词再请求一次。返回 (响应文本, 类别, 模型)
+        """
+        digest = data_hash(source_data) if source_data is not None else file_hash(image_path)
+        caption = self.index.get_caption(digest)
+        if caption is None:
+            messages = self.build_messages(self.encode_image_url(image_path, source_data), self.caption_prompt)
+            self.cancel_token.raise_if_cancelled()
+            # 描述需要完整文本，不使用匹配到类别即中止的流式请求
+            description, _, model_name = self.send_request(messages, stream=False)
+            self.index.set_caption(digest, description, model_name)
+        else:
+            description, model_name = caption['description'], caption['model']
+        
+        category = self.map_description(description)
+        if category is not None:
+            return description, category, model_name
+        
+        self.cancel_token.raise_if_cancelled()
+        return self.send_request(self.build_messages(self.encode_image_url(image_path, source_data)))
+
     def classify_image(self, image_path):
         """使用VL API对单张图片进行分类"""
+        return self.classify_image_detailed(image_path)['category']
+
+    def classify_image_detailed(self, image_path, source_data=None):
+        """使用VL API对单张图片进行分类，返回包含类别、原始响应、模型和延迟的结果字典
+        
+        source_data不为None时分类内存中的图片数据（如压缩包成员），image_path只用于显示。
+        """
+        result = {'category': "其他", 'raw_response': None, 'model': None, 'latency': None, 'error': None}
         try:
             # 验证必要的配置
-            if not all([self.api_base_url, self.api_key, self.classification_prompt]):
+            has_api = self.endpoint_pool is not None or all([self.api_base_url, self.api_key])
+            if not (has_api and self.classification_prompt):
                 raise ValueError("缺少必要的配置：API_BASE_URL, API_KEY, CLASSIFICATION_PROMPT")
                 
             # 如果客户端未初始化，则初始化
-            if self.client is None:
+            if self.endpoint_pool is None and self.client is None:
                 self.client = OpenAI(
                     api_key=self.api_key,
                     base_url=self.api_base_url
                 )
             
-            # 读取并编码图片
-            base64_image = self.encode_image(image_path)
+            self.cancel_token.raise_if_cancelled()
+            if self.neighbors is not None:
+                start = time.monotonic()
+                features, prediction = self.predict_from_neighbors(image_path, source_data)
+                if prediction is not None:
+                    category, margin, distance = prediction
+                    result.update(category=category, model=NEIGHBOR_MODEL, latency=time.monotonic() - start,
+                                  raw_response=f"近邻投票领先 {margin:.2f}，最近距离 {distance:.3f}")
+                    print(f"图片 {os.path.basename(image_path)} 由近邻索引标注为: {category}")
+                    return result
+                # 请求API后把特征连同类别加入索引（见record_result）
+                result['features'] = features
             
-            # 准备API请求
-            completion = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
-                            },
-                            {
-                                "type": "text",
-                                "text": self.classification_prompt
-                            }
-                        ]
-                    }
-                ]
-            )
-            
-            # 从 API响应中提取类别并匹配到预定义类别
-            response_text = completion.choices[0].message.content
-            category = self.get_closest_category(response_text)
+            # 按预算放行，用量累计到本图片的结果中
+            result['usage'] = empty_tokens()
+            if self.budget is not None:
+                self.budget.acquire(self.cancel_token)
+            succeeded = False
+            try:
+                with self.track_usage(result['usage']):
+                    if self.caption_mode:
+                        start = time.monotonic()
+                        response_text, category, model_name = self.classify_with_caption(image_path, source_data)
+                    else:
+                        # 读取并编码图片
+                        messages = self.build_messages(self.encode_image_url(image_path, source_data))
+                        self.cancel_token.raise_if_cancelled()
+                        
+                        start = time.monotonic()
+                        response_text, category, model_name = self.send_request(messages)
+                succeeded = True
+            finally:
+                if self.budget is not None:
+                    self.budget.release(completed=succeeded or result['usage']['requests'] > 0)
+            result.update(category=category, raw_response=response_text, model=model_name,
+                          latency=time.monotonic() - start)
             print(f"图片 {os.path.basename(image_path)} 的原始响应: {response_text}")
             print(f"匹配到的类别: {category}")
-            return category
-                
+            return result
+        
+        except ClassificationCancelled:
+            raise
         except Exception as e:
             print(f"处理图片 {image_path} 时出错: {str(e)}")
-            return "其他"
+            result['error'] = str(e)
+            return result
+
+    def predict_from_neighbors(self, image_path, source_data=None):
+        """提取特征并查询近邻索引，返回 (特征向量, 预测结果或None)"""
+        try:
+            from feature_index import extract_features
+            features = extract_features(image_source(image_path, source_data))
+        except Exception as e:
+            print(f"提取图片特征时出错: {str(e)}")
+            return None, None
+        prediction = self.neighbors.predict(features)
+        if prediction is not None and prediction[0] not in self.valid_categories:
+            prediction = None
+        if prediction is not None:
+            with self.counter_lock:
+                self.neighbor_hits += 1
+        return features, prediction
+
+    def sync_neighbors(self, output_dir):
+        """把输出目录中已分类的图片同步到近邻索引（只为新增的图片提取特征）"""
+        if self.neighbors is None:
+            return
+        print("\n同步近邻索引...")
+        layout = self.output_layout(output_dir)
+        self.neighbors.sync({
+            path: category for category in self.valid_categories
+            for path in layout.list_category(category, IMAGE_EXTENSIONS)
+        })
+        self.neighbors.save()
+
+    def record_result(self, image_path, result, output_path=None, source_data=None):
+        """更新实时统计，并将分类结果写入索引（启用索引时）"""
+        try:
+            size = len(source_data) if source_data is not None else os.path.getsize(image_path)
+        except OSError:
+            size = 0
+        self.stats.record(result['category'], size, error=bool(result.get('error')))
+        
+        # API给出的类别作为新样本加入近邻索引，"其他"不作为近邻标签
+        features = result.get('features')
+        if (self.neighbors is not None and features is not None and output_path and os.path.isfile(output_path)
+                and not result.get('error') and result['category'] in self.valid_categories):
+            self.neighbors.add(features, result['category'], os.path.abspath(output_path))
+        
+        if self.index is None:
+            return
+        try:
+            self.index.add(
+                source_path=source_location(image_path),
+                output_path=os.path.abspath(output_path) if output_path else None,
+                file_hash=data_hash(source_data) if source_data is not None else file_hash(image_path),
+                file_size=size,
+                category=result['category'],
+                raw_response=result['raw_response'],
+                model=result['model'],
+                latency=result['latency'],
+                usage=result.get('usage')
+            )
+        except Exception as e:
+            print(f"写入分类索引时出错: {str(e)}")
+
+    def cancel(self):
+        """取消当前处理：丢弃排队中的任务，中止进行中的请求"""
+        self.cancel_token.cancel()
+        # 关闭HTTP连接，使阻塞中的非流式请求尽快返回（包括端点池和对冲请求使用的各端点客户端）
+        if self.client is not None:
+            try:
+                self.client.close()
+            except Exception:
+                pass
+            self.client = None
+        if self.endpoint_pool is not None:
+            self.endpoint_pool.reset_clients()
+
+    def reset_cancellation(self):
+        """开始新一轮处理前重置取消状态"""
+        if self.cancel_token.cancelled:
+            self.cancel_token = CancellationToken()
+
+    def close(self):
+        """释放分类器持有的资源（索引数据库、健康检查线程、预处理进程池），并保存统计和预算用量"""
+        self.stats.save()
+        if self.budget is not None:
+            self.budget.save()
+        if self.neighbors is not None and self.neighbors.dirty:
+            self.neighbors.save()
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+        if self.endpoint_pool is not None:
+            self.endpoint_pool.stop_health_checks()
+        if self.preprocess_pool is not None:
+            self.preprocess_pool.shutdown(wait=False, cancel_futures=True)
+            self.preprocess_pool = None
+        if self.hedger is not None:
+            self.hedger.shutdown()
+        for writer in self.manifest_writers.values():
+            writer.close()
+        self.manifest_writers = {}
+
+    def task_queue(self):
+        """按配置的调度策略创建待处理图片的优先级队列"""
+        return PriorityTaskQueue(self.priority_policy, self.priority_aging)
+
+    def memory_exceeded(self):
+        """当前内存是否超过配置的上限（先尝试回收一次）"""
+        if not self.memory_limit_mb:
+            return False
+        rss = current_rss_mb()
+        if rss is None or rss <= self.memory_limit_mb:
+            return False
+        gc.collect()
+        rss = current_rss_mb()
+        return rss is not None and rss > self.memory_limit_mb
 
     def process_single_image(self, args):
         """处理单张图片（用于并发处理）"""
@@ -191,37 +1075,244 @@ class ImageClassifier:
         image_path = os.path.join(input_dir, image_file)
         
         try:
+            # 已取消时直接丢弃排队中的任务
+            self.cancel_token.raise_if_cancelled()
+            
             # 获取分类
             with self.counter_lock:
                 print(f"\n正在处理: {image_file} ({index + 1}/{total})")
             
-            category = self.classify_image(image_path)
+            result = self.classify_image_detailed(image_path)
+            self.cancel_token.raise_if_cancelled()
             
-            # 更新计数器
-            with self.counter_lock:
-                self.category_counter[category] = self.category_counter.get(category, 0) + 1
+            # 复制文件（重名时追加序号），虚拟整理模式下只写清单
+            output_path = self.store_result(image_path, result, output_dir, image_file)
             
-            # 复制文件
-            category_dir = os.path.join(output_dir, category)
-            shutil.copy2(image_path, os.path.join(category_dir, image_file))
+            self.record_result(image_path, result, output_path)
             
             return True
+        except ClassificationCancelled:
+            return False
         except Exception as e:
             print(f"\n处理图片 {image_file} 时出错: {str(e)}")
+            self.stats.record(None, error=True)
+            return False
+
+    def process_member(self, args):
+        """处理压缩包或远程输入源中的一张图片（用于并发处理），数据在工作线程中读取"""
+        archive_path, member_name, load, output_dir, index, total, archive_output = args
+        source_path = os.path.join(archive_path, member_name)
+        display_name = f"{os.path.basename(archive_path.rstrip('/'))}/{member_name}"
+        stored = False
+        
+        try:
+            self.cancel_token.raise_if_cancelled()
+            data = load()
+            if self.preflight_enabled:
+                check = inspect_image(source_path, self.max_pixels, self.large_pixels, data)
+                if check['status'] == 'bad':
+                    print(f"预检未通过 {display_name}: {check['reason']}")
+                    quarantine([check], self.quarantine_dir or os.path.join(output_dir, '.quarantine'), move=False)
+                    self.stats.record(None, error=True)
+                    return False
+                if check['status'] == 'large':
+                    self.large_images.add(source_path)
+            
+            with self.counter_lock:
+                print(f"\n正在处理: {display_name} ({index + 1}/{total})")
+            
+            result = self.classify_image_detailed(source_path, data)
+            self.cancel_token.raise_if_cancelled()
+            
+            name = os.path.basename(member_name)
+            if archive_output is not None and not self.virtual_organize:
+                output_path = archive_output.add(result['category'], name, data)
+            else:
+                output_path = self.store_result(source_path, result, output_dir, name, data)
+            self.record_result(source_path, result, output_path, data)
+            stored = True
+            return True
+        except ClassificationCancelled:
+            return False
+        except Exception as e:
+            print(f"\n处理图片 {display_name} 时出错: {str(e)}")
+            self.stats.record(None, error=True)
             return False
+        finally:
+            if not stored:
+                self.incomplete_archives.add(archive_path)
 
-    def clean_input_directory(self, input_dir):
-        """清空输入文件夹，保留.gitkeep文件"""
+    def open_remote(self, location):
+        """列出远程输入源中的图片，返回PrefetchReader列表（列出失败时为空）"""
+        try:
+            return [PrefetchReader(
+                open_source(location), location, IMAGE_EXTENSIONS,
+                workers=self.prefetch_workers,
+                prefetch_bytes=int(self.prefetch_mb * 1024 * 1024),
+                max_member_bytes=int(self.archive_max_member_mb * 1024 * 1024)
+            )]
+        except ImportError as e:
+            print(f"读取S3兼容存储需要安装boto3: {str(e)}")
+        except Exception as e:
+            print(f"列出远程输入 {location} 时出错: {str(e)}")
+        return []
+
+    def open_archives(self, input_dir):
+        """打开输入目录中的压缩包，返回ArchiveReader列表"""
+        if not self.archive_input:
+            return []
+        readers = []
+        for name in sorted(os.listdir(input_dir)):
+            path = os.path.join(input_dir, name)
+            if not (os.path.isfile(path) and is_archive(name)):
+                continue
+            if self.virtual_organize:
+                # 清单按原图路径引用图片，压缩包内的图片无法在--apply时整理
+                print(f"虚拟整理模式不读取压缩包，已跳过: {name}")
+                self.incomplete_archives.add(path)
+                continue
+            try:
+                readers.append(ArchiveReader(
+                    path, IMAGE_EXTENSIONS,
+                    readahead_bytes=int(self.archive_readahead_mb * 1024 * 1024),
+                    max_member_bytes=int(self.archive_max_member_mb * 1024 * 1024)
+                ))
+            except (OSError, zipfile.BadZipFile) as e:
+                print(f"打开压缩包 {name} 时出错: {str(e)}")
+                self.incomplete_archives.add(path)
+        return readers
+
+    def store_result(self, image_path, result, output_dir, name=None, source_data=None):
+        """把图片放入类别目录并返回输出路径；虚拟整理模式下只写清单（和符号链接），返回None
+        
+        source_data不为None时写入内存中的图片数据，image_path只用于记录来源。
+        """
+        layout = self.output_layout(output_dir)
+        if not self.virtual_organize:
+            return layout.place(image_path, result['category'], name, data=source_data)
+        digest = data_hash(source_data) if source_data is not None else file_hash(image_path)
+        link_path = None
+        if self.virtual_symlinks and source_data is None:
+            try:
+                link_path = layout.place(image_path, result['category'], name, digest=digest, link=True)
+            except OSError as e:
+                print(f"创建符号链接时出错: {str(e)}")
+        self.manifest_writer(output_dir).add({
+            'source_path': source_location(image_path),
+            'file_hash': digest,
+            'file_size': len(source_data) if source_data is not None else os.path.getsize(image_path),
+            'category': result['category'],
+            'model': result['model'],
+            'latency': result['latency'],
+            'link_path': link_path,
+            'classified_at': time.time(),
+        })
+        return None
+
+    def manifest_path(self, output_dir):
+        return self.virtual_manifest_path or os.path.join(output_dir, 'manifest.jsonl')
+
+    def manifest_writer(self, output_dir):
+        """懒加载输出目录对应的虚拟整理清单"""
+        with self.counter_lock:
+            writer = self.manifest_writers.get(output_dir)
+            if writer is None:
+                writer = ManifestWriter(self.manifest_path(output_dir))
+                self.manifest_writers[output_dir] = writer
+            return writer
+
+    def apply_manifest(self, output_dir, manifest_path=None, move=None):
+        """按虚拟整理的清单一次性把图片复制（move为True时移动）到类别目录，替换清单中的符号链接"""
+        manifest_path = manifest_path or self.manifest_path(output_dir)
+        if move is None:
+            move = os.getenv('APPLY_MOVE', 'false').lower() == 'true'
+        print(f"\n=== 应用分类清单: {manifest_path} ===")
+        if not os.path.exists(manifest_path):
+            print("❌ 清单不存在！")
+            return None
+        rows = read_manifest(manifest_path)
+        layout = self.output_layout(output_dir)
+        summary = {'placed': 0, 'missing': 0, 'failed': 0}
+        
+        def apply_row(row):
+            link_path = row.get('link_path')
+            if link_path and os.path.islink(link_path):
+                os.remove(link_path)
+                layout.forget(link_path)
+            source_path = row['source_path']
+            if not os.path.exists(source_path):
+                return 'missing', source_path, None
+            return 'placed', source_path, layout.place(source_path, row['category'], move=move)
+        
+        placed = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(apply_row, row) for row in rows]
+            for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures),
+                               desc="应用清单", unit="张"):
+                try:
+                    outcome, source_path, output_path = future.result()
+                except Exception as e:
+                    print(f"整理图片时出错: {str(e)}")
+                    summary['failed'] += 1
+                    continue
+                summary[outcome] += 1
+                if output_path:
+                    placed[source_path] = output_path
+        if self.index is not None and placed:
+            self.index.set_output_paths(placed)
+        print(f"✓ 已整理 {summary['placed']} 张图片，原图不存在 {summary['missing']} 张，失败 {summary['failed']} 张")
+        return summary
+
+    def output_layout(self, output_dir):
+        """返回输出目录对应的布局（按目录缓存，同一目录共用重名检查的锁）"""
+        with self.counter_lock:
+            layout = self.output_layouts.get(output_dir)
+            if layout is None:
+                layout = OutputLayout(output_dir, self.output_layout_mode, self.output_shard_levels)
+                self.output_layouts[output_dir] = layout
+            return layout
+
+    def preflight(self, image_paths, output_dir, move_bad=True):
+        """并行预检图片文件头，返回可以处理的图片路径列表
+        
+        损坏、截断、不支持或尺寸超限的文件移入隔离目录（默认为输出目录下的.quarantine）并写入report.jsonl，
+        move_bad为False时只写报告、保留原文件；
+        超大图片记录到large_images，解码时走缩小解码通道。
+        """
+        if not self.preflight_enabled or not image_paths:
+            return list(image_paths)
+        results = inspect_images(image_paths, self.max_pixels, self.large_pixels, self.preflight_workers)
+        good = []
+        bad = []
+        for result in results:
+            if result['status'] == 'bad':
+                print(f"预检未通过 {os.path.basename(result['path'])}: {result['reason']}")
+                bad.append(result)
+                continue
+            if result['warning']:
+                print(f"预检警告 {os.path.basename(result['path'])}: {result['warning']}")
+            if result['status'] == 'large':
+                self.large_images.add(result['path'])
+            good.append(result['path'])
+        quarantine(bad, self.quarantine_dir or os.path.join(output_dir, '.quarantine'), move=move_bad)
+        return good
+
+    def clean_input_directory(self, input_dir, keep=()):
+        """清空输入文件夹，保留.gitkeep文件和keep中的文件（如有成员未处理的压缩包）"""
         print("\n4. 清理输入文件夹...")
+        keep = {os.path.abspath(path) for path in keep}
         try:
             # 获取所有文件
             files = os.listdir(input_dir)
             for file in files:
                 if file != '.gitkeep':  # 保留.gitkeep文件
                     file_path = os.path.join(input_dir, file)
+                    if os.path.abspath(file_path) in keep:
+                        print(f"保留未完整处理的压缩包: {file}")
+                        continue
                     if os.path.isfile(file_path):
                         os.remove(file_path)
-            print("✓ 输入文件夹已清空")
+            print("✓ 输入文件夹已清空" if not keep else "✓ 输入文件夹已清理")
         except Exception as e:
             print(f"清理输入文件夹时出错: {str(e)}")
 
@@ -240,59 +1331,690 @@ class ImageClassifier:
         
         # 获取所有图片文件
         print("\n2. 扫描图片文件...")
-        image_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
-        image_files = [
-            f for f in os.listdir(input_dir) 
-            if os.path.isfile(os.path.join(input_dir, f)) and 
-            f.lower().endswith(image_extensions)
-        ]
+        remote = is_remote(input_dir)
+        if remote:
+            # 远程输入源的图片在工作线程之前预取
+            image_files = []
+            readers = self.open_remote(input_dir)
+        else:
+            image_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+            image_files = [
+                f for f in os.listdir(input_dir) 
+                if os.path.isfile(os.path.join(input_dir, f)) and 
+                f.lower().endswith(image_extensions)
+            ]
+            self.incomplete_archives = set()
+            readers = self.open_archives(input_dir)
         
-        total_images = len(image_files)
-        if total_images == 0:
+        if not image_files and not readers:
             print("❌ 未找到任何图片文件！")
             return
-        print(f"✓ 找到 {total_images} 张图片待处理")
         
-        # 初始化计数器
-        self.category_counter = {category: 0 for category in self.valid_categories + ['其他']}
+        # 只读文件头预检，损坏和不支持的文件在请求API前隔离
+        checked = self.preflight([os.path.join(input_dir, f) for f in image_files], output_dir)
+        skipped = len(image_files) - len(checked)
+        image_files = [os.path.basename(path) for path in checked]
+        total_images = len(image_files)
+        for reader in readers:
+            count = reader.count()
+            total_images += count or 0
+            print(f"✓ {'远程输入' if remote else '压缩包'} {os.path.basename(reader.path.rstrip('/'))}: "
+                  + (f"{count} 张图片" if count is not None else "顺序读取，数量在读取过程中统计")
+                  + (f"，{len(reader.skipped)} 张超过大小上限已跳过" if reader.skipped else ""))
+        if total_images == 0 and all(reader.count() is not None for reader in readers):
+            print("❌ 没有可处理的图片文件！")
+            for reader in readers:
+                reader.close()
+            return
+        print(f"✓ 找到 {total_images} 张图片待处理" + (f"，{skipped} 张未通过预检已隔离" if skipped else ""))
+        archive_output = ArchiveOutput(output_dir) if readers and self.archive_output == 'archive' else None
         
-        # 准备并发处理参数
-        process_args = [
-            (image_file, input_dir, output_dir, index, total_images)
-            for index, image_file in enumerate(image_files)
-        ]
+        # 用已分类的图片更新近邻索引
+        self.sync_neighbors(output_dir)
+        self.neighbor_hits = 0
+        
+        # 初始化统计
+        self.stats.start_run(total_images, self.valid_categories + ['其他'])
         
-        # 使用线程池进行并发处理
+        # 使用线程池进行并发处理，在途任务数不超过max_pending_tasks
         print(f"\n3. 开始处理图片... (使用 {self.max_workers} 个并发线程)")
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            futures = [executor.submit(self.process_single_image, args) for args in process_args]
+        self.reset_cancellation()
+        max_pending = max(self.max_pending_tasks, self.max_workers)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        pending = set()
+        cancelled = False
+        with tqdm(total=total_images, desc="处理进度", unit="张") as progress:
             
-            # 使用tqdm显示总体进度
-            for _ in tqdm(
-                concurrent.futures.as_completed(futures),
-                total=len(futures),
-                desc="处理进度",
-                unit="张"
-            ):
-                pass
+            def tasks():
+                # 先按调度策略处理目录中的图片，再依次流式读取压缩包成员（按读取顺序）
+                queue = self.task_queue()
+                for image_file in image_files:
+                    queue.push(os.path.join(input_dir, image_file), image_file)
+                index = 0
+                while True:
+                    image_file = queue.pop()
+                    if image_file is None:
+                        break
+                    yield self.process_single_image, (image_file, input_dir, output_dir, index, total_images)
+                    index += 1
+                for reader in readers:
+                    sequential = reader.count() is None
+                    try:
+                        for member_name, load in reader:
+                            if sequential:
+                                self.stats.add_total()
+                                progress.total += 1
+                            yield self.process_member, (
+                                reader.path, member_name, load, output_dir, index, progress.total, archive_output
+                            )
+                            index += 1
+                    except (OSError, EOFError, tarfile.TarError, zipfile.BadZipFile) as e:
+                        print(f"读取 {os.path.basename(reader.path.rstrip('/'))} 时出错: {str(e)}")
+                        self.incomplete_archives.add(reader.path)
+                    # 超过大小上限被跳过的成员没有输出，压缩包不能删除
+                    if reader.skipped:
+                        self.incomplete_archives.add(reader.path)
+            
+            def wait_one():
+                # 等待至少一个任务完成，完成的future立即丢弃
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                pending.difference_update(done)
+                # 进度条读取实时统计
+                snapshot = self.stats.snapshot()
+                progress.update(snapshot['done'] - progress.n)
+                progress.set_postfix(错误=snapshot['errors'], 剩余=format_duration(snapshot['eta']))
+            
+            try:
+                for task, args in tasks():
+                    # 预算用尽后不再提交新任务，未处理的图片留在输入目录
+                    if self.budget is not None and self.budget.exhausted:
+                        break
+                    while len(pending) >= max_pending:
+                        wait_one()
+                    # 超过内存上限时先让在途任务排空
+                    while pending and self.memory_exceeded():
+                        wait_one()
+                    pending.add(executor.submit(task, args))
+                
+                while pending:
+                    wait_one()
+            except KeyboardInterrupt:
+                cancelled = True
+                print("\n正在取消...")
+                self.cancel()
+                # 丢弃排队中的任务，进行中的任务最多再等待cancel_grace秒
+                executor.shutdown(wait=False, cancel_futures=True)
+                concurrent.futures.wait(pending, timeout=self.cancel_grace)
+        executor.shutdown(wait=not cancelled)
+        for reader in readers:
+            reader.close()
+        if archive_output is not None:
+            archive_output.close()
+        total_images = progress.total
+        
+        if cancelled:
+            # 保存已完成部分的结果
+            if self.index is not None:
+                self.index.flush()
+            self.stats.save()
+            snapshot = self.stats.snapshot()
+            print(f"\n✗ 分类已取消：已完成 {snapshot['done']}/{total_images} 张，"
+                  f"结果保存在: {output_dir}")
+            return False
+        budget_stop = self.budget.exhausted if self.budget is not None else None
         
         # 打印分类统计
         print("\n=== 分类完成 ===")
         print("\n分类统计:")
+        snapshot = self.stats.snapshot()
         print("-" * 30)
         for category in self.valid_categories + ['其他']:
-            count = self.category_counter[category]
-            percentage = (count / total_images) * 100
+            count = snapshot['counts'].get(category, 0)
+            percentage = (count / max(total_images, 1)) * 100
             print(f"{category}: {count} 张图片 ({percentage:.1f}%)")
         print("-" * 30)
-        print(f"总计: {total_images} 张图片")
+        print(f"总计: {total_images} 张图片，失败 {snapshot['errors']} 张，"
+              f"耗时 {format_duration(snapshot['elapsed'])}，"
+              f"共 {snapshot['bytes'] / (1024 * 1024):.1f}MB")
+        self.stats.save()
+        
+        if self.endpoint_pool is not None:
+            self.endpoint_pool.print_stats()
+        if self.hedger is not None:
+            self.hedger.print_stats()
+        tokens = snapshot['tokens']
+        if tokens['requests']:
+            print(f"Token用量: 输入 {tokens['prompt']}（命中缓存 {tokens['cached']}，"
+                  f"{tokens['cached'] / max(tokens['prompt'], 1):.0%}，图片 {tokens['image']}），"
+                  f"输出 {tokens['completion']}，费用 {tokens['cost']:.4f}")
+        if self.budget is not None:
+            self.budget.save()
+            budget = self.budget.snapshot()
+            period = f"（{budget['period']}）" if budget['period'] else ''
+            print(f"预算用量{period}: "
+                  f"{budget['tokens']} token，费用 {budget['cost']:.4f}，{budget['images']} 张图片")
+        if self.neighbors is not None:
+            print(f"近邻索引本地标注 {self.neighbor_hits} 张，请求API {total_images - self.neighbor_hits} 张，"
+                  f"索引共 {len(self.neighbors)} 张")
+            self.neighbors.save()
+        
+        if self.index is not None:
+            self.index.flush()
         
-        # 如果配置为true，清空输入文件夹
-        if os.getenv('CLEAN_INPUT_AFTER_PROCESS', 'true').lower() == 'true':
-            self.clean_input_directory(input_dir)
+        # 如果配置为true，清空输入文件夹（虚拟整理模式下清单引用原图，不清空）
+        if self.virtual_organize:
+            for writer in self.manifest_writers.values():
+                writer.close()
+            self.manifest_writers = {}
+        elif os.getenv('CLEAN_INPUT_AFTER_PROCESS', 'true').lower() == 'true' and not remote and not budget_stop:
+            self.clean_input_directory(input_dir, keep=self.incomplete_archives)
         
+        if budget_stop:
+            print(f"\n✗ 已达到{budget_stop}，停止提交新图片：已完成 {snapshot['done']}/{total_images} 张，"
+                  f"未处理的图片保留在输入目录，调整预算后重新运行即可继续")
+            print(f"✓ 已完成部分的结果保存在: {output_dir}")
+            return False
         print("\n✓ 所有图片已完成分类！")
+        if self.virtual_organize:
+            print(f"✓ 分类清单保存在: {self.manifest_path(output_dir)}（使用 --apply 整理文件）")
+        else:
+            print(f"✓ 分类结果保存在: {output_dir}")
+        return True
+
+    def estimate_run(self, input_dir, output_dir, sample_size=20):
+        """运行前预估：分类随机抽取的少量图片（不复制文件），按样本的平均用量和延迟估算整批的token、费用和耗时
+        
+        只从通过预检的图片中抽样和估算（未通过的图片只写入报告，不移动）。
+        返回估算结果字典，没有图片时返回None。样本请求是真实请求，其用量计入统计和预算。
+        """
+        print("\n=== 预估用量 ===")
+        image_files = [
+            f for f in os.listdir(input_dir)
+            if os.path.isfile(os.path.join(input_dir, f)) and
+            f.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+        checked = self.preflight([os.path.join(input_dir, f) for f in image_files], output_dir, move_bad=False)
+        skipped = len(image_files) - len(checked)
+        image_files = [os.path.basename(path) for path in checked]
+        if not image_files:
+            print("❌ 未找到任何图片文件！")
+            return None
+        sample = random.sample(image_files, min(max(sample_size, 1), len(image_files)))
+        print(f"从 {len(image_files)} 张图片中抽取 {len(sample)} 张试分类..."
+              + (f"（{skipped} 张未通过预检，不计入估算）" if skipped else ""))
+        self.reset_cancellation()
+        
+        usage = empty_tokens()
+        latencies = []
+        for image_file in tqdm(sample, desc="试分类", unit="张"):
+            result = self.classify_image_detailed(os.path.join(input_dir, image_file))
+            if result['error']:
+                continue
+            for key, value in result.get('usage', {}).items():
+                usage[key] += value
+            if result['latency'] is not None:
+                latencies.append(result['latency'])
+        measured = len(latencies)
+        if not measured:
+            print("❌ 样本图片全部分类失败，无法估算")
+            return None
+        
+        total = len(image_files)
+        scale = total / measured
+        duration = sum(latencies) / measured * total / self.max_workers
+        if self.budget is not None and self.budget.images_per_hour:
+            duration = max(duration, total / self.budget.images_per_hour * 3600)
+        estimate = {
+            'images': total,
+            'sample': measured,
+            'prompt_tokens': int(usage['prompt'] * scale),
+            'completion_tokens': int(usage['completion'] * scale),
+            'cached_tokens': int(usage['cached'] * scale),
+            'cost': usage['cost'] * scale,
+            'duration': duration,
+        }
+        print("-" * 30)
+        print(f"预计输入token: {estimate['prompt_tokens']}（命中缓存 {estimate['cached_tokens']}）")
+        print(f"预计输出token: {estimate['completion_tokens']}")
+        print(f"预计费用: {estimate['cost']:.4f}")
+        print(f"预计耗时: {format_duration(duration)}（{self.max_workers} 个并发线程）")
+        print("-" * 30)
+        if self.budget is not None:
+            tokens = estimate['prompt_tokens'] + estimate['completion_tokens']
+            if self.budget.max_tokens and tokens > self.budget.max_tokens:
+                print(f"⚠ 预计token超出预算 {self.budget.max_tokens}，"
+                      f"约可处理 {int(total * self.budget.max_tokens / tokens)} 张")
+            if self.budget.max_cost and estimate['cost'] > self.budget.max_cost:
+                print(f"⚠ 预计费用超出预算 {self.budget.max_cost:g}，"
+                      f"约可处理 {int(total * self.budget.max_cost / estimate['cost'])} 张")
+        return estimate
+
+    def get_batch_client(self):
+        """返回批处理使用的 (客户端, 模型名)，配置了端点池时使用第一个端点"""
+        if self.endpoint_pool is not None:
+            endpoint = self.endpoint_pool.endpoints[0]
+            return endpoint.client, endpoint.model_name
+        if not all([self.api_base_url, self.api_key]):
+            raise ValueError("缺少必要的配置：API_BASE_URL, API_KEY")
+        if self.client is None:
+            self.client = OpenAI(api_key=self.api_key, base_url=self.api_base_url)
+        return self.client, self.model_name
+
+    def organize_directory_batch(self, input_dir, output_dir, work_dir=None):
+        """通过批处理接口整理图片目录，适合不关心延迟、只关心成本的大批量离线任务
+        
+        预处理后的请求写入JSONL文件并提交，轮询到批次结束后按类别映射复制文件。
+        任务状态保存在work_dir中，中断后再次运行会继续轮询已提交的批次，不会重复提交。
+        """
+        print("\n=== 开始图片分类（批处理模式） ===")
+        work_dir = work_dir or os.getenv('BATCH_WORK_DIR') or os.path.join(output_dir, '.batch')
+        state_path = os.path.join(work_dir, 'state.json')
+        client, model_name = self.get_batch_client()
+        job = BatchJob(client, poll_interval=float(os.getenv('BATCH_POLL_INTERVAL', '60')))
+        
+        print("\n1. 准备目录...")
+        os.makedirs(output_dir, exist_ok=True)
+        for category in self.valid_categories + ['其他']:
+            os.makedirs(os.path.join(output_dir, category), exist_ok=True)
+        
+        def save_state():
+            temp_path = f"{state_path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(temp_path, state_path)
+        
+        if os.path.exists(state_path):
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            input_dir = state['input_dir']
+            print(f"✓ 继续未完成的批处理任务: {work_dir}")
+        else:
+            print("\n2. 生成批处理请求...")
+            image_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+            image_files = [
+                f for f in os.listdir(input_dir)
+                if os.path.isfile(os.path.join(input_dir, f)) and
+                f.lower().endswith(image_extensions)
+            ]
+            image_files = [
+                os.path.basename(path) for path in
+                self.preflight([os.path.join(input_dir, f) for f in image_files], output_dir)
+            ]
+            if not image_files:
+                print("❌ 未找到任何图片文件！")
+                return
+            
+            writer = BatchFileWriter(
+                work_dir,
+                max_requests=int(os.getenv('BATCH_MAX_REQUESTS', '50000')),
+                max_bytes=int(float(os.getenv('BATCH_MAX_MB', '190')) * 1024 * 1024)
+            )
+            items = {}
+            skipped = 0
+            try:
+                for index, image_file in enumerate(tqdm(image_files, desc="生成请求", unit="张")):
+                    try:
+                        image_url = self.encode_image_url(os.path.join(input_dir, image_file))
+                    except Exception as e:
+                        print(f"编码图片 {image_file} 时出错: {str(e)}")
+                        skipped += 1
+                        continue
+                    custom_id = f"img-{index}"
+                    writer.add(custom_id, model_name, self.build_messages(image_url))
+                    items[custom_id] = image_file
+            finally:
+                writer.close()
+            state = {
+                'input_dir': input_dir,
+                'model': model_name,
+                'items': items,
+                'skipped': skipped,  # 编码失败、没有提交的图片数
+                'stored': [],  # 已放入类别目录的请求
+                'batches': [{'path': path, 'id': None, 'applied': False} for path in writer.paths],
+            }
+            save_state()
+            print(f"✓ 已生成 {len(items)} 个请求，共 {len(writer.paths)} 个批次")
+        
+        items = state['items']
+        stored = set(state.setdefault('stored', []))
+        max_retries = int(os.getenv('BATCH_MAX_RETRIES', '3'))
+        self.stats.start_run(len(items), self.valid_categories + ['其他'])
+        self.reset_cancellation()
+        
+        def requeue(entry, returned):
+            """把批次中没有返回结果的请求写入新的批次文件，返回重新提交的请求数"""
+            path = os.path.join(work_dir, f"retry_{len(state['batches']):03d}.jsonl")
+            count = 0
+            with open(entry['path'], 'rb') as f, open(path, 'wb') as out:
+                for line in f:
+                    if line.strip() and json.loads(line)['custom_id'] not in returned:
+                        out.write(line)
+                        count += 1
+            if count:
+                state['batches'].append({'path': path, 'id': None, 'applied': False,
+                                         'attempt': entry.get('attempt', 0) + 1})
+            else:
+                os.remove(path)
+            return count
+        
+        print("\n3. 提交并等待批处理完成...")
+        try:
+            for entry in state['batches']:
+                if entry['applied']:
+                    continue
+                if entry['id'] is None:
+                    if self.budget is not None:
+                        with open(entry['path'], 'r', encoding='utf-8') as f:
+                            pending = sum(1 for line in f if line.strip())
+                        reason = self.budget.check(pending)
+                        if reason:
+                            raise BudgetExceeded(f"提交批次 {os.path.basename(entry['path'])} 将超出{reason}")
+                    entry['id'] = job.submit(entry['path'])
+                    save_state()
+                    print(f"✓ 已提交批次 {entry['id']}")
+                batch = job.wait(entry['id'], self.cancel_token)
+                if batch.status == 'failed':
+                    # 下次运行时重新提交
+                    print(f"❌ 批次 {entry['id']} 失败: {batch.errors}")
+                    entry['id'] = None
+                    save_state()
+                    continue
+                
+                # 过期或被取消的批次只返回已完成部分的结果，其余请求重新提交
+                returned = set()
+                for custom_id, response_text, error, usage in job.results(batch):
+                    image_file = items.get(custom_id)
+                    if image_file is None:
+                        continue
+                    returned.add(custom_id)
+                    if custom_id in stored:
+                        continue
+                    image_usage = empty_tokens()
+                    with self.track_usage(image_usage):
+                        self.record_usage(usage)
+                    if self.budget is not None and usage:
+                        self.budget.add_images(1)
+                    image_path = os.path.join(input_dir, image_file)
+                    category = self.get_closest_category(response_text) if response_text else "其他"
+                    result = {'category': category, 'raw_response': response_text,
+                              'model': state['model'], 'latency': None, 'error': error, 'usage': image_usage}
+                    if error:
+                        print(f"处理图片 {image_file} 时出错: {error}")
+                    try:
+                        output_path = self.store_result(image_path, result, output_dir, image_file)
+                    except OSError as e:
+                        print(f"复制图片 {image_file} 时出错: {str(e)}")
+                        continue
+                    self.record_result(image_path, result, output_path)
+                    stored.add(custom_id)
+                if entry.get('attempt', 0) < max_retries:
+                    missing = requeue(entry, returned)
+                    if missing:
+                        print(f"批次 {entry['id']}（{batch.status}）缺少 {missing} 个结果，已重新排队")
+                entry['applied'] = True
+                state['stored'] = sorted(stored)
+                save_state()
+        except BudgetExceeded as e:
+            print(f"\n✗ {e}，未提交的批次保留在 {work_dir}，调整预算后重新运行即可继续")
+            if self.index is not None:
+                self.index.flush()
+            self.stats.save()
+            if self.budget is not None:
+                self.budget.save()
+            return False
+        except (KeyboardInterrupt, ClassificationCancelled):
+            print(f"\n✗ 已停止等待，已提交的批次会继续在服务端处理，重新运行即可继续: {work_dir}")
+            if self.index is not None:
+                self.index.flush()
+            self.stats.save()
+            return False
+        
+        snapshot = self.stats.snapshot()
+        if self.index is not None:
+            self.index.flush()
+        self.stats.save()
+        if not all(entry['applied'] for entry in state['batches']):
+            print(f"\n✗ 部分批次失败，重新运行将重新提交: {work_dir}")
+            return True
+        
+        print("\n=== 分类完成 ===")
+        print("-" * 30)
+        for category in self.valid_categories + ['其他']:
+            print(f"{category}: {snapshot['counts'].get(category, 0)} 张图片")
+        print("-" * 30)
+        print(f"总计: {snapshot['done']} 张图片，失败 {snapshot['errors']} 张")
+        shutil.rmtree(work_dir, ignore_errors=True)
+        
+        # 只有所有图片都已放入类别目录时才清空输入文件夹
+        incomplete = len(items) - len(stored & set(items)) + state.get('skipped', 0)
+        if incomplete:
+            print(f"\n✗ {incomplete} 张图片没有得到结果或未能保存，输入文件夹未清空，重新运行即可处理")
+        elif (os.getenv('CLEAN_INPUT_AFTER_PROCESS', 'true').lower() == 'true'
+                and not self.virtual_organize):
+            # 批处理模式不读取压缩包，压缩包保留在输入文件夹中
+            archives = [
+                os.path.join(input_dir, f) for f in os.listdir(input_dir)
+                if os.path.isfile(os.path.join(input_dir, f)) and is_archive(f)
+            ]
+            if archives:
+                print(f"批处理模式不读取压缩包，{len(archives)} 个压缩包未处理")
+            self.clean_input_directory(input_dir, keep=archives)
         print(f"✓ 分类结果保存在: {output_dir}")
+        return True
+
+    def recategorize_output(self, output_dir):
+        """类别或提示词变化后按已保存的图片描述重新整理输出目录
+        
+        有描述且能映射到当前类别的图片只在本地移动；没有描述或无法映射的图片才重新请求API。
+        API请求失败的图片留在原类别目录并计为失败。
+        返回 {'local': 本地归类数, 'api': 请求API数, 'moved': 移动数, 'failed': 失败数}
+        """
+        print("\n=== 重新归类输出目录 ===")
+        if self.index is None:
+            print("❌ 重新归类需要配置INDEX_DB_PATH")
+            return None
+        categories = self.valid_categories + ['其他']
+        for category in categories:
+            os.makedirs(os.path.join(output_dir, category), exist_ok=True)
+        
+        layout = self.output_layout(output_dir)
+        image_paths = []
+        for category in layout.categories():
+            image_paths.extend(layout.list_category(category, IMAGE_EXTENSIONS))
+        self.stats.start_run(len(image_paths), categories)
+        self.reset_cancellation()
+        summary = {'local': 0, 'api': 0, 'moved': 0, 'failed': 0}
+        
+        def place(image_path, result):
+            # 请求失败时类别回退为“其他”，不能据此把已归类的图片移走
+            if result.get('error'):
+                with self.counter_lock:
+                    summary['failed'] += 1
+                self.stats.record(None, error=True)
+                return
+            # 移动到新类别目录，与已有文件重名时追加序号
+            target_path = image_path
+            if layout.split(image_path)[0] != result['category']:
+                target_path = layout.place(image_path, result['category'], move=True)
+                layout.forget(image_path)
+                with self.counter_lock:
+                    summary['moved'] += 1
+            self.record_result(target_path, result, target_path)
+        
+        # 第一遍：按已保存的描述在本地归类
+        unresolved = []
+        for image_path in tqdm(image_paths, desc="本地归类", unit="张"):
+            caption = self.index.get_caption(file_hash(image_path))
+            category = self.map_description(caption['description']) if caption else None
+            if category is None:
+                unresolved.append(image_path)
+                continue
+            summary['local'] += 1
+            place(image_path, {'category': category, 'raw_response': caption['description'],
+                               'model': caption['model'], 'latency': None, 'error': None})
+        
+        # 第二遍：没有描述或无法映射的图片重新请求API
+        if unresolved:
+            print(f"\n{len(unresolved)} 张图片需要重新请求API...")
+            
+            def classify_and_place(image_path):
+                result = self.classify_image_detailed(image_path)
+                with self.counter_lock:
+                    summary['api'] += 1
+                place(image_path, result)
+            
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [executor.submit(classify_and_place, path) for path in unresolved]
+                for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures),
+                                   desc="请求API", unit="张"):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(f"重新归类图片时出错: {str(e)}")
+        
+        # 删除已不在类别列表中的空目录（包括空的分片和清单）
+        for category in layout.categories():
+            if category in categories:
+                continue
+            category_dir = os.path.join(output_dir, category)
+            if any(layout.walk_category(category, IMAGE_EXTENSIONS)):
+                continue
+            manifest_path = os.path.join(category_dir, MANIFEST_NAME)
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+            for root, _, _ in os.walk(category_dir, topdown=False):
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    pass
+        if self.index is not None:
+            self.index.flush()
+        self.stats.save()
+        self.sync_neighbors(output_dir)
+        print(f"✓ 重新归类完成：本地归类 {summary['local']} 张，请求API {summary['api']} 张，"
+              f"移动 {summary['moved']} 张，失败 {summary['failed']} 张")
+        return summary
+
+    def migrate_output(self, output_dir):
+        """把已有的输出目录迁移到当前配置的布局（OUTPUT_LAYOUT），并同步索引中的输出路径"""
+        layout = self.output_layout(output_dir)
+        print(f"\n=== 迁移输出目录到 {layout.mode} 布局 ===")
+        moved = layout.migrate(IMAGE_EXTENSIONS)
+        if self.index is not None and moved:
+            self.index.move_outputs(moved)
+        if self.neighbors is not None and moved:
+            self.neighbors.rename(moved)
+            self.neighbors.save()
+        print(f"✓ 迁移完成：移动 {len(moved)} 张图片")
+        return moved
+
+    def watch_directory(self, input_dir, output_dir, debounce=None, poll_interval=None):
+        """常驻监听输入目录，新图片写入完成后立即提交到线程池分类
+        
+        进程、API连接和线程池保持常驻，按Ctrl+C退出。
+        """
+        debounce = debounce if debounce is not None else float(os.getenv('WATCH_DEBOUNCE', '1.0'))
+        poll_interval = poll_interval if poll_interval is not None else float(os.getenv('WATCH_POLL_INTERVAL', '1.0'))
+        clean_input = (os.getenv('CLEAN_INPUT_AFTER_PROCESS', 'true').lower() == 'true'
+                       and not self.virtual_organize)
+        
+        print("\n=== 监听模式 ===")
+        os.makedirs(input_dir, exist_ok=True)
+        os.makedirs(output_dir, exist_ok=True)
+        for category in self.valid_categories + ['其他']:
+            os.makedirs(os.path.join(output_dir, category), exist_ok=True)
+        self.sync_neighbors(output_dir)
+        self.stats.start_run(0, self.valid_categories + ['其他'])
+        self.reset_cancellation()
+        
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        # 就绪的图片先进入优先级队列，在途任务未满时按调度策略提交；排队中只保存路径
+        queue = self.task_queue()
+        max_pending = max(self.max_pending_tasks, self.max_workers)
+        in_flight = set()  # 排队中和处理中的图片
+        futures = set()
+        submitted = [0]
+        
+        def dispatch():
+            while not self.cancel_token.cancelled:
+                with self.counter_lock:
+                    running = len(futures)
+                # 内存超限时等待其他在途任务完成
+                if running >= max_pending or (running and self.memory_exceeded()):
+                    return
+                with self.counter_lock:
+                    if len(futures) >= max_pending:
+                        return
+                    image_path = queue.pop()
+                    if image_path is None:
+                        return
+                    index = submitted[0]
+                    submitted[0] += 1
+                    args = (os.path.basename(image_path), input_dir, output_dir, index, index + 1)
+                    try:
+                        future = executor.submit(self.process_single_image, args)
+                    except RuntimeError:
+                        # 线程池已关闭
+                        return
+                    futures.add(future)
+                future.add_done_callback(lambda f, image_path=image_path: on_done(image_path, f))
+        
+        def on_done(image_path, future):
+            with self.counter_lock:
+                in_flight.discard(image_path)
+                futures.discard(future)
+            # 处理成功后从输入目录移除，使同名新文件能被再次处理
+            if not future.cancelled() and future.result() and clean_input:
+                try:
+                    os.remove(image_path)
+                except OSError as e:
+                    print(f"删除已处理文件 {image_path} 时出错: {str(e)}")
+                watcher.forget(image_path)
+            if self.index is not None:
+                self.index.flush()
+            dispatch()
+        
+        def on_file_ready(image_path):
+            with self.counter_lock:
+                if image_path in in_flight:
+                    return
+            if not self.preflight([image_path], output_dir):
+                watcher.forget(image_path)
+                return
+            with self.counter_lock:
+                if image_path in in_flight:
+                    return
+                in_flight.add(image_path)
+                self.stats.add_total()
+            queue.push(image_path)
+            dispatch()
+        
+        watcher = FolderWatcher(input_dir, on_file_ready, debounce=debounce, poll_interval=poll_interval)
+        print(f"✓ 正在监听 {input_dir}，分类结果保存在 {output_dir}（按 Ctrl+C 退出）")
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            print("\n正在停止监听...")
+            self.cancel()
+        finally:
+            watcher.stop()
+            cancelled = self.cancel_token.cancelled
+            # 正常结束时处理完排队中的图片
+            while not cancelled and len(queue):
+                with self.counter_lock:
+                    remaining = list(futures)
+                if not remaining:
+                    dispatch()
+                concurrent.futures.wait(remaining, timeout=0.5, return_when=concurrent.futures.FIRST_COMPLETED)
+            # 取消时丢弃排队中的任务，进行中的任务最多再等待cancel_grace秒
+            executor.shutdown(wait=False, cancel_futures=cancelled)
+            with self.counter_lock:
+                remaining = list(futures)
+            concurrent.futures.wait(remaining, timeout=self.cancel_grace if cancelled else None)
+            if self.index is not None:
+                self.index.flush()
+            self.stats.save()
+            print(f"✓ 监听结束，共处理 {submitted[0]} 张图片")
 
 def main():
     # 使用示例
@@ -302,11 +2024,66 @@ def main():
     input_dir = os.getenv('INPUT_DIR', 'images/input')
     output_dir = os.getenv('OUTPUT_DIR', 'images/output')
     
-    if not os.path.exists(input_dir):
+    # 监听模式：常驻进程，增量分类新加入的图片
+    if '--watch' in sys.argv[1:] or os.getenv('WATCH_MODE', 'false').lower() == 'true':
+        if is_remote(input_dir):
+            print("监听模式只支持本地输入目录！")
+            return
+        classifier.watch_directory(input_dir, output_dir)
+        classifier.close()
+        if classifier.cancel_token.cancelled:
+            os._exit(130)
+        return
+    
+    # 虚拟整理：只写分类清单，不复制文件
+    if '--virtual' in sys.argv[1:]:
+        classifier.virtual_organize = True
+    
+    # 应用虚拟整理的清单：按清单一次性整理文件
+    if '--apply' in sys.argv[1:]:
+        classifier.apply_manifest(output_dir)
+        classifier.close()
+        return
+    
+    # 迁移输出目录：把已有的输出目录整理为OUTPUT_LAYOUT配置的布局
+    if '--migrate-layout' in sys.argv[1:]:
+        classifier.migrate_output(output_dir)
+        classifier.close()
+        return
+    
+    # 重新归类：类别变化后按已保存的描述重新整理输出目录
+    if '--recategorize' in sys.argv[1:]:
+        classifier.recategorize_output(output_dir)
+        classifier.close()
+        return
+    
+    if not is_remote(input_dir) and not os.path.exists(input_dir):
         print("输入目录不存在！")
         return
+    
+    # 运行前预估：试分类少量样本，估算整批的token、费用和耗时，不整理文件
+    if '--estimate' in sys.argv[1:]:
+        if is_remote(input_dir):
+            print("预估只支持本地输入目录！")
+            return
+        classifier.estimate_run(input_dir, output_dir, int(os.getenv('ESTIMATE_SAMPLE', '20')))
+        classifier.close()
+        return
+    
+    # 批处理模式：提交到服务端批处理接口，适合大批量离线任务
+    if '--batch' in sys.argv[1:] or os.getenv('BATCH_MODE', 'false').lower() == 'true':
+        if is_remote(input_dir):
+            print("批处理模式只支持本地输入目录！")
+            return
+        classifier.organize_directory_batch(input_dir, output_dir)
+        classifier.close()
+        return
         
-    classifier.organize_directory(input_dir, output_dir)
+    completed = classifier.organize_directory(input_dir, output_dir)
+    classifier.close()
+    if completed is False:
+        # 取消后不再等待仍阻塞在网络请求中的工作线程（解释器退出时会逐个join）
+        os._exit(130)
 
 if __name__ == "__main__":
     main()
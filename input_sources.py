@@ -0,0 +1,161 @@
+import os
+import json
+import threading
+import concurrent.futures
+import urllib.request
+from collections import deque
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse, unquote, quote
+
+
+def is_remote(location):
+    return location.startswith(('http://', 'https://', 's3://'))
+
+
+class LinkParser(HTMLParser):
+    """收集目录索引页面中的链接"""
+    def __init__(self):
+        super().__init__()
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            href = dict(attrs).get('href')
+            if href:
+                self.links.append(href)
+
+
+class HttpIndexSource:
+    """HTTP目录索引：列出索引页面（HTML链接或JSON列表）中的图片，逐个下载
+
+    JSON索引可以是URL/文件名字符串列表，或包含url（或name）和可选size字段的对象列表。
+    """
+    def __init__(self, url, timeout=60):
+        self.url = url if url.endswith('/') else url + '/'
+        self.timeout = timeout
+
+    def list(self, extensions):
+        """返回 [(名称, 大小或None)]，名称为相对索引URL的路径"""
+        with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+            body = response.read()
+            content_type = response.headers.get('Content-Type', '')
+        if 'json' in content_type:
+            links = []
+            for item in json.loads(body):
+                if isinstance(item, str):
+                    links.append((item, None))
+                else:
+                    links.append((item.get('url') or item.get('name'), item.get('size')))
+        else:
+            parser = LinkParser()
+            parser.feed(body.decode('utf-8', errors='replace'))
+            links = [(href, None) for href in parser.links]
+
+        items = []
+        seen = set()
+        for href, size in links:
+            absolute = urljoin(self.url, href)
+            if not absolute.startswith(self.url) or urlparse(absolute).query:
+                continue
+            name = unquote(absolute[len(self.url):])
+            if name and name not in seen and name.lower().endswith(extensions):
+                seen.add(name)
+                items.append((name, size))
+        return items
+
+    def read(self, name):
+        with urllib.request.urlopen(self.url + quote(name), timeout=self.timeout) as response:
+            return response.read()
+
+
+class S3Source:
+    """S3兼容存储（如MinIO）：s3://bucket/prefix，需要boto3，也可以传入兼容的client（便于测试）"""
+    def __init__(self, url, endpoint_url=None, client=None):
+        parsed = urlparse(url)
+        self.bucket = parsed.netloc
+        self.prefix = parsed.path.lstrip('/')
+        if self.prefix and not self.prefix.endswith('/'):
+            self.prefix += '/'
+        if client is None:
+            import boto3
+            client = boto3.client('s3', endpoint_url=endpoint_url or os.getenv('S3_ENDPOINT_URL') or None)
+        self.client = client
+
+    def list(self, extensions):
+        items = []
+        token = None
+        while True:
+            kwargs = {'Bucket': self.bucket, 'Prefix': self.prefix}
+            if token:
+                kwargs['ContinuationToken'] = token
+            page = self.client.list_objects_v2(**kwargs)
+            for item in page.get('Contents', []):
+                name = item['Key'][len(self.prefix):]
+                if name and name.lower().endswith(extensions):
+                    items.append((name, item.get('Size')))
+            if not page.get('IsTruncated'):
+                return items
+            token = page.get('NextContinuationToken')
+
+    def read(self, name):
+        return self.client.get_object(Bucket=self.bucket, Key=self.prefix + name)['Body'].read()
+
+
+def open_source(location):
+    """按位置创建输入源：http(s)://为HTTP目录索引，s3://为S3兼容存储"""
+    if location.startswith('s3://'):
+        return S3Source(location)
+    return HttpIndexSource(location)
+
+
+class PrefetchReader:
+    """在工作线程之前预取远程图片，接口与ArchiveReader一致
+
+    最多workers个并发下载；已下载但尚未被取走的数据不超过prefetch_bytes（大小未知时只按数量限制），
+    使下载与分类重叠而内存有界。迭代产出 (名称, load)，load()等待下载完成并返回bytes。
+    """
+    def __init__(self, source, location, extensions, workers=4, prefetch_bytes=64 * 1024 * 1024,
+                 max_member_bytes=200 * 1024 * 1024):
+        self.source = source
+        self.path = location
+        self.workers = max(workers, 1)
+        self.prefetch_bytes = prefetch_bytes
+        self.skipped = []
+        self.items = []
+        for name, size in source.list(extensions):
+            if size is not None and size > max_member_bytes:
+                self.skipped.append(name)
+            else:
+                self.items.append((name, size))
+        self.executor = None
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def count(self):
+        return len(self.items)
+
+    def __iter__(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        window = deque()  # 已提交下载、尚未交给调用方的 (名称, 大小, future)
+        window_bytes = 0
+        position = 0
+        while position < len(self.items) or window:
+            # 在数量和字节上限内继续提交下载
+            while position < len(self.items) and not self.closed:
+                name, size = self.items[position]
+                if window and (len(window) >= self.workers * 2 or
+                               window_bytes + (size or 0) > self.prefetch_bytes):
+                    break
+                window.append((name, size, self.executor.submit(self.source.read, name)))
+                window_bytes += size or 0
+                position += 1
+            if self.closed or not window:
+                return
+            name, size, future = window.popleft()
+            window_bytes -= size or 0
+            yield name, future.result
+
+    def close(self):
+        self.closed = True
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
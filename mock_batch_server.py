@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+本地模拟的OpenAI兼容批处理接口，用于在不产生费用的情况下测试批处理模式
+
+用法: python mock_batch_server.py [--port 8765] [--delay 3] [--replies 风景,猫,动漫] [--fail-every 0] [--expire-after 0]
+然后设置 API_BASE_URL=http://127.0.0.1:8765/v1 并运行 python image_classifier.py --batch
+
+实现 POST /v1/files、POST /v1/batches、GET /v1/batches/{id}、GET /v1/files/{id}/content。
+批次在提交delay秒后完成，响应文本按请求顺序轮流取自replies；fail-every为N时每N个请求返回一个错误；
+expire-after为N时每个批次只处理前N个请求，其余请求没有结果，批次状态为expired。
+"""
+
+import json
+import time
+import argparse
+import itertools
+from email import message_from_bytes
+from email.policy import default as default_policy
+from threading import Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class MockBatchBackend:
+    """保存上传的文件和批次，按时间推进批次状态"""
+    def __init__(self, delay, replies, fail_every, expire_after=0):
+        self.delay = delay
+        self.replies = replies
+        self.fail_every = fail_every
+        self.expire_after = expire_after
+        self.files = {}
+        self.batches = {}
+        self.ids = itertools.count(1)
+        self.lock = Lock()
+
+    def add_file(self, data, filename, purpose):
+        with self.lock:
+            file_id = f"file-{next(self.ids)}"
+            self.files[file_id] = data
+        return {'id': file_id, 'object': 'file', 'bytes': len(data), 'created_at': int(time.time()),
+                'filename': filename, 'purpose': purpose, 'status': 'processed'}
+
+    def create_batch(self, input_file_id, endpoint, completion_window):
+        if input_file_id not in self.files:
+            return None
+        with self.lock:
+            batch_id = f"batch-{next(self.ids)}"
+            self.batches[batch_id] = {
+                'id': batch_id, 'object': 'batch', 'endpoint': endpoint,
+                'input_file_id': input_file_id, 'completion_window': completion_window,
+                'status': 'validating', 'created_at': int(time.time()),
+                'output_file_id': None, 'error_file_id': None, 'errors': None,
+                'request_counts': {'total': self._count_lines(input_file_id), 'completed': 0, 'failed': 0},
+                '_submitted': time.monotonic(),
+            }
+        return self.get_batch(batch_id)
+
+    def _count_lines(self, file_id):
+        return sum(1 for line in self.files[file_id].splitlines() if line.strip())
+
+    def get_batch(self, batch_id):
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return None
+            elapsed = time.monotonic() - batch['_submitted']
+            if batch['status'] == 'validating':
+                batch['status'] = 'in_progress'
+            elif batch['status'] == 'in_progress' and elapsed >= self.delay:
+                self._complete(batch)
+            return {key: value for key, value in batch.items() if not key.startswith('_')}
+
+    def _complete(self, batch):
+        outputs = []
+        errors = []
+        lines = [line for line in self.files[batch['input_file_id']].splitlines() if line.strip()]
+        expired = bool(self.expire_after) and len(lines) > self.expire_after
+        if expired:
+            lines = lines[:self.expire_after]
+        for index, line in enumerate(lines, 1):
+            request = json.loads(line)
+            custom_id = request['custom_id']
+            if self.fail_every and index % self.fail_every == 0:
+                errors.append({'id': f"req-{index}", 'custom_id': custom_id, 'response': None,
+                               'error': {'code': 'server_error', 'message': '模拟的请求失败'}})
+                continue
+            reply = self.replies[(index - 1) % len(self.replies)]
+            outputs.append({
+                'id': f"req-{index}", 'custom_id': custom_id, 'error': None,
+                'response': {'status_code': 200, 'request_id': f"req-{index}", 'body': {
+                    'id': f"chatcmpl-{index}", 'object': 'chat.completion', 'created': int(time.time()),
+                    'model': request['body'].get('model'),
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': reply}}],
+                }},
+            })
+        batch['status'] = 'expired' if expired else 'completed'
+        batch['request_counts'].update(completed=len(outputs), failed=len(errors))
+        batch['output_file_id'] = self._store_lines(outputs)
+        batch['error_file_id'] = self._store_lines(errors) if errors else None
+
+    def _store_lines(self, items):
+        file_id = f"file-{next(self.ids)}"
+        self.files[file_id] = ''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in items).encode('utf-8')
+        return file_id
+
+
+class MockBatchHandler(BaseHTTPRequestHandler):
+    backend = None
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_POST(self):
+        body = self.read_body()
+        if self.path == '/v1/files':
+            # 解析multipart/form-data上传
+            message = message_from_bytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body,
+                policy=default_policy
+            )
+            fields = {}
+            filename = None
+            for part in message.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                fields[name] = part.get_payload(decode=True)
+                filename = part.get_filename() or filename
+            self.send_json(200, self.backend.add_file(
+                fields.get('file', b''), filename, (fields.get('purpose') or b'batch').decode()
+            ))
+        elif self.path == '/v1/batches':
+            request = json.loads(body)
+            batch = self.backend.create_batch(
+                request['input_file_id'], request['endpoint'], request['completion_window']
+            )
+            if batch is None:
+                self.send_json(404, {'error': {'message': '文件不存在'}})
+            else:
+                self.send_json(200, batch)
+        else:
+            self.send_json(404, {'error': {'message': f"未知路径 {self.path}"}})
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if len(parts) == 3 and parts[:2] == ['v1', 'batches']:
+            batch = self.backend.get_batch(parts[2])
+            if batch is None:
+                self.send_json(404, {'error': {'message': '批次不存在'}})
+            else:
+                self.send_json(200, batch)
+        elif len(parts) == 4 and parts[:2] == ['v1', 'files'] and parts[3] == 'content':
+            data = self.backend.files.get(parts[2])
+            if data is None:
+                self.send_json(404, {'error': {'message': '文件不存在'}})
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/jsonl')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self.send_json(404, {'error': {'message': f"未知路径 {self.path}"}})
+
+    def log_message(self, format, *args):
+        print(f"[mock] {format % args}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟的OpenAI兼容批处理接口')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay', type=float, default=3.0, help='批次提交后多少秒完成')
+    parser.add_argument('--replies', default='风景,猫,动漫,会议,表情包', help='轮流使用的响应文本，逗号分隔')
+    parser.add_argument('--fail-every', type=int, default=0, help='每N个请求返回一个错误，0表示不失败')
+    parser.add_argument('--expire-after', type=int, default=0, help='每个批次只处理前N个请求后过期，0表示全部处理')
+    args = parser.parse_args()
+
+    MockBatchHandler.backend = MockBatchBackend(args.delay, args.replies.split(','), args.fail_every,
+                                                args.expire_after)
+    server = ThreadingHTTPServer((args.host, args.port), MockBatchHandler)
+    print(f"模拟批处理接口: http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+import io
+import os
+import json
+import time
+import shutil
+from datetime import datetime
+from threading import Lock
+from PIL import Image
+from classification_index import file_hash, data_hash
+
+LAYOUT_MODES = ('flat', 'hash', 'date')
+MANIFEST_NAME = '.manifest.jsonl'
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 36867
+EXIF_DATETIME = 306
+
+
+def copy_to_output(image_path, output_path):
+    """先复制为.part临时文件再原子替换，中途取消或出错时不会留下写了一半的文件"""
+    part_path = f"{output_path}.part"
+    try:
+        shutil.copy2(image_path, part_path)
+        os.replace(part_path, output_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    return output_path
+
+
+def image_date(path, data=None):
+    """图片的拍摄日期（EXIF，只读取文件头），没有时使用文件修改时间（内存中的数据使用当前时间）"""
+    try:
+        with Image.open(io.BytesIO(data) if data is not None else path) as img:
+            exif = img.getexif()
+            value = exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+        if value:
+            return datetime.strptime(str(value).strip('\x00 ')[:19], '%Y:%m:%d %H:%M:%S')
+    except Exception:
+        pass
+    if data is not None:
+        return datetime.now()
+    return datetime.fromtimestamp(os.path.getmtime(path))
+
+
+class OutputLayout:
+    """输出目录布局
+
+    flat 把图片平铺在类别目录下；hash 按内容SHA-1前缀分片（如 宠物/3f/a9/）；date 按拍摄日期分片（如 宠物/2024/05/）。
+    分片布局下每个类别目录有一个追加写入的清单（.manifest.jsonl），记录文件的相对路径、哈希和来源，
+    列出和统计类别时读取清单，不必遍历所有分片。目标文件重名时追加序号，内容相同时直接复用已有文件。
+    """
+    def __init__(self, output_dir, mode='flat', shard_levels=1):
+        if mode not in LAYOUT_MODES:
+            raise ValueError(f"未知的输出布局: {mode}，可选 {', '.join(LAYOUT_MODES)}")
+        self.output_dir = output_dir
+        self.mode = mode
+        self.shard_levels = max(shard_levels, 1)
+        self.lock = Lock()
+
+    @property
+    def sharded(self):
+        return self.mode != 'flat'
+
+    def shard_for(self, image_path, digest=None, data=None):
+        """图片所在分片相对类别目录的路径，平铺布局返回空字符串"""
+        if self.mode == 'hash':
+            digest = digest or (data_hash(data) if data is not None else file_hash(image_path))
+            return os.path.join(*(digest[i * 2:i * 2 + 2] for i in range(self.shard_levels)))
+        if self.mode == 'date':
+            date = image_date(image_path, data)
+            return os.path.join(f"{date.year:04d}", f"{date.month:02d}")
+        return ''
+
+    def _reserve(self, target_dir, name, image_path, digest, data=None):
+        """选择不冲突的文件名并创建占位文件，返回 (目标路径, 是否已存在相同内容的文件)
+
+        源文件本身（如迁移时已在目标位置）不会被当作重复文件。哈希在锁外计算，只在第一次重名时计算一次。
+        """
+        base, ext = os.path.splitext(name)
+        suffix = 0
+        size = len(data) if data is not None else os.path.getsize(image_path)
+        source = os.stat(image_path) if data is None else None
+        while True:
+            candidate = os.path.join(target_dir, f"{base}_{suffix}{ext}" if suffix else name)
+            with self.lock:
+                try:
+                    os.close(os.open(candidate, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                    return candidate, False
+                except FileExistsError:
+                    pass
+            try:
+                existing = os.lstat(candidate)
+            except FileNotFoundError:
+                continue  # 已被删除，重试同一个名称
+            # 同名且内容相同（如重复运行）时复用已有文件，源文件本身除外
+            if ((source is None or not os.path.samestat(existing, source)) and
+                    (existing.st_size == size or os.path.islink(candidate))):
+                if digest is None:
+                    digest = data_hash(data) if data is not None else file_hash(image_path)
+                try:
+                    if os.path.getsize(candidate) == size and digest == file_hash(candidate):
+                        return candidate, True
+                except OSError:
+                    pass
+            suffix += 1
+
+    def place(self, image_path, category, name=None, move=False, digest=None, link=False, data=None):
+        """把图片复制到类别目录的分片中，返回输出路径
+
+        move为True时移动文件，link为True时创建指向原图的符号链接；
+        data不为None时写入内存中的图片数据（如压缩包成员），image_path只用于命名。
+        """
+        name = name or os.path.basename(image_path)
+        if self.mode == 'hash' and digest is None:
+            digest = data_hash(data) if data is not None else file_hash(image_path)
+        shard = self.shard_for(image_path, digest, data)
+        target_dir = os.path.join(self.output_dir, category, shard)
+        os.makedirs(target_dir, exist_ok=True)
+        output_path, existing = self._reserve(target_dir, name, image_path, digest, data)
+        try:
+            if existing:
+                if move and os.path.abspath(image_path) != os.path.abspath(output_path):
+                    os.remove(image_path)
+            elif data is not None:
+                part_path = f"{output_path}.part"
+                with open(part_path, 'wb') as f:
+                    f.write(data)
+                os.replace(part_path, output_path)
+            elif move:
+                shutil.move(image_path, output_path)
+            elif link:
+                link_path = f"{output_path}.link"
+                os.symlink(os.path.abspath(image_path), link_path)
+                os.replace(link_path, output_path)
+            else:
+                copy_to_output(image_path, output_path)
+        except BaseException:
+            if not existing and os.path.exists(output_path) and os.path.getsize(output_path) == 0:
+                os.remove(output_path)
+            raise
+        if self.sharded and not existing:
+            self._append_manifest(category, {
+                'op': 'add', 'path': os.path.relpath(output_path, os.path.join(self.output_dir, category)),
+                'hash': digest, 'size': os.path.getsize(output_path),
+                'source': os.path.basename(image_path), 'time': time.time(),
+            })
+        return output_path
+
+    def forget(self, output_path):
+        """图片已从类别目录移走时在清单中记录删除"""
+        if not self.sharded:
+            return
+        category, relative = self.split(output_path)
+        if category is not None:
+            self._append_manifest(category, {'op': 'remove', 'path': relative, 'time': time.time()})
+
+    def split(self, output_path):
+        """输出路径 -> (类别, 相对类别目录的路径)，不在输出目录中时返回 (None, None)"""
+        relative = os.path.relpath(os.path.abspath(output_path), os.path.abspath(self.output_dir))
+        parts = relative.split(os.sep)
+        if len(parts) < 2 or parts[0] in (os.pardir, os.curdir):
+            return None, None
+        return parts[0], os.path.join(*parts[1:])
+
+    def _append_manifest(self, category, entry):
+        path = os.path.join(self.output_dir, category, MANIFEST_NAME)
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self.lock:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def read_manifest(self, category):
+        """重放类别清单，返回 {相对路径: 条目}，清单不存在时返回None"""
+        path = os.path.join(self.output_dir, category, MANIFEST_NAME)
+        if not os.path.exists(path):
+            return None
+        entries = {}
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('op') == 'remove':
+                    entries.pop(entry['path'], None)
+                else:
+                    entries[entry['path']] = entry
+        return entries
+
+    def write_manifest(self, category, entries):
+        """用当前条目重写类别清单（压缩掉删除记录）"""
+        path = os.path.join(self.output_dir, category, MANIFEST_NAME)
+        temp_path = f"{path}.tmp"
+        with self.lock:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            os.replace(temp_path, path)
+
+    def walk_category(self, category, extensions):
+        """遍历类别目录（包括所有分片）中的图片"""
+        stack = [os.path.join(self.output_dir, category)]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith(extensions):
+                    yield entry.path
+
+    def list_category(self, category, extensions):
+        """列出类别中的图片：分片布局优先读取清单，没有清单时遍历目录"""
+        entries = self.read_manifest(category) if self.sharded else None
+        if entries is None:
+            return list(self.walk_category(category, extensions))
+        category_dir = os.path.join(self.output_dir, category)
+        return [os.path.join(category_dir, relative) for relative in entries
+                if relative.lower().endswith(extensions)]
+
+    def categories(self):
+        """输出目录中的类别目录名"""
+        if not os.path.isdir(self.output_dir):
+            return []
+        return [entry.name for entry in os.scandir(self.output_dir)
+                if entry.is_dir() and not entry.name.startswith('.')]
+
+    def migrate(self, extensions):
+        """把已有的输出目录整理为当前布局，并重建各类别的清单
+
+        返回 {旧路径: 新路径}，用于同步分类索引和近邻索引中记录的输出路径。
+        """
+        moved = {}
+        for category in self.categories():
+            category_dir = os.path.join(self.output_dir, category)
+            entries = []
+            for path in list(self.walk_category(category, extensions)):
+                digest = file_hash(path) if self.sharded else None
+                target_dir = os.path.join(category_dir, self.shard_for(path, digest))
+                target = path
+                existing = False
+                if os.path.normpath(os.path.dirname(path)) != os.path.normpath(target_dir):
+                    os.makedirs(target_dir, exist_ok=True)
+                    target, existing = self._reserve(target_dir, os.path.basename(path), path, digest)
+                    if existing:
+                        os.remove(path)
+                    else:
+                        os.replace(path, target)
+                    moved[path] = target
+                if self.sharded and not existing:
+                    entries.append({
+                        'op': 'add', 'path': os.path.relpath(target, category_dir), 'hash': digest,
+                        'size': os.path.getsize(target), 'source': os.path.basename(path), 'time': time.time(),
+                    })
+            # 删除迁移后变空的分片目录
+            for root, dirs, files in os.walk(category_dir, topdown=False):
+                if root != category_dir and not os.listdir(root):
+                    os.rmdir(root)
+            if self.sharded:
+                self.write_manifest(category, entries)
+            elif os.path.exists(os.path.join(category_dir, MANIFEST_NAME)):
+                os.remove(os.path.join(category_dir, MANIFEST_NAME))
+        return moved
@@ -0,0 +1,140 @@
+import io
+import os
+import json
+import time
+import shutil
+import warnings
+import concurrent.futures
+from PIL import Image, UnidentifiedImageError
+
+SUPPORTED_FORMATS = {'JPEG', 'MPO', 'PNG', 'GIF', 'BMP', 'WEBP'}
+# 各格式的文件结束标记，在文件末尾TAIL_SIZE字节内找不到时进一步校验是否被截断
+TRAILERS = {'JPEG': b'\xff\xd9', 'MPO': b'\xff\xd9', 'PNG': b'IEND', 'GIF': b'\x3b'}
+TAIL_SIZE = 1024
+EXTENSION_FORMATS = {
+    '.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG', '.gif': 'GIF', '.bmp': 'BMP', '.webp': 'WEBP',
+}
+
+
+def has_trailer(path, trailer, data=None):
+    """文件末尾是否包含结束标记"""
+    if data is not None:
+        return trailer in data[-TAIL_SIZE:]
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(f.tell() - TAIL_SIZE, 0))
+        return trailer in f.read()
+
+
+def check_truncated(source, image_format):
+    """结束标记缺失时校验图片是否完整，返回错误原因或None
+
+    JPEG以1/8尺寸在DCT域解码（开销很小），截断时会报错；其他格式使用verify()逐块校验而不解码像素。
+    """
+    try:
+        with Image.open(source) as img:
+            if image_format in ('JPEG', 'MPO'):
+                img.draft('RGB', (img.width // 8 or 1, img.height // 8 or 1))
+                img.load()
+            else:
+                img.verify()
+    except Exception as e:
+        return f"文件不完整: {str(e)}"
+    return None
+
+
+def inspect_image(path, max_pixels, large_pixels, data=None):
+    """只读取文件头检查图片，返回检查结果字典
+
+    status为 ok（正常）、large（尺寸过大，走缩小解码通道）或 bad（需要隔离，reason为原因）。
+    data不为None时检查内存中的图片数据（如压缩包成员），path只用于显示和判断扩展名。
+    """
+    result = {
+        'path': path, 'status': 'ok', 'reason': None, 'warning': None,
+        'format': None, 'width': None, 'height': None, 'frames': 1, 'size': None,
+    }
+    try:
+        result['size'] = len(data) if data is not None else os.path.getsize(path)
+        if result['size'] == 0:
+            result.update(status='bad', reason="空文件")
+            return result
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            # Image.open只解析文件头，不解码像素
+            with Image.open(io.BytesIO(data) if data is not None else path) as img:
+                result.update(format=img.format, width=img.width, height=img.height)
+                if img.format == 'GIF':
+                    # GIF的n_frames需要扫描全部帧，这里只判断是否为动图
+                    result['frames'] = 2 if img.is_animated else 1
+                else:
+                    result['frames'] = getattr(img, 'n_frames', 1)
+    except Image.DecompressionBombError as e:
+        result.update(status='bad', reason=f"尺寸过大: {str(e)}")
+        return result
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError) as e:
+        result.update(status='bad', reason=f"无法识别的图片: {str(e)}")
+        return result
+
+    image_format = result['format']
+    if image_format not in SUPPORTED_FORMATS:
+        result.update(status='bad', reason=f"不支持的格式: {image_format}")
+        return result
+    if not result['width'] or not result['height']:
+        result.update(status='bad', reason="图片尺寸无效")
+        return result
+    pixels = result['width'] * result['height']
+    if pixels > max_pixels:
+        result.update(status='bad', reason=f"尺寸过大: {result['width']}x{result['height']}")
+        return result
+
+    trailer = TRAILERS.get(image_format)
+    try:
+        if trailer is not None and not has_trailer(path, trailer, data):
+            reason = check_truncated(io.BytesIO(data) if data is not None else path, image_format)
+            if reason:
+                result.update(status='bad', reason=reason)
+                return result
+    except OSError as e:
+        result.update(status='bad', reason=f"读取文件失败: {str(e)}")
+        return result
+
+    expected = EXTENSION_FORMATS.get(os.path.splitext(path)[1].lower())
+    if expected and expected != image_format and not (expected == 'JPEG' and image_format == 'MPO'):
+        result['warning'] = f"扩展名与实际格式({image_format})不符"
+    if pixels > large_pixels:
+        result['status'] = 'large'
+    return result
+
+
+def inspect_images(paths, max_pixels, large_pixels, max_workers=8):
+    """并行检查多张图片，按输入顺序返回检查结果"""
+    if len(paths) <= 1:
+        return [inspect_image(path, max_pixels, large_pixels) for path in paths]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda path: inspect_image(path, max_pixels, large_pixels), paths))
+
+
+def quarantine(results, quarantine_dir, move=True):
+    """把检查失败的图片移动到隔离目录（move为False时保留原文件），并追加写入报告（report.jsonl）"""
+    if not results:
+        return
+    os.makedirs(quarantine_dir, exist_ok=True)
+    with open(os.path.join(quarantine_dir, 'report.jsonl'), 'a', encoding='utf-8') as report:
+        for result in results:
+            if not move:
+                entry = dict(result, quarantined_path=None, checked_at=time.time())
+                report.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                continue
+            name, ext = os.path.splitext(os.path.basename(result['path']))
+            target = os.path.join(quarantine_dir, name + ext)
+            suffix = 1
+            while os.path.exists(target):
+                target = os.path.join(quarantine_dir, f"{name}_{suffix}{ext}")
+                suffix += 1
+            try:
+                shutil.move(result['path'], target)
+            except OSError as e:
+                print(f"隔离文件 {result['path']} 时出错: {str(e)}")
+                target = None
+            entry = dict(result, quarantined_path=target, checked_at=time.time())
+            report.write(json.dumps(entry, ensure_ascii=False) + '\n')
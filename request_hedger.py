@@ -0,0 +1,203 @@
+import time
+import concurrent.futures
+from collections import deque
+from threading import Lock
+from cancellation import CancellationToken
+
+
+def percentile(values, fraction):
+    """返回已排序列表的近似分位数"""
+    if not values:
+        return None
+    index = min(int(len(values) * fraction), len(values) - 1)
+    return values[index]
+
+
+class RequestHedger:
+    """对冲请求：请求超过近期p95延迟仍未返回时发送一个副本，先返回的结果获胜
+
+    额外请求数不超过 budget × 总请求数。落败的请求通过各自的取消令牌中止（流式请求会立即断开）。
+    两个尝试的耗时都计入对冲延迟的样本：落败请求最终仍完成时（如无法中止的非流式请求）记录实际耗时，
+    被中止时记录到中止为止的耗时（实际耗时的下限），避免只记录较快的一方使p95偏低；
+    对冲获胜时用原请求的实际耗时计算节省的尾延迟。
+    """
+    def __init__(self, budget=0.05, percentile=0.95, min_samples=20, window=200, max_workers=8):
+        self.budget = budget
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.lock = Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+        self.attempt_latencies = deque(maxlen=window)  # 单次请求耗时（含落败请求），用于计算对冲延迟
+        self.request_latencies = deque(maxlen=window)  # 对冲后的端到端耗时
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+        self.timeouts = 0
+        self.aborted_losers = 0
+        self.saved_total = 0.0  # 已测得的节省时间（秒）
+        self.saved_count = 0
+
+    def hedge_delay(self):
+        """发送对冲请求前的等待时间（近期单次请求延迟的p95），样本不足时返回None"""
+        with self.lock:
+            if len(self.attempt_latencies) < self.min_samples:
+                return None
+            return percentile(sorted(self.attempt_latencies), self.percentile)
+
+    def _reserve_hedge(self):
+        """在预算内占用一次对冲名额"""
+        with self.lock:
+            if self.hedges + 1 > self.budget * self.requests:
+                self.budget_denied += 1
+                return False
+            self.hedges += 1
+            return True
+
+    def run(self, attempt, deadline=None, parent_token=None):
+        """执行 attempt(token, timeout) 并按需对冲，返回最先成功的结果
+
+        deadline为整个请求的截止时间（秒），超时抛出TimeoutError；
+        parent_token被取消时所有尝试一起中止。
+        """
+        start = time.monotonic()
+        with self.lock:
+            self.requests += 1
+        delay = self.hedge_delay()
+        attempts = {}  # future -> (是否为对冲请求, 取消令牌, 发出时间)
+
+        def launch(is_hedge):
+            token = CancellationToken()
+            handle = parent_token.register(token.cancel) if parent_token is not None else None
+            remaining = deadline - (time.monotonic() - start) if deadline else None
+            future = self.executor.submit(self._timed, attempt, token, remaining)
+            future.add_done_callback(
+                lambda _: parent_token.unregister(handle) if parent_token is not None else None
+            )
+            attempts[future] = (is_hedge, token, time.monotonic() - start)
+            return future
+
+        pending = {launch(False)}
+        may_hedge = delay is not None and self.budget > 0
+        winner = None
+        last_error = None
+        while pending:
+            elapsed = time.monotonic() - start
+            timeout = deadline - elapsed if deadline else None
+            if may_hedge:
+                wait_hedge = max(delay - elapsed, 0.0)
+                timeout = wait_hedge if timeout is None else min(timeout, wait_hedge)
+            done, pending = concurrent.futures.wait(
+                pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                if future.exception() is None:
+                    winner = future
+                    break
+                last_error = future.exception()
+            if winner is not None:
+                break
+            if done:
+                continue
+
+            elapsed = time.monotonic() - start
+            if deadline and elapsed >= deadline:
+                break
+            if may_hedge and elapsed >= delay:
+                may_hedge = False
+                if self._reserve_hedge():
+                    # 直接加入等待集合：对冲请求可能在这里之前就已完成
+                    pending.add(launch(True))
+
+        win_time = time.monotonic() - start
+        # 中止其余尝试，完成后再统计节省的时间
+        if winner is not None:
+            hedge_won = attempts[winner][0]
+            for future in pending:
+                launched = attempts[future][2]
+                future.add_done_callback(
+                    lambda f, launched=launched: self._record_loser(f, win_time, launched, hedge_won)
+                )
+        for future in pending:
+            attempts[future][1].cancel()
+
+        if winner is None:
+            if parent_token is not None:
+                parent_token.raise_if_cancelled()
+            if pending or last_error is None:
+                with self.lock:
+                    self.timeouts += 1
+                raise TimeoutError(f"请求超过截止时间 {deadline}s")
+            raise last_error
+
+        is_hedge = attempts[winner][0]
+        result, latency = winner.result()
+        with self.lock:
+            self.attempt_latencies.append(latency)
+            self.request_latencies.append(win_time)
+            if is_hedge:
+                self.hedge_wins += 1
+        return result
+
+    @staticmethod
+    def _timed(attempt, token, timeout):
+        start = time.monotonic()
+        result = attempt(token, timeout)
+        return result, time.monotonic() - start
+
+    def _record_loser(self, future, win_time, launched, hedge_won):
+        """记录落败请求的耗时，对冲获胜时同时统计节省的尾延迟"""
+        with self.lock:
+            if future.cancelled() or future.exception() is not None:
+                # 被中止的请求只知道实际耗时不短于中止前已等待的时间
+                self.aborted_losers += 1
+                self.attempt_latencies.append(max(win_time - launched, 0.0))
+                return
+            _, latency = future.result()
+            self.attempt_latencies.append(latency)
+            if hedge_won:
+                self.saved_total += max(latency - win_time, 0.0)
+                self.saved_count += 1
+
+    def stats(self):
+        """返回对冲统计"""
+        with self.lock:
+            latencies = sorted(self.request_latencies)
+            attempts = sorted(self.attempt_latencies)
+            return {
+                'requests': self.requests,
+                'hedges': self.hedges,
+                'hedge_rate': self.hedges / self.requests if self.requests else 0.0,
+                'hedge_wins': self.hedge_wins,
+                'budget_denied': self.budget_denied,
+                'timeouts': self.timeouts,
+                'aborted_losers': self.aborted_losers,
+                'saved_total': self.saved_total,
+                'saved_count': self.saved_count,
+                'attempt_p95': percentile(attempts, 0.95),
+                'p50': percentile(latencies, 0.50),
+                'p95': percentile(latencies, 0.95),
+                'p99': percentile(latencies, 0.99),
+            }
+
+    def print_stats(self):
+        """打印对冲统计"""
+        stats = self.stats()
+
+        def fmt(value):
+            return f"{value:.2f}s" if value is not None else "-"
+
+        print("\n对冲请求统计:")
+        print("-" * 30)
+        print(f"请求 {stats['requests']} 次，对冲 {stats['hedges']} 次 ({stats['hedge_rate']:.1%})，"
+              f"对冲获胜 {stats['hedge_wins']} 次，超出预算未对冲 {stats['budget_denied']} 次，"
+              f"超时 {stats['timeouts']} 次")
+        print(f"端到端延迟 p50 {fmt(stats['p50'])} / p95 {fmt(stats['p95'])} / p99 {fmt(stats['p99'])}，"
+              f"单次请求 p95 {fmt(stats['attempt_p95'])}")
+        print(f"已测得节省尾延迟 {stats['saved_total']:.2f}s（{stats['saved_count']} 次），"
+              f"另有 {stats['aborted_losers']} 个落败请求被中止")
+        print("-" * 30)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
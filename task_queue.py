@@ -0,0 +1,80 @@
+import os
+import heapq
+import itertools
+import time
+from threading import Lock
+
+PRIORITY_POLICIES = ('fifo', 'smallest', 'oldest')
+SELECTED_BOOST = 1e12  # 用户选中的图片排在所有未选中的图片之前
+
+
+def priority_of(path, policy):
+    """图片的基础优先级，越小越先处理
+
+    smallest 按文件大小（MB），oldest 按修改时间（小时），fifo 全部相同（按加入顺序）。
+    """
+    if policy == 'fifo':
+        return 0.0
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 0.0
+    if policy == 'smallest':
+        return stat.st_size / (1024 * 1024)
+    return stat.st_mtime / 3600
+
+
+class PriorityTaskQueue:
+    """工作线程前的优先级队列（线程安全）
+
+    有效优先级 = 基础优先级 - 等待秒数 × aging：先到的大图片随等待时间逐渐前移，
+    不会被源源不断加入的小图片饿死。等待时间对同时加入的图片相同，所以只影响之后加入的图片，
+    按 基础优先级 + 加入时间 × aging 排序即可用堆实现。优先级相同时按加入顺序。
+    """
+    def __init__(self, policy='fifo', aging=0.0):
+        if policy not in PRIORITY_POLICIES:
+            raise ValueError(f"未知的调度策略: {policy}，可选 {', '.join(PRIORITY_POLICIES)}")
+        self.policy = policy
+        self.aging = aging
+        self.lock = Lock()
+        self.heap = []
+        self.entries = {}  # 路径 -> 堆中的条目，被提升或取出的条目标记为失效
+        self.counter = itertools.count()
+        self.start = time.monotonic()
+
+    def _push_locked(self, path, item, base, enqueued):
+        entry = [base + (enqueued - self.start) * self.aging, next(self.counter), path, item, enqueued, base, True]
+        self.entries[path] = entry
+        heapq.heappush(self.heap, entry)
+
+    def push(self, path, item=None, selected=False):
+        """加入一张图片，item为出队时返回的任务（默认为路径），selected为True时优先处理"""
+        base = priority_of(path, self.policy) - (SELECTED_BOOST if selected else 0)
+        with self.lock:
+            if path in self.entries:
+                return
+            self._push_locked(path, path if item is None else item, base, time.monotonic())
+
+    def promote(self, path):
+        """把尚未出队的图片提升到未选中图片之前，返回是否找到"""
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry[5] < 0:
+                return False
+            entry[-1] = False
+            self._push_locked(path, entry[3], entry[5] - SELECTED_BOOST, entry[4])
+            return True
+
+    def pop(self):
+        """取出有效优先级最高的任务，队列为空时返回None"""
+        with self.lock:
+            while self.heap:
+                entry = heapq.heappop(self.heap)
+                if entry[-1]:
+                    del self.entries[entry[2]]
+                    return entry[3]
+            return None
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
@@ -0,0 +1,76 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+from PIL import Image
+
+from image_classifier import ImageClassifier
+
+
+def image_bytes(size=(32, 32), noise=False):
+    img = Image.effect_noise(size, 80).convert('RGB') if noise else Image.new('RGB', size, 'red')
+    buffer = io.BytesIO()
+    img.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def write_zip(path, members):
+    with zipfile.ZipFile(path, 'w') as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+
+
+@pytest.fixture
+def classifier(tmp_path, monkeypatch):
+    monkeypatch.setenv('ARCHIVE_MAX_MEMBER_MB', '0.05')
+    monkeypatch.setenv('CLEAN_INPUT_AFTER_PROCESS', 'true')
+    classifier = ImageClassifier(api_base_url='http://127.0.0.1:9/v1', api_key='test', model_name='mock',
+                                 classification_prompt='分类', valid_categories=['宠物'])
+
+    def classify(path, source_data=None):
+        return {'category': '宠物', 'raw_response': '宠物', 'model': 'mock', 'latency': 0.0, 'error': None}
+    monkeypatch.setattr(classifier, 'classify_image_detailed', classify)
+    yield classifier
+    classifier.close()
+
+
+def test_only_fully_stored_archives_are_cleaned(classifier, tmp_path):
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    write_zip(input_dir / 'good.zip', {'a.png': image_bytes(), 'b.png': image_bytes((40, 40))})
+    # 超过大小上限被跳过的成员
+    write_zip(input_dir / 'oversized.zip', {'small.png': image_bytes(),
+                                            'big.png': image_bytes((400, 400), noise=True)})
+    # 未通过预检的成员
+    write_zip(input_dir / 'corrupt.zip', {'ok.png': image_bytes(), 'broken.png': image_bytes()[:40]})
+    # 读取到一半出错的tar
+    tar_buffer = io.BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode='w:gz') as tar:
+        for name in ('x.png', 'y.png'):
+            data = image_bytes((300, 300), noise=True)
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    (input_dir / 'truncated.tar.gz').write_bytes(tar_buffer.getvalue()[:len(tar_buffer.getvalue()) // 2])
+
+    classifier.organize_directory(str(input_dir), str(tmp_path / 'out'))
+
+    assert sorted(os.listdir(input_dir)) == ['corrupt.zip', 'oversized.zip', 'truncated.tar.gz']
+
+
+def test_virtual_mode_skips_archives(classifier, tmp_path):
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    write_zip(input_dir / 'dump.zip', {'a.png': image_bytes()})
+    Image.new('RGB', (32, 32), 'blue').save(input_dir / 'b.png')
+    output_dir = tmp_path / 'out'
+    classifier.virtual_organize = True
+
+    classifier.organize_directory(str(input_dir), str(output_dir))
+    summary = classifier.apply_manifest(str(output_dir))
+
+    # 清单只引用磁盘上存在的原图，压缩包留在输入文件夹
+    assert summary == {'placed': 1, 'missing': 0, 'failed': 0}
+    assert sorted(os.listdir(input_dir)) == ['b.png', 'dump.zip']
@@ -0,0 +1,83 @@
+import os
+import threading
+import zipfile
+from http.server import ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+from image_classifier import ImageClassifier
+from mock_batch_server import MockBatchBackend, MockBatchHandler
+
+
+@pytest.fixture
+def batch_server():
+    servers = []
+
+    def start(expire_after=0, fail_every=0):
+        handler = type('Handler', (MockBatchHandler,), {
+            'backend': MockBatchBackend(0, ['风景', '宠物'], fail_every, expire_after),
+            'log_message': lambda self, *args: None,
+        })
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+@pytest.fixture
+def folders(tmp_path, monkeypatch):
+    monkeypatch.setenv('BATCH_POLL_INTERVAL', '0.05')
+    monkeypatch.setenv('CLEAN_INPUT_AFTER_PROCESS', 'true')
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    for i in range(5):
+        Image.new('RGB', (40 + i, 40), (i * 40, 0, 0)).save(input_dir / f"{i}.jpg")
+    return str(input_dir), str(tmp_path / 'out')
+
+
+def classify(base_url, input_dir, output_dir):
+    classifier = ImageClassifier(api_base_url=base_url, api_key='test', model_name='mock',
+                                 classification_prompt='分类', valid_categories=['风景', '宠物'])
+    try:
+        return classifier.organize_directory_batch(input_dir, output_dir)
+    finally:
+        classifier.close()
+
+
+def stored_images(output_dir):
+    return sorted(name for root, _, files in os.walk(output_dir) for name in files if name.endswith('.jpg'))
+
+
+def test_expired_batch_is_requeued(batch_server, folders):
+    input_dir, output_dir = folders
+
+    assert classify(batch_server(expire_after=3), input_dir, output_dir)
+
+    assert stored_images(output_dir) == [f"{i}.jpg" for i in range(5)]
+    assert os.listdir(input_dir) == []
+
+
+def test_input_kept_when_results_are_missing(batch_server, folders, monkeypatch):
+    monkeypatch.setenv('BATCH_MAX_RETRIES', '0')
+    input_dir, output_dir = folders
+
+    classify(batch_server(expire_after=3), input_dir, output_dir)
+
+    assert len(stored_images(output_dir)) == 3
+    assert sorted(os.listdir(input_dir)) == [f"{i}.jpg" for i in range(5)]
+
+
+def test_archives_are_kept_in_batch_mode(batch_server, folders):
+    input_dir, output_dir = folders
+    with zipfile.ZipFile(os.path.join(input_dir, 'dump.zip'), 'w') as archive:
+        archive.writestr('a.jpg', b'not read in batch mode')
+
+    assert classify(batch_server(), input_dir, output_dir)
+
+    assert len(stored_images(output_dir)) == 5
+    assert os.listdir(input_dir) == ['dump.zip']
@@ -0,0 +1,93 @@
+import concurrent.futures
+import os
+import threading
+import time
+import tracemalloc
+
+from PIL import Image
+
+import image_classifier
+from image_classifier import ImageClassifier
+
+
+class CountingExecutor(concurrent.futures.ThreadPoolExecutor):
+    """记录同时在途（已提交未完成）的任务数峰值"""
+    in_flight = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        cls = CountingExecutor
+        with cls.lock:
+            cls.in_flight += 1
+            cls.peak = max(cls.peak, cls.in_flight)
+        future = super().submit(fn, *args, **kwargs)
+
+        def done(_):
+            with cls.lock:
+                cls.in_flight -= 1
+        future.add_done_callback(done)
+        return future
+
+
+def test_in_flight_tasks_stay_bounded(tmp_path, monkeypatch):
+    monkeypatch.setenv('MAX_PENDING_TASKS', '6')
+    monkeypatch.setenv('CLEAN_INPUT_AFTER_PROCESS', 'false')
+    monkeypatch.setenv('PREFLIGHT', 'false')
+    monkeypatch.setattr(image_classifier.concurrent.futures, 'ThreadPoolExecutor', CountingExecutor)
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    image = Image.new('RGB', (16, 16), 'red')
+    for i in range(600):
+        image.save(input_dir / f"{i:04d}.png")
+
+    classifier = ImageClassifier(api_base_url='http://127.0.0.1:9/v1', api_key='test', model_name='mock',
+                                 classification_prompt='分类', valid_categories=['宠物'], max_workers=3)
+
+    def classify(path, source_data=None):
+        time.sleep(0.001)
+        return {'category': '宠物', 'raw_response': '宠物', 'model': 'mock', 'latency': 0.001, 'error': None}
+    monkeypatch.setattr(classifier, 'classify_image_detailed', classify)
+    try:
+        assert classifier.organize_directory(str(input_dir), str(tmp_path / 'out'))
+    finally:
+        classifier.close()
+
+    assert len(os.listdir(tmp_path / 'out' / '宠物')) == 600
+    assert 3 <= CountingExecutor.peak <= 6
+
+
+def peak_memory_kb(tmp_path, monkeypatch, count):
+    """整理count张图片，返回整理过程中Python分配内存的峰值（KB）"""
+    monkeypatch.setenv('MAX_PENDING_TASKS', '6')
+    monkeypatch.setenv('CLEAN_INPUT_AFTER_PROCESS', 'false')
+    monkeypatch.setenv('PREFLIGHT', 'false')
+    input_dir = tmp_path / f"in{count}"
+    input_dir.mkdir()
+    image = Image.new('RGB', (16, 16), 'red')
+    for i in range(count):
+        image.save(input_dir / f"{i:05d}.png")
+
+    classifier = ImageClassifier(api_base_url='http://127.0.0.1:9/v1', api_key='test', model_name='mock',
+                                 classification_prompt='分类', valid_categories=['宠物'], max_workers=3)
+
+    def classify(path, source_data=None):
+        time.sleep(0.0005)
+        return {'category': '宠物', 'raw_response': '宠物', 'model': 'mock', 'latency': 0.001, 'error': None}
+    monkeypatch.setattr(classifier, 'classify_image_detailed', classify)
+    tracemalloc.start()
+    try:
+        assert classifier.organize_directory(str(input_dir), str(tmp_path / f"out{count}"))
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+        classifier.close()
+
+
+def test_peak_memory_does_not_scale_with_batch_size(tmp_path, monkeypatch):
+    small = peak_memory_kb(tmp_path, monkeypatch, 200)
+    large = peak_memory_kb(tmp_path, monkeypatch, 2000)
+
+    # 文件名列表和调度队列本身随图片数线性增长（每张约0.4KB），在途任务有界；
+    # 一次性提交全部任务时每张图片还要多约2KB（future和排队的任务）
+    assert (large - small) / 1800 < 1.0
@@ -0,0 +1,31 @@
+from endpoint_pool import Endpoint, EndpointPool
+from image_classifier import ImageClassifier
+
+
+class FakeClient:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_cancel_closes_pooled_clients():
+    classifier = ImageClassifier(api_base_url='http://127.0.0.1:9/v1', api_key='test', model_name='mock',
+                                 classification_prompt='分类', valid_categories=['宠物'])
+    endpoints = [Endpoint('http://127.0.0.1:9/v1', 'test', 'mock', name=name) for name in ('a', 'b')]
+    old_clients = []
+    for endpoint in endpoints:
+        endpoint.client = FakeClient()
+        old_clients.append(endpoint.client)
+    classifier.endpoint_pool = EndpointPool(endpoints)
+    direct = classifier.client = FakeClient()
+    try:
+        classifier.cancel()
+    finally:
+        classifier.close()
+
+    assert direct.closed
+    assert all(client.closed for client in old_clients)
+    # 新一轮处理使用新的客户端
+    assert all(endpoint.client is not old for endpoint, old in zip(endpoints, old_clients))
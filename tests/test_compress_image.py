@@ -0,0 +1,86 @@
+import io
+
+import os
+import concurrent.futures
+from multiprocessing import shared_memory
+
+from PIL import Image
+
+from image_classifier import ImageClassifier, compress_image, preprocess_to_shared_memory
+
+EXIF_ORIENTATION = 0x0112
+
+
+def save_rotated(path, fmt, **params):
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = 6
+    first = Image.new('RGB', (2000, 1500), 'red')
+    second = Image.new('RGB', (2000, 1500), 'blue')
+    first.save(path, fmt, exif=exif, save_all=True, append_images=[second], **params)
+
+
+def output_size(buffer):
+    with Image.open(io.BytesIO(buffer.getvalue())) as img:
+        return img.size
+
+
+def test_mpo_is_rotated_like_a_photo(tmp_path):
+    path = str(tmp_path / 'camera.jpg')
+    save_rotated(path, 'MPO')
+
+    assert output_size(compress_image(path, (1024, 1024), 85, animation_frames=4)) == (768, 1024)
+    assert output_size(compress_image(path, (1024, 1024), 85, animation_frames=1)) == (768, 1024)
+
+
+def test_multipage_tiff_uses_first_page(tmp_path):
+    path = str(tmp_path / 'scan.tiff')
+    pages = [Image.new('RGB', (2000, 1500), color) for color in ('red', 'blue')]
+    pages[0].save(path, save_all=True, append_images=pages[1:])
+
+    assert output_size(compress_image(path, (1024, 1024), 85, animation_frames=4)) == (1024, 768)
+
+
+def test_animated_gif_is_tiled(tmp_path):
+    path = str(tmp_path / 'anim.gif')
+    frames = [Image.new('RGB', (400, 300), color) for color in ('red', 'green', 'blue', 'white')]
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=100)
+
+    width, height = output_size(compress_image(path, (1024, 1024), 85, animation_frames=4))
+    assert width <= 1024 and height <= 1024
+    assert width > 400  # 多帧拼成网格
+
+
+def test_preprocess_to_shared_memory_outlives_worker(tmp_path):
+    path = tmp_path / 'photo.jpg'
+    Image.new('RGB', (2048, 1536), 'green').save(path)
+    expected = compress_image(str(path), (1024, 1024), 85).getvalue()
+
+    # 子进程退出后共享内存仍由父进程读取和释放
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as pool:
+        name, size, original_size = pool.submit(
+            preprocess_to_shared_memory, str(path), (1024, 1024), 85
+        ).result()
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        assert bytes(shm.buf[:size]) == expected
+        assert original_size == os.path.getsize(path)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_preprocess_pool_does_not_fork(tmp_path, capsys):
+    path = tmp_path / 'photo.jpg'
+    Image.new('RGB', (2048, 1536), 'green').save(path)
+    classifier = ImageClassifier(api_base_url='http://127.0.0.1:9/v1', api_key='test', model_name='mock',
+                                 classification_prompt='分类', valid_categories=['宠物'],
+                                 preprocess_processes=1)
+    try:
+        # 与实际运行一样在工作线程中懒加载进程池
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            encoded = executor.submit(classifier.encode_image, str(path)).result()
+        assert classifier.get_preprocess_pool()._mp_context.get_start_method() != 'fork'
+        assert encoded
+        assert '进程池预处理图片时出错' not in capsys.readouterr().out
+    finally:
+        classifier.close()
@@ -0,0 +1,84 @@
+import openai
+import pytest
+
+from cancellation import ClassificationCancelled
+from endpoint_pool import Endpoint, EndpointPool
+
+
+def api_error(error_type, status_code=None):
+    # 只用于判断异常类型，不需要真实的请求和响应对象
+    error = error_type.__new__(error_type)
+    if status_code is not None:
+        error.status_code = status_code
+    return error
+
+
+@pytest.fixture
+def pool():
+    endpoints = [Endpoint('http://127.0.0.1:9/v1', 'test', 'mock', name=name) for name in ('a', 'b')]
+    return EndpointPool(endpoints, failure_threshold=1, cooldown=60)
+
+
+def stats_by_name(pool):
+    return {item['name']: item for item in pool.stats()}
+
+
+@pytest.mark.parametrize('error', [api_error(openai.BadRequestError),
+                                   api_error(openai.UnprocessableEntityError),
+                                   api_error(openai.APIStatusError, 413)])
+def test_payload_error_is_raised_without_failover(pool, error):
+    calls = []
+
+    def func(endpoint):
+        calls.append(endpoint.name)
+        raise error
+
+    with pytest.raises(type(error)):
+        pool.call(func)
+
+    assert len(calls) == 1
+    stats = stats_by_name(pool)[calls[0]]
+    # 计入请求数和错误数，但不熔断
+    assert stats['requests'] == 1 and stats['errors'] == 1
+    assert not any(item['circuit_open'] for item in pool.stats())
+    assert all(item['outstanding'] == 0 for item in pool.stats())
+
+
+@pytest.mark.parametrize('error_type', [openai.APIConnectionError, openai.APITimeoutError,
+                                        openai.RateLimitError, openai.InternalServerError,
+                                        openai.AuthenticationError, openai.PermissionDeniedError,
+                                        openai.NotFoundError])
+def test_endpoint_failures_fail_over(pool, error_type):
+    def func(endpoint):
+        if endpoint.name == 'a':
+            raise api_error(error_type)
+        return endpoint.name
+
+    assert pool.call(func) == 'b'
+    stats = stats_by_name(pool)
+    assert stats['a']['circuit_open'] and stats['a']['errors'] == 1
+    assert not stats['b']['circuit_open']
+
+
+def test_revoked_key_stops_receiving_requests(pool):
+    def func(endpoint):
+        if endpoint.name == 'a':
+            raise api_error(openai.AuthenticationError)
+        return endpoint.name
+
+    assert [pool.call(func) for _ in range(10)] == ['b'] * 10
+    stats = stats_by_name(pool)
+    assert stats['a']['requests'] == 1 and stats['a']['errors'] == 1
+    assert stats['b']['requests'] == 10 and stats['b']['errors'] == 0
+
+
+def test_cancelled_request_is_not_an_error(pool):
+    def func(endpoint):
+        raise ClassificationCancelled()
+
+    with pytest.raises(ClassificationCancelled):
+        pool.call(func)
+
+    stats = [item for item in pool.stats() if item['requests']]
+    assert len(stats) == 1
+    assert stats[0]['cancelled'] == 1 and stats[0]['errors'] == 0 and not stats[0]['circuit_open']
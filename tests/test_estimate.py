@@ -0,0 +1,35 @@
+import os
+
+from PIL import Image
+
+from image_classifier import ImageClassifier
+
+
+def test_estimate_samples_only_images_that_pass_preflight(tmp_path, monkeypatch):
+    monkeypatch.setenv('PREFLIGHT', 'true')
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    for i in range(3):
+        Image.new('RGB', (32, 32), 'red').save(input_dir / f"{i}.png")
+    for name in ('broken.png', 'broken.jpg'):
+        (input_dir / name).write_bytes(b'not an image')
+    (input_dir / 'notes.txt').write_text('x')
+
+    classifier = ImageClassifier(api_base_url='http://127.0.0.1:9/v1', api_key='test', model_name='mock',
+                                 classification_prompt='分类', valid_categories=['宠物'])
+    sampled = []
+
+    def classify(path, source_data=None):
+        sampled.append(os.path.basename(path))
+        return {'category': '宠物', 'raw_response': '宠物', 'model': 'mock', 'latency': 0.5, 'error': None,
+                'usage': {'requests': 1, 'prompt': 100, 'completion': 2, 'cached': 0, 'image': 80, 'cost': 0.01}}
+    monkeypatch.setattr(classifier, 'classify_image_detailed', classify)
+    try:
+        estimate = classifier.estimate_run(str(input_dir), str(tmp_path / 'out'), sample_size=20)
+    finally:
+        classifier.close()
+
+    assert sorted(sampled) == ['0.png', '1.png', '2.png']
+    assert estimate['images'] == 3 and estimate['prompt_tokens'] == 300
+    # 预估不移动未通过预检的文件
+    assert sorted(os.listdir(input_dir)) == ['0.png', '1.png', '2.png', 'broken.jpg', 'broken.png', 'notes.txt']
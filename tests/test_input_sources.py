@@ -0,0 +1,201 @@
+import io
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from PIL import Image
+
+import image_classifier
+from image_classifier import ImageClassifier
+from input_sources import S3Source, HttpIndexSource, PrefetchReader
+from virtual_manifest import read_manifest
+
+EXTENSIONS = ('.jpg', '.png')
+
+
+def image_bytes(color='red'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 32), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class FakeS3Client:
+    """按page_size分页的list_objects_v2/get_object，记录收到的分页参数"""
+    def __init__(self, objects, page_size=2):
+        self.objects = objects
+        self.page_size = page_size
+        self.list_calls = []
+
+    def list_objects_v2(self, Bucket, Prefix, ContinuationToken=None):
+        self.list_calls.append((Bucket, Prefix, ContinuationToken))
+        keys = sorted(key for key in self.objects if key.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + self.page_size]
+        result = {'Contents': [{'Key': key, 'Size': len(self.objects[key])} for key in page],
+                  'IsTruncated': start + self.page_size < len(keys)}
+        if result['IsTruncated']:
+            result['NextContinuationToken'] = str(start + self.page_size)
+        return result
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+
+def test_s3_source_follows_pagination():
+    objects = {f"pics/{i}.png": b'x' * (i + 1) for i in range(5)}
+    objects.update({'pics/notes.txt': b'', 'other/9.png': b''})
+    client = FakeS3Client(objects)
+    source = S3Source('s3://bucket/pics', client=client)
+
+    items = source.list(EXTENSIONS)
+
+    assert items == [(f"{i}.png", i + 1) for i in range(5)]
+    assert [call[2] for call in client.list_calls] == [None, '2', '4']
+    assert all(call[:2] == ('bucket', 'pics/') for call in client.list_calls)
+    assert source.read('3.png') == b'xxxx'
+
+
+@pytest.fixture
+def http_index():
+    files = {'a.png': b'aaa', 'sub/b.jpg': b'bb', 'c d.png': b'c'}
+    pages = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split('?')[0]
+            if path in pages:
+                content_type, body = pages[path]
+            elif path.startswith('/images/') and path[len('/images/'):].replace('%20', ' ') in files:
+                content_type, body = 'image/png', files[path[len('/images/'):].replace('%20', ' ')]
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", pages
+    server.shutdown()
+
+
+def test_http_index_lists_html_links(http_index):
+    base, pages = http_index
+    pages['/images/'] = ('text/html', (
+        '<a href="../">上级目录</a><a href="a.png">a</a><a href="sub/b.jpg">b</a>'
+        '<a href="c%20d.png">c</a><a href="a.png">重复</a><a href="?C=M;O=A">排序</a>'
+        '<a href="readme.txt">说明</a><a href="http://example.com/x.png">外部</a>'
+    ).encode('utf-8'))
+    source = HttpIndexSource(f"{base}/images")
+
+    assert source.list(EXTENSIONS) == [('a.png', None), ('sub/b.jpg', None), ('c d.png', None)]
+    assert source.read('c d.png') == b'c'
+
+
+def test_http_index_lists_json(http_index):
+    base, pages = http_index
+    pages['/images/'] = ('application/json', json.dumps(
+        ['a.png', {'name': 'sub/b.jpg', 'size': 2}, {'url': f"{base}/images/c%20d.png", 'size': 1}]
+    ).encode('utf-8'))
+    source = HttpIndexSource(f"{base}/images/")
+
+    assert source.list(EXTENSIONS) == [('a.png', None), ('sub/b.jpg', 2), ('c d.png', 1)]
+    assert source.read('sub/b.jpg') == b'bb'
+
+
+class RecordingSource:
+    """记录开始下载的顺序"""
+    def __init__(self, sizes):
+        self.sizes = sizes
+        self.started = []
+        self.lock = threading.Lock()
+
+    def list(self, extensions):
+        return [(f"{i}.png", size) for i, size in enumerate(self.sizes)]
+
+    def read(self, name):
+        with self.lock:
+            self.started.append(name)
+        return b'x' * (self.sizes[int(name.split('.')[0])] or 1)
+
+
+def prefetched_after_each_item(reader, source):
+    """逐个取出图片，返回每次取出时已开始下载但尚未被取走的图片（含正在取出的一张）"""
+    windows = []
+    for index, (name, load) in enumerate(reader):
+        assert name == f"{index}.png"
+        load()
+        time.sleep(0.02)  # 等待已提交的下载开始
+        with source.lock:
+            windows.append([int(started.split('.')[0]) for started in source.started
+                            if int(started.split('.')[0]) >= index])
+    return windows
+
+
+def test_prefetch_is_bounded_by_count():
+    source = RecordingSource([None] * 20)
+    reader = PrefetchReader(source, 'http://example/', EXTENSIONS, workers=2, prefetch_bytes=1024)
+
+    windows = prefetched_after_each_item(reader, source)
+
+    assert len(windows) == 20
+    assert max(len(window) for window in windows) <= 4
+    assert sorted(source.started) == sorted(f"{i}.png" for i in range(20))
+
+
+def test_prefetch_is_bounded_by_bytes():
+    sizes = [300, 300, 300, 300, 900, 300, 300, 300]
+    source = RecordingSource(sizes)
+    reader = PrefetchReader(source, 'http://example/', EXTENSIONS, workers=8, prefetch_bytes=1000)
+
+    windows = prefetched_after_each_item(reader, source)
+
+    # 单张超过上限的图片单独下载，其余情况下预取窗口不超过prefetch_bytes
+    assert all(sum(sizes[i] for i in window) <= 1000 or len(window) == 1 for window in windows)
+    assert max(len(window) for window in windows) < 8
+
+
+def test_prefetch_skips_oversized_members():
+    source = RecordingSource([10, 5000, 10])
+    reader = PrefetchReader(source, 'http://example/', EXTENSIONS, max_member_bytes=1000)
+
+    assert reader.count() == 2
+    assert reader.skipped == ['1.png']
+    assert [name for name, _ in reader] == ['0.png', '2.png']
+    reader.close()
+
+
+@pytest.mark.parametrize('virtual', [False, True])
+def test_remote_source_path_is_kept(tmp_path, monkeypatch, virtual):
+    objects = {f"pics/{name}": image_bytes(color) for name, color in (('a.png', 'red'), ('b.png', 'blue'))}
+    client = FakeS3Client(objects)
+    monkeypatch.setattr(image_classifier, 'open_source', lambda location: S3Source(location, client=client))
+    classifier = ImageClassifier(api_base_url='http://127.0.0.1:9/v1', api_key='test', model_name='mock',
+                                 classification_prompt='分类', valid_categories=['宠物'],
+                                 index_path=str(tmp_path / 'index.db'))
+
+    def classify(path, source_data=None):
+        return {'category': '宠物', 'raw_response': '宠物', 'model': 'mock', 'latency': 0.0, 'error': None}
+    monkeypatch.setattr(classifier, 'classify_image_detailed', classify)
+    monkeypatch.chdir(tmp_path)
+    classifier.virtual_organize = virtual
+    try:
+        classifier.organize_directory('s3://bucket/pics', str(tmp_path / 'out'))
+        rows = classifier.index.query()
+    finally:
+        classifier.close()
+
+    expected = ['s3://bucket/pics/a.png', 's3://bucket/pics/b.png']
+    assert sorted(row['source_path'] for row in rows) == expected
+    if virtual:
+        manifest = classifier.manifest_path(str(tmp_path / 'out'))
+        assert sorted(row['source_path'] for row in read_manifest(manifest)) == expected
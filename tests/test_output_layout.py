@@ -0,0 +1,64 @@
+import os
+
+from PIL import Image
+
+from output_layout import OutputLayout, MANIFEST_NAME
+
+EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def make_image(path, color):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new('RGB', (32, 32), color).save(path)
+
+
+def category_files(output_dir, category):
+    found = []
+    for root, _, files in os.walk(os.path.join(output_dir, category)):
+        found.extend(os.path.join(root, name) for name in files if name != MANIFEST_NAME)
+    return sorted(found)
+
+
+def test_migrate_flat_to_flat_keeps_files(tmp_path):
+    output_dir = str(tmp_path)
+    make_image(os.path.join(output_dir, '宠物', 'a.jpg'), 'red')
+    make_image(os.path.join(output_dir, '宠物', 'b.jpg'), 'blue')
+
+    moved = OutputLayout(output_dir, 'flat').migrate(EXTENSIONS)
+
+    assert moved == {}
+    assert [os.path.basename(p) for p in category_files(output_dir, '宠物')] == ['a.jpg', 'b.jpg']
+
+
+def test_migrate_sharded_to_flat_and_back(tmp_path):
+    output_dir = str(tmp_path)
+    make_image(os.path.join(output_dir, '宠物', 'a.jpg'), 'red')
+    make_image(os.path.join(output_dir, '宠物', 'b.jpg'), 'blue')
+
+    OutputLayout(output_dir, 'hash').migrate(EXTENSIONS)
+    sharded = category_files(output_dir, '宠物')
+    assert len(sharded) == 2
+    assert all(os.path.dirname(p) != os.path.join(output_dir, '宠物') for p in sharded)
+
+    moved = OutputLayout(output_dir, 'flat').migrate(EXTENSIONS)
+
+    assert len(moved) == 2
+    assert category_files(output_dir, '宠物') == [
+        os.path.join(output_dir, '宠物', 'a.jpg'), os.path.join(output_dir, '宠物', 'b.jpg')
+    ]
+    assert not os.path.exists(os.path.join(output_dir, '宠物', MANIFEST_NAME))
+
+
+def test_place_reuses_identical_file_and_suffixes_different(tmp_path):
+    source_dir = tmp_path / 'in'
+    output_dir = str(tmp_path / 'out')
+    make_image(str(source_dir / 'a.jpg'), 'red')
+    make_image(str(source_dir / 'other' / 'a.jpg'), 'green')
+    layout = OutputLayout(output_dir, 'flat')
+
+    first = layout.place(str(source_dir / 'a.jpg'), '宠物')
+    again = layout.place(str(source_dir / 'a.jpg'), '宠物')
+    different = layout.place(str(source_dir / 'other' / 'a.jpg'), '宠物')
+
+    assert again == first
+    assert os.path.basename(different) == 'a_1.jpg'
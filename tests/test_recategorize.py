@@ -0,0 +1,62 @@
+import os
+
+import pytest
+from PIL import Image
+
+from image_classifier import ImageClassifier, DEFAULT_CAPTION_PROMPT
+
+CATEGORIES = ['二次元', '生活照片', '宠物', '工作', '表情包']
+
+
+@pytest.fixture
+def classifier(tmp_path):
+    classifier = ImageClassifier(api_base_url='http://127.0.0.1:9/v1', api_key='test', model_name='mock',
+                                 classification_prompt='分类', valid_categories=CATEGORIES,
+                                 index_path=str(tmp_path / 'index.db'))
+    yield classifier
+    classifier.close()
+
+
+@pytest.mark.parametrize('caption, expected', [
+    ('一张照片，画面中一只橘猫趴在沙发上，旁边能看到人物的手', '宠物'),
+    ('一张会议室里的照片，几个人物围坐在桌边讨论项目文档', '工作'),
+    ('一张表情包图片，人物表情夸张，配有搞笑文字', '表情包'),
+    ('海边日落的风景照片，画面中没有人物', '生活照片'),
+    ('动漫风格的插画，人物是一位二次元少女', '二次元'),
+    ('A photo of a dog playing with a ball in the park', '宠物'),
+    ('A category diagram on a whiteboard', None),
+])
+def test_map_description(classifier, caption, expected):
+    assert classifier.map_description(caption) == expected
+
+
+def test_failed_request_keeps_image_in_place(classifier, tmp_path, monkeypatch):
+    output_dir = tmp_path / 'out'
+    image_path = output_dir / '宠物' / 'cat.jpg'
+    image_path.parent.mkdir(parents=True)
+    Image.new('RGB', (32, 32), 'orange').save(image_path)
+
+    def failing_request(path, source_data=None):
+        return {'category': '其他', 'raw_response': None, 'model': None, 'latency': None,
+                'error': '连接超时'}
+    monkeypatch.setattr(classifier, 'classify_image_detailed', failing_request)
+
+    summary = classifier.recategorize_output(str(output_dir))
+
+    assert summary['failed'] == 1
+    assert summary['moved'] == 0
+    assert os.path.exists(image_path)
+    assert os.listdir(output_dir / '其他') == []
+
+
+def test_blank_caption_prompt_uses_default(tmp_path, monkeypatch):
+    # .env.example中的 CAPTION_PROMPT= 表示使用默认提示词
+    monkeypatch.setenv('CAPTION_PROMPT', '')
+    classifier = ImageClassifier(api_base_url='http://127.0.0.1:9/v1', api_key='test', model_name='mock',
+                                 classification_prompt='分类', valid_categories=CATEGORIES,
+                                 index_path=str(tmp_path / 'index.db'))
+    try:
+        assert classifier.caption_prompt == DEFAULT_CAPTION_PROMPT
+        assert classifier.build_messages('data:', classifier.caption_prompt)[0]['content'] == DEFAULT_CAPTION_PROMPT
+    finally:
+        classifier.close()
@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+from request_hedger import RequestHedger
+
+
+@pytest.fixture
+def hedger():
+    hedger = RequestHedger(budget=1.0, min_samples=5)
+    hedger.attempt_latencies.extend([0.05] * 5)
+    yield hedger
+    hedger.shutdown()
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_aborted_primary_latency_is_recorded(hedger):
+    calls = []
+
+    def attempt(token, timeout):
+        calls.append(token)
+        if len(calls) == 1:
+            # 慢的原请求，被取消时中止
+            token.wait(1.0)
+            token.raise_if_cancelled()
+        return 'ok'
+
+    assert hedger.run(attempt) == 'ok'
+
+    assert wait_for(lambda: len(hedger.attempt_latencies) == 7)
+    assert hedger.stats()['hedge_wins'] == 1
+    assert hedger.stats()['aborted_losers'] == 1
+    # 被中止的原请求按中止前已等待的时间记录，不短于对冲延迟
+    assert max(list(hedger.attempt_latencies)[5:]) >= 0.05
+
+
+def test_losing_hedge_latency_is_recorded(hedger):
+    calls = []
+
+    def attempt(token, timeout):
+        calls.append(token)
+        if len(calls) == 1:
+            time.sleep(0.08)
+            return 'primary'
+        # 无法中止的对冲请求（如非流式请求）
+        time.sleep(0.2)
+        return 'hedge'
+
+    assert hedger.run(attempt) == 'primary'
+
+    assert wait_for(lambda: len(hedger.attempt_latencies) == 7)
+    assert max(hedger.attempt_latencies) >= 0.2
+    assert hedger.stats()['hedge_wins'] == 0
@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+
+import pytest
+
+from image_classifier import ImageClassifier
+
+CATEGORIES = ['二次元', '生活照片', '宠物', '工作', '表情包']
+
+
+@pytest.fixture
+def classifier(tmp_path):
+    classifier = ImageClassifier(api_base_url='http://127.0.0.1:9/v1', api_key='test', model_name='mock',
+                                 classification_prompt='分类', valid_categories=CATEGORIES,
+                                 index_path=str(tmp_path / 'index.db'))
+    yield classifier
+    classifier.close()
+
+
+class FakeStream:
+    """按块返回响应文本的流，记录被读取的块数；usage不为None时最后返回只含用量的数据块"""
+    def __init__(self, deltas, usage=None):
+        self.deltas = deltas
+        self.usage = usage
+        self.consumed = 0
+        self.closed = False
+
+    def __iter__(self):
+        for delta in self.deltas:
+            self.consumed += 1
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))], usage=None)
+        if self.usage is not None:
+            yield SimpleNamespace(choices=[], usage=self.usage)
+
+    def close(self):
+        self.closed = True
+
+
+def fake_client(stream):
+    create = lambda **kwargs: stream
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+@pytest.mark.parametrize('deltas, expected, consumed', [
+    # 中文回复没有空白，在标点处即可确定类别
+    (['宠', '物', '。', '这张图片', '展示了', '一只猫'], '宠物', 3),
+    (['工作', '，', '会议', '记录'], '工作', 2),
+    # 最高优先级的类别无需等到词结束
+    (['动漫', '插画', '风格'], '二次元', 1),
+    (['A cat', ' sleeping', ' on a sofa'], '宠物', 2),
+    # 词未结束前后续文本仍可能改变结果
+    (['宠物', '动漫'], '二次元', 2),
+    (['这是', '风景'], '生活照片', 2),
+])
+def test_streaming_stops_once_category_is_determined(classifier, deltas, expected, consumed):
+    stream = FakeStream(deltas)
+
+    text, category = classifier.request_streaming_category(fake_client(stream), 'mock', [])
+
+    assert category == expected
+    assert stream.consumed == consumed
+    assert stream.closed
+    assert text == ''.join(deltas[:consumed])
+    # 与对完整回复的判定一致
+    assert classifier.get_closest_category(''.join(deltas)) == expected
+
+
+def test_usage_is_recorded_when_stream_completes(classifier):
+    usage = SimpleNamespace(prompt_tokens=120, completion_tokens=3, prompt_tokens_details=None)
+    stream = FakeStream(['宠物'], usage)
+
+    assert classifier.request_streaming_category(fake_client(stream), 'mock', [])[1] == '宠物'
+
+    tokens = classifier.stats.snapshot()['tokens']
+    assert (tokens['requests'], tokens['prompt'], tokens['completion']) == (1, 120, 3)
+
+
+def test_token_budget_disables_streaming(tmp_path, monkeypatch):
+    monkeypatch.setenv('BUDGET_TOKENS', '1000')
+    monkeypatch.setenv('BUDGET_PERIOD', 'run')
+    classifier = ImageClassifier(api_base_url='http://127.0.0.1:9/v1', api_key='test', model_name='mock',
+                                 classification_prompt='分类', valid_categories=CATEGORIES, use_stream=True)
+    try:
+        # 提前中止的流没有用量，预算无法计数
+        assert not classifier.use_stream
+    finally:
+        classifier.close()
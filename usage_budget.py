@@ -0,0 +1,190 @@
+import os
+import json
+import time
+from collections import deque
+from threading import Condition
+from cancellation import ClassificationCancelled
+
+PERIOD_FORMATS = {'day': '%Y-%m-%d', 'month': '%Y-%m'}
+
+
+class BudgetExceeded(ClassificationCancelled):
+    """预算已用尽，停止发送新的请求"""
+
+
+def usage_cost(prompt_tokens, completion_tokens, cached_tokens, input_price, output_price, cached_price):
+    """按每百万token单价计算费用，命中缓存的输入token按cached_price计价"""
+    uncached = max(prompt_tokens - cached_tokens, 0)
+    return (uncached * input_price + cached_tokens * cached_price + completion_tokens * output_price) / 1e6
+
+
+class UsageBudget:
+    """token、费用和每小时图片数预算
+
+    每张图片请求API前调用acquire()、结束后调用release()：已用量加上在途图片的预计用量（按已完成图片的平均值）
+    将超过预算时不再放行，抛出BudgetExceeded；用量超过slowdown比例后只允许一个在途图片，把超支限制在一张以内；
+    最近一小时的图片数达到images_per_hour时等待。period为day/month时用量持久化到state_path，跨运行累计。
+    """
+    def __init__(self, max_tokens=0, max_cost=0.0, images_per_hour=0, input_price=0.0, output_price=0.0,
+                 cached_price=None, slowdown=0.9, period='run', state_path=None):
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.images_per_hour = images_per_hour
+        self.input_price = input_price
+        self.output_price = output_price
+        self.cached_price = input_price if cached_price is None else cached_price
+        self.slowdown = slowdown
+        self.period = period if period in PERIOD_FORMATS else 'run'
+        self.state_path = state_path if self.period != 'run' else None
+        self.condition = Condition()
+        self.recent = deque()  # 最近一小时放行的时间
+        self.in_flight = 0
+        self.exhausted = None  # 预算用尽的原因
+        self.period_key = None
+        self.tokens = 0
+        self.cost_spent = 0.0
+        self.images = 0  # 本周期已完成的图片数
+        self._load()
+
+    @classmethod
+    def from_env(cls):
+        """按环境变量创建预算，没有配置任何预算时返回None"""
+        budget = cls(
+            max_tokens=int(os.getenv('BUDGET_TOKENS', '0')),
+            max_cost=float(os.getenv('BUDGET_COST', '0')),
+            images_per_hour=int(os.getenv('BUDGET_IMAGES_PER_HOUR', '0')),
+            input_price=float(os.getenv('PRICE_INPUT_PER_M', '0')),
+            output_price=float(os.getenv('PRICE_OUTPUT_PER_M', '0')),
+            cached_price=float(os.getenv('PRICE_CACHED_PER_M')) if os.getenv('PRICE_CACHED_PER_M') else None,
+            slowdown=float(os.getenv('BUDGET_SLOWDOWN', '0.9')),
+            period=os.getenv('BUDGET_PERIOD', 'run'),
+            state_path=os.getenv('BUDGET_STATE_PATH', 'budget_state.json')
+        )
+        return budget if budget.enabled else None
+
+    @property
+    def enabled(self):
+        return bool(self.max_tokens or self.max_cost or self.images_per_hour)
+
+    def cost(self, prompt_tokens, completion_tokens, cached_tokens=0):
+        return usage_cost(prompt_tokens, completion_tokens, cached_tokens,
+                          self.input_price, self.output_price, self.cached_price)
+
+    def _current_key(self):
+        if self.period == 'run':
+            return None
+        return time.strftime(PERIOD_FORMATS[self.period])
+
+    def _load(self):
+        self.period_key = self._current_key()
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except Exception as e:
+            print(f"读取预算状态时出错: {str(e)}")
+            return
+        if state.get('period') == self.period_key:
+            self.tokens = state.get('tokens', 0)
+            self.cost_spent = state.get('cost', 0.0)
+            self.images = state.get('images', 0)
+
+    def save(self):
+        """保存本周期的用量（period为run时不保存）"""
+        if not self.state_path:
+            return
+        with self.condition:
+            state = {'period': self.period_key, 'tokens': self.tokens, 'cost': self.cost_spent, 'images': self.images}
+        temp_path = f"{self.state_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.state_path)
+
+    def _roll_period(self):
+        key = self._current_key()
+        if key != self.period_key:
+            self.period_key = key
+            self.tokens = 0
+            self.cost_spent = 0.0
+            self.images = 0
+            self.exhausted = None
+
+    def record(self, prompt_tokens, completion_tokens, cached_tokens=0):
+        """记录一次请求的用量，返回本次费用"""
+        cost = self.cost(prompt_tokens, completion_tokens, cached_tokens)
+        with self.condition:
+            self.tokens += prompt_tokens + completion_tokens
+            self.cost_spent += cost
+            self.condition.notify_all()
+        return cost
+
+    def _over_budget(self, pending):
+        """已用量加上pending张图片的预计用量是否超过预算，返回原因或None"""
+        per_image_tokens = self.tokens / self.images if self.images else 0
+        per_image_cost = self.cost_spent / self.images if self.images else 0
+        if self.max_tokens and self.tokens + pending * per_image_tokens >= self.max_tokens:
+            return f"token预算 {self.max_tokens}"
+        if self.max_cost and self.cost_spent + pending * per_image_cost >= self.max_cost:
+            return f"费用预算 {self.max_cost:g}"
+        return None
+
+    def _near_limit(self):
+        return ((self.max_tokens and self.tokens >= self.slowdown * self.max_tokens) or
+                (self.max_cost and self.cost_spent >= self.slowdown * self.max_cost))
+
+    def acquire(self, token=None):
+        """为一张图片占用预算，预算用尽时抛出BudgetExceeded，需要限速时等待"""
+        with self.condition:
+            while True:
+                if token is not None:
+                    token.raise_if_cancelled()
+                self._roll_period()
+                if self.exhausted:
+                    raise BudgetExceeded(f"已达到{self.exhausted}")
+                wait = None
+                if self._over_budget(self.in_flight + 1):
+                    if not self.in_flight:
+                        self.exhausted = self._over_budget(1)
+                        raise BudgetExceeded(f"已达到{self.exhausted}")
+                    wait = 1.0  # 等在途图片完成后按实际用量重新判断
+                elif self._near_limit() and self.in_flight:
+                    wait = 1.0
+                elif self.images_per_hour:
+                    now = time.monotonic()
+                    while self.recent and now - self.recent[0] >= 3600:
+                        self.recent.popleft()
+                    if len(self.recent) >= self.images_per_hour:
+                        wait = min(3600 - (now - self.recent[0]), 1.0)
+                if wait is None:
+                    self.in_flight += 1
+                    self.recent.append(time.monotonic())
+                    return
+                self.condition.wait(wait)
+
+    def check(self, images):
+        """按已完成图片的平均用量估计再处理images张图片是否超出预算，返回原因或None（用于批处理提交前检查）"""
+        with self.condition:
+            self._roll_period()
+            return self.exhausted or self._over_budget(images)
+
+    def add_images(self, images):
+        """记录不经过acquire()完成的图片数（批处理结果）"""
+        with self.condition:
+            self.images += images
+            self.recent.extend([time.monotonic()] * images)
+
+    def release(self, completed=True):
+        """图片的请求结束（completed为False表示没有实际发出请求）"""
+        with self.condition:
+            self.in_flight -= 1
+            if completed:
+                self.images += 1
+            self.condition.notify_all()
+
+    def snapshot(self):
+        with self.condition:
+            return {
+                'period': self.period_key, 'tokens': self.tokens, 'cost': self.cost_spent,
+                'images': self.images, 'exhausted': self.exhausted,
+            }
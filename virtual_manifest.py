@@ -0,0 +1,92 @@
+import os
+import csv
+import json
+import importlib.util
+from threading import Lock
+
+MANIFEST_FIELDS = ('source_path', 'file_hash', 'file_size', 'category', 'model', 'latency', 'link_path',
+                   'classified_at')
+
+
+def manifest_format(path):
+    """按扩展名判断清单格式：.csv、.parquet，其余为JSONL"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        return 'csv'
+    if ext == '.parquet':
+        return 'parquet'
+    return 'jsonl'
+
+
+class ManifestWriter:
+    """虚拟整理模式的分类清单，每张图片一行（来源路径、哈希、类别、模型、耗时），不复制文件
+
+    JSONL和CSV逐行追加写入；Parquet不支持追加，在close()时与已有文件合并后一次写入（需要pyarrow）。
+    """
+    def __init__(self, path):
+        self.path = path
+        self.format = manifest_format(path)
+        self.lock = Lock()
+        self.rows = []
+        self.file = None
+        self.writer = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if self.format == 'parquet':
+            # 提前检查依赖，避免分类完成后才发现无法写入
+            if importlib.util.find_spec('pyarrow') is None:
+                raise ImportError("写入Parquet清单需要安装pyarrow")
+        elif self.format == 'csv':
+            new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+            self.file = open(path, 'a', newline='', encoding='utf-8')
+            self.writer = csv.DictWriter(self.file, fieldnames=MANIFEST_FIELDS)
+            if new_file:
+                self.writer.writeheader()
+        else:
+            self.file = open(path, 'a', encoding='utf-8')
+
+    def add(self, row):
+        """写入一条记录"""
+        row = {field: row.get(field) for field in MANIFEST_FIELDS}
+        with self.lock:
+            if self.format == 'parquet':
+                self.rows.append(row)
+            elif self.format == 'csv':
+                self.writer.writerow(row)
+                self.file.flush()
+            else:
+                self.file.write(json.dumps(row, ensure_ascii=False) + '\n')
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            if self.format == 'parquet' and self.rows:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                table = pa.Table.from_pylist(self.rows)
+                if os.path.exists(self.path):
+                    table = pa.concat_tables([pq.read_table(self.path), table], promote_options='default')
+                temp_path = f"{self.path}.tmp"
+                pq.write_table(table, temp_path)
+                os.replace(temp_path, self.path)
+                self.rows = []
+
+
+def read_manifest(path):
+    """读取清单，同一来源路径只保留最后一条记录，按首次出现的顺序返回记录列表"""
+    manifest = manifest_format(path)
+    if manifest == 'parquet':
+        import pyarrow.parquet as pq
+        rows = pq.read_table(path).to_pylist()
+    elif manifest == 'csv':
+        with open(path, 'r', newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    latest = {}
+    for row in rows:
+        latest[row['source_path']] = row
+    return list(latest.values())